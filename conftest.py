@@ -1,24 +1,36 @@
 # Detect the mode amd set default as appropriate
 
 
+import contextlib
 import os
+import shutil
+import sys
 from argparse import Namespace
 
 import pytest
 
+import envycontrol.utils
 from envycontrol import (BLACKLIST_PATH, EXTRA_XORG_90_PATH, EXTRA_XORG_PATH,
                          LIGHTDM_CONFIG_PATH, LIGHTDM_SCRIPT_PATH,
-                         MODESET_PATH, UDEV_INTEGRATED_PATH, UDEV_PM_PATH,
-                         XORG_PATH)
+                         MODESET_PATH, PREFIX, UDEV_INTEGRATED_PATH,
+                         UDEV_PM_PATH, XORG_PATH)
 from envycontrol.cacheconfig import CachedConfig
-from envycontrol.main import SUPPORTED_OPTIMUS_MODES
-from envycontrol.utils import get_current_mode
+from envycontrol.main import SUPPORTED_OPTIMUS_MODES, main
+from envycontrol.replay import set_replay_dir
+from envycontrol.utils import get_current_mode, set_require_root
 
 ROOT_MARK = 'root'
 SLOW_MARK = 'slow'
 CUSTOM_PYTEST_MARKS = [ROOT_MARK, SLOW_MARK]
 SUPPORTED_PYTEST_MARKS = [*SUPPORTED_OPTIMUS_MODES, *CUSTOM_PYTEST_MARKS]
 
+HARDWARE_FIXTURES_DIR = os.path.join(os.path.dirname(__file__), 'tests', 'fixtures', 'hardware')
+HARDWARE_FIXTURES = sorted(os.listdir(HARDWARE_FIXTURES_DIR))
+
+# what hardware.get_detector() probes with
+DETECTORS = ['find_nvidia_gpu_pci_bus', 'get_amd_igpu_name', 'get_display_manager', 'get_igpu_bus_pci_bus',
+             'get_igpu_vendor']
+
 curr_mode = None
 
 
@@ -105,3 +117,56 @@ def display_manager():
         read_cache()
     dm = cache_file_obj['metadata']['display_manager']
     return dm
+
+
+@pytest.fixture
+def scratch_root(tmp_path, monkeypatch) -> str:
+    '''Run in a throw-away copy of the sysroot tree'''
+    shutil.copytree(PREFIX, tmp_path / PREFIX, symlinks=True)
+    monkeypatch.chdir(tmp_path)
+    return str(tmp_path)
+
+
+@pytest.fixture
+def replay_hardware():
+    '''Point the detectors at one of tests/fixtures/hardware'''
+    def wrapper(name: str) -> None:
+        set_replay_dir(os.path.join(HARDWARE_FIXTURES_DIR, name))
+    yield wrapper
+    set_replay_dir(None)
+
+
+@contextlib.contextmanager
+def hermetic_switch():
+    '''Keep switches from needing root; services are managed offline under the scratch root'''
+    set_require_root(False)
+    try:
+        yield
+    finally:
+        set_require_root(True)
+
+
+@pytest.fixture
+def run_main(monkeypatch):
+    '''Call main() with argv as the command line, as any user'''
+    def wrapper(argv: list[str]) -> None:
+        monkeypatch.setattr(sys, 'argv', ['envycontrol', *argv])
+        with hermetic_switch():
+            main()
+    return wrapper
+
+
+def read_file(path: str) -> str | None:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def forbid_detection(monkeypatch) -> None:
+    def fail(*args, **kwargs):
+        raise AssertionError('unexpected detection')
+
+    for name in DETECTORS:
+        monkeypatch.setattr(envycontrol.utils, name, fail)
@@ -4,201 +4,36 @@ PREFIX = 'sysroot'
 
 # begin constants definition
 
+# generated file content is in envycontrol/templates/; see envycontrol.templatestore
+
 VERSION = '3.4.0'
 
 BLACKLIST_PATH = PREFIX + '/etc/modprobe.d/blacklist-nvidia.conf'
 
-BLACKLIST_CONTENT = '''# Automatically generated by EnvyControl
-
-blacklist nouveau
-blacklist nvidia
-blacklist nvidia_drm
-blacklist nvidia_uvm
-blacklist nvidia_modeset
-blacklist nvidia_current
-blacklist nvidia_current_drm
-blacklist nvidia_current_uvm
-blacklist nvidia_current_modeset
-alias nouveau off
-alias nvidia off
-alias nvidia_drm off
-alias nvidia_uvm off
-alias nvidia_modeset off
-alias nvidia_current off
-alias nvidia_current_drm off
-alias nvidia_current_uvm off
-alias nvidia_current_modeset off
-'''
-
 UDEV_INTEGRATED_PATH = PREFIX + '/lib/udev/rules.d/50-remove-nvidia.rules'
 
-UDEV_INTEGRATED = '''# Automatically generated by EnvyControl
-
-# Remove NVIDIA USB xHCI Host Controller devices, if present
-ACTION=="add", SUBSYSTEM=="pci", ATTR{vendor}=="0x10de", ATTR{class}=="0x0c0330", ATTR{power/control}="auto", ATTR{remove}="1"
-
-# Remove NVIDIA USB Type-C UCSI devices, if present
-ACTION=="add", SUBSYSTEM=="pci", ATTR{vendor}=="0x10de", ATTR{class}=="0x0c8000", ATTR{power/control}="auto", ATTR{remove}="1"
-
-# Remove NVIDIA Audio devices, if present
-ACTION=="add", SUBSYSTEM=="pci", ATTR{vendor}=="0x10de", ATTR{class}=="0x040300", ATTR{power/control}="auto", ATTR{remove}="1"
-
-# Remove NVIDIA VGA/3D controller devices
-ACTION=="add", SUBSYSTEM=="pci", ATTR{vendor}=="0x10de", ATTR{class}=="0x03[0-9]*", ATTR{power/control}="auto", ATTR{remove}="1"
-'''
-
 UDEV_PM_PATH = PREFIX + '/lib/udev/rules.d/80-nvidia-pm.rules'
 
-UDEV_PM_CONTENT = '''# Automatically generated by EnvyControl
-
-# Remove NVIDIA USB xHCI Host Controller devices, if present
-ACTION=="add", SUBSYSTEM=="pci", ATTR{vendor}=="0x10de", ATTR{class}=="0x0c0330", ATTR{remove}="1"
-
-# Remove NVIDIA USB Type-C UCSI devices, if present
-ACTION=="add", SUBSYSTEM=="pci", ATTR{vendor}=="0x10de", ATTR{class}=="0x0c8000", ATTR{remove}="1"
-
-# Remove NVIDIA Audio devices, if present
-ACTION=="add", SUBSYSTEM=="pci", ATTR{vendor}=="0x10de", ATTR{class}=="0x040300", ATTR{remove}="1"
-
-# Enable runtime PM for NVIDIA VGA/3D controller devices on driver bind
-ACTION=="bind", SUBSYSTEM=="pci", ATTR{vendor}=="0x10de", ATTR{class}=="0x030000", TEST=="power/control", ATTR{power/control}="auto"
-ACTION=="bind", SUBSYSTEM=="pci", ATTR{vendor}=="0x10de", ATTR{class}=="0x030200", TEST=="power/control", ATTR{power/control}="auto"
-
-# Disable runtime PM for NVIDIA VGA/3D controller devices on driver unbind
-ACTION=="unbind", SUBSYSTEM=="pci", ATTR{vendor}=="0x10de", ATTR{class}=="0x030000", TEST=="power/control", ATTR{power/control}="on"
-ACTION=="unbind", SUBSYSTEM=="pci", ATTR{vendor}=="0x10de", ATTR{class}=="0x030200", TEST=="power/control", ATTR{power/control}="on"
-'''
-
 XORG_PATH = PREFIX + '/etc/X11/xorg.conf'
 
-XORG_INTEL = '''# Automatically generated by EnvyControl
-
-Section "ServerLayout"
-    Identifier "layout"
-    Screen 0 "nvidia"
-    Inactive "intel"
-EndSection
-
-Section "Device"
-    Identifier "nvidia"
-    Driver "nvidia"
-    BusID "{}"
-EndSection
-
-Section "Screen"
-    Identifier "nvidia"
-    Device "nvidia"
-    Option "AllowEmptyInitialConfiguration"
-EndSection
-
-Section "Device"
-    Identifier "intel"
-    Driver "modesetting"
-EndSection
-
-Section "Screen"
-    Identifier "intel"
-    Device "intel"
-EndSection
-'''
-
-XORG_AMD = '''# Automatically generated by EnvyControl
-
-Section "ServerLayout"
-    Identifier "layout"
-    Screen 0 "nvidia"
-    Inactive "amdgpu"
-EndSection
-
-Section "Device"
-    Identifier "nvidia"
-    Driver "nvidia"
-    BusID "{}"
-EndSection
-
-Section "Screen"
-    Identifier "nvidia"
-    Device "nvidia"
-    Option "AllowEmptyInitialConfiguration"
-EndSection
-
-Section "Device"
-    Identifier "amdgpu"
-    Driver "amdgpu"
-EndSection
-
-Section "Screen"
-    Identifier "amd"
-    Device "amdgpu"
-EndSection
-'''
-
 EXTRA_XORG_PATH = PREFIX + '/etc/X11/xorg.conf.d/10-nvidia.conf'
 
-EXTRA_XORG_CONTENT = '''# Automatically generated by EnvyControl
-
-Section "OutputClass"
-    Identifier "nvidia"
-    MatchDriver "nvidia-drm"
-    Driver "nvidia"
-'''
-
 EXTRA_XORG_90_PATH = PREFIX + '/etc/X11/xorg.conf.d/90-nvidia.conf'
 
-FORCE_COMP = '    Option "ForceCompositionPipeline" "true"\n'
-
-COOLBITS = '    Option "Coolbits" "{}"\n'
-
 MODESET_PATH = PREFIX + '/etc/modprobe.d/nvidia.conf'
 
-MODESET_CONTENT = '''# Automatically generated by EnvyControl
-
-options nvidia-drm modeset=1
-options nvidia NVreg_UsePageAttributeTable=1 NVreg_InitializeSystemMemoryAllocations=0
-'''
-
-MODESET_CURRENT_CONTENT = '''# Automatically generated by EnvyControl
-
-options nvidia-current-drm modeset=1
-options nvidia-current NVreg_UsePageAttributeTable=1 NVreg_InitializeSystemMemoryAllocations=0
-'''
-
-MODESET_RTD3 = '''# Automatically generated by EnvyControl
-
-options nvidia-drm modeset=1
-options nvidia "NVreg_DynamicPowerManagement=0x0{}"
-options nvidia NVreg_UsePageAttributeTable=1 NVreg_InitializeSystemMemoryAllocations=0
-'''
-
-MODESET_CURRENT_RTD3 = '''# Automatically generated by EnvyControl
-
-options nvidia-current-drm modeset=1
-options nvidia-current "NVreg_DynamicPowerManagement=0x0{}"
-options nvidia-current NVreg_UsePageAttributeTable=1 NVreg_InitializeSystemMemoryAllocations=0
-'''
-
 SDDM_XSETUP_PATH = PREFIX + '/usr/share/sddm/scripts/Xsetup'
 
-SDDM_XSETUP_CONTENT = '''#!/bin/sh
-# Xsetup - run as root before the login dialog appears
-
-'''
-
 LIGHTDM_SCRIPT_PATH = PREFIX + '/etc/lightdm/nvidia.sh'
 
 LIGHTDM_CONFIG_PATH = PREFIX + '/etc/lightdm/lightdm.conf.d/20-nvidia.conf'
 
-LIGHTDM_CONFIG_CONTENT = '''# Automatically generated by EnvyControl
-
-[Seat:*]
-display-setup-script=/etc/lightdm/nvidia.sh
-'''
+# Note: Do NOT remove this in cleanup!
+CACHE_FILE_PATH = PREFIX + '/var/cache/envycontrol/cache.json'
 
-NVIDIA_XRANDR_SCRIPT = '''#!/bin/sh
-# Automatically generated by EnvyControl
+QUERY_SOCKET_PATH = PREFIX + '/run/envycontrol/query.sock'
 
-xrandr --setprovideroutputsource "{}" NVIDIA-0
-xrandr --auto
-'''
+# Note: Do NOT remove this in cleanup!
+JOURNAL_PATH = PREFIX + '/var/cache/envycontrol/journal.json'
 
 # end constants definition
@@ -0,0 +1,114 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+
+from envycontrol import PREFIX
+from envycontrol.staging import atomic_write
+from envycontrol.target import target_path
+
+# Note: Do NOT remove this in cleanup!
+BACKUP_STORE_DIR = PREFIX + '/var/cache/envycontrol/system'
+
+BACKUP_INDEX_VERSION = 1
+
+
+class BackupStore:
+    '''Content-addressed, gzip compressed copies of the system files EnvyControl modifies or deletes
+
+    Each content is stored once as objects/<sha256[:2]>/<sha256>.gz, readable with zcat. The index maps every
+    path to its original, the content before EnvyControl first touched it, and to the content it had right before
+    the latest change. The original is never replaced, so repeated switches can not lose it.
+    '''
+
+    def __init__(self, store_dir: str, read_only: bool = False) -> None:
+        self.store_dir = store_dir
+        self.index_path = os.path.join(store_dir, 'index.json')
+        self.index = self.load()
+        self.dirty = False
+        self.lock = threading.Lock()
+        # a read-only store keeps new contents in memory and never saves, e.g., while only planning a switch
+        self.read_only = read_only
+        self.unsaved = {}
+
+    def load(self) -> dict:
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+            if index.get('version') == BACKUP_INDEX_VERSION:
+                return index
+            logging.warning(f"Ignoring backup index {self.index_path} of version {index.get('version')}")
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logging.warning(f"Could not read backup index {self.index_path}: {e}")
+        # {'version': int, 'files': {path: {'original': sha256 | None, 'mode': int | None, 'latest': sha256}}}
+        return {'version': BACKUP_INDEX_VERSION, 'files': {}}
+
+    def get_object_path(self, digest: str) -> str:
+        return os.path.join(self.store_dir, 'objects', digest[:2], digest + '.gz')
+
+    def put(self, content: bytes) -> str:
+        '''Store content unless it already is; returns its sha256'''
+        digest = hashlib.sha256(content).hexdigest()
+        path = self.get_object_path(digest)
+        if self.read_only:
+            self.unsaved[digest] = content
+        elif not os.path.exists(path):
+            atomic_write(path, gzip.compress(content, mtime=0), 0o600)
+        return digest
+
+    def get(self, digest: str) -> bytes:
+        if digest in self.unsaved:
+            return self.unsaved[digest]
+        with open(self.get_object_path(digest), 'rb') as f:
+            return gzip.decompress(f.read())
+
+    def backup(self, path: str, content: bytes | None, mode: int | None) -> None:
+        '''path is about to be modified or deleted; content is None when it does not exist yet'''
+        digest = None if content is None else self.put(content)
+        with self.lock:
+            entry = self.index['files'].get(path)
+            if entry is None:
+                entry = self.index['files'][path] = {'original': digest, 'mode': mode}
+                logging.debug(f"Stored original of {path}: {digest or 'absent'}")
+                self.dirty = True
+            if digest is not None and entry.get('latest') != digest:
+                entry['latest'] = digest
+                self.dirty = True
+
+    def set_original(self, path: str, content: bytes, mode: int) -> None:
+        '''Adopt a backup made some other way as the original of path, unless one is known'''
+        with self.lock:
+            entry = self.index['files'].get(path)
+            if entry is not None and entry['original'] is not None:
+                return
+        digest = self.put(content)
+        with self.lock:
+            self.index['files'][path] = {**(entry or {}), 'original': digest, 'mode': mode}
+            self.dirty = True
+
+    def get_originals(self) -> list[tuple[str, bytes, int]]:
+        '''[(path, content, mode)] of the paths that existed before EnvyControl first touched them'''
+        originals = []
+        for path, entry in sorted(self.index['files'].items()):
+            if entry['original'] is None:
+                continue
+            try:
+                originals.append((path, self.get(entry['original']), entry['mode']))
+            except (OSError, ValueError) as e:
+                logging.error(f"Backup of {path} is not readable: {e}")
+        return originals
+
+    def save(self) -> None:
+        with self.lock:
+            if not self.dirty or self.read_only:
+                return
+            atomic_write(self.index_path, json.dumps(self.index, indent=4, sort_keys=True).encode('utf-8'))
+            self.dirty = False
+
+
+def get_backup_store(read_only: bool = False) -> BackupStore:
+    return BackupStore(target_path(BACKUP_STORE_DIR), read_only)
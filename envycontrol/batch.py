@@ -0,0 +1,139 @@
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from envycontrol import VERSION
+from envycontrol.replay import set_replay_dir
+from envycontrol.target import set_root_dir
+
+DEFAULT_JOBS = os.cpu_count() or 1
+
+
+@contextlib.contextmanager
+def captured_output(buffer):
+    '''Send stdout, stderr and log records of one root to buffer; pool workers are reused across roots'''
+    root = logging.getLogger()
+    handlers = root.handlers[:]
+    handler = logging.StreamHandler(buffer)
+    handler.setFormatter(logging.Formatter('%(levelname)s: %(message)s'))
+    root.handlers = [handler]
+    try:
+        with contextlib.redirect_stdout(buffer), contextlib.redirect_stderr(buffer):
+            yield
+    finally:
+        root.handlers = handlers
+
+
+def apply_root(root, argv):
+    '''Run `envycontrol argv` against root in this process; returns the result of root for the report'''
+    from envycontrol.main import main
+
+    buffer = io.StringIO()
+    exit_status = 0
+    start = time.perf_counter()
+    set_root_dir(root)
+    try:
+        with captured_output(buffer):
+            sys.argv = ['envycontrol', *argv]
+            main()
+    except SystemExit as e:
+        exit_status = e.code if isinstance(e.code, int) else int(e.code is not None)
+    except Exception as e:
+        buffer.write(f'ERROR: {type(e).__name__}: {e}\n')
+        exit_status = 1
+    finally:
+        set_root_dir(None)
+
+    return {
+        'root': root,
+        'exit_status': exit_status,
+        'elapsed_s': round(time.perf_counter() - start, 3),
+        'output': buffer.getvalue(),
+    }
+
+
+def run_batch(roots, argv, jobs=DEFAULT_JOBS, replay=None):
+    '''Apply argv to every root across a pool of jobs processes; results are in the order of roots'''
+    roots = [os.path.abspath(root) for root in roots]
+    with ProcessPoolExecutor(max_workers=max(1, min(jobs, len(roots))),
+                             initializer=set_replay_dir, initargs=(replay,)) as pool:
+        return list(pool.map(apply_root, roots, [argv] * len(roots)))
+
+
+def print_summary(results):
+    width = max(len(result['root']) for result in results)
+    for result in results:
+        state = 'ok' if result['exit_status'] == 0 else f"failed ({result['exit_status']})"
+        print(f"{result['root']:<{width}}  {state:<11}  {result['elapsed_s']:.2f}s")
+
+    failed = [result for result in results if result['exit_status'] != 0]
+    print(f'{len(results) - len(failed)} of {len(results)} root(s) switched')
+    for result in failed:
+        logging.error(f"{result['root']}:\n{result['output'].rstrip()}")
+
+
+def read_roots_file(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith('#')]
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(prog='envycontrol batch',
+                                     description='Apply a switch or profile to many roots, e.g., OS images, in parallel',
+                                     epilog='e.g., envycontrol batch --root img1 --root img2 -- --switch nvidia')
+    parser.add_argument('--root', type=str, metavar='DIR', action='append', default=[],
+                        help='Root to apply to; may be repeated')
+    parser.add_argument('--roots-from', type=str, metavar='FILE',
+                        help='Read the roots from FILE, one per line')
+    parser.add_argument('--jobs', type=int, metavar='N', default=DEFAULT_JOBS,
+                        help='Apply to up to N roots in parallel. Default: %(default)s')
+    parser.add_argument('--replay', type=str, metavar='DIR',
+                        help='Read hardware from a fixture made by `envycontrol capture` instead of this machine')
+    parser.add_argument('--report', type=str, metavar='FILE',
+                        help='Write the JSON report, including the output of every root, to FILE')
+    parser.add_argument('--verbose', default=False, action='store_true',
+                        help='Enable verbose mode')
+    parser.add_argument('command', nargs=argparse.REMAINDER,
+                        help='Options of envycontrol, e.g., --switch nvidia, or a verb, e.g., switch --profile NAME')
+    return parser
+
+
+def batch_main(argv):
+    '''envycontrol batch'''
+    parser = create_parser()
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(format='%(levelname)s: %(message)s')
+    if args.verbose:
+        logging.getLogger().setLevel(logging.DEBUG)
+
+    command = args.command[1:] if args.command[:1] == ['--'] else args.command
+    roots = args.root + (read_roots_file(args.roots_from) if args.roots_from else [])
+    if not roots or not command:
+        parser.error('needs at least one root and the envycontrol options to apply')
+    if '--root' in command:
+        parser.error('--root belongs before --')
+
+    results = run_batch(roots, command, args.jobs, args.replay)
+    print_summary(results)
+
+    if args.report:
+        report = {
+            'version': VERSION,
+            'created': datetime.now().isoformat(),
+            'argv': command,
+            'jobs': args.jobs,
+            'roots': results,
+        }
+        with open(args.report, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(report, indent=4) + '\n')
+
+    if any(result['exit_status'] != 0 for result in results):
+        sys.exit(1)
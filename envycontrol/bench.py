@@ -0,0 +1,249 @@
+import argparse
+import contextlib
+import fnmatch
+import io
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from envycontrol import PREFIX, VERSION
+from envycontrol.main import SUPPORTED_OPTIMUS_MODES
+from envycontrol.replay import set_replay_dir
+
+BENCH_SWITCH_OPTIONS = [
+    [],
+    ['--rtd3'],
+    ['--coolbits'],
+    ['--dm', 'sddm'],
+    ['--dm', 'lightdm'],
+]
+
+# the switch cases need an Nvidia GPU; without --live they read this fixture instead of the machine
+DEFAULT_BENCH_FIXTURE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tests', 'fixtures',
+                                     'hardware', 'intel_nvidia_sddm')
+
+DEFAULT_REPEAT = 20
+DEFAULT_WARMUP = 2
+DEFAULT_TOLERANCE = 0.25
+
+
+def get_bench_cases():
+    '''name -> envycontrol argv'''
+    cases = {
+        'query': ['--query'],
+        'cache-create': ['--cache-create'],
+        'cache-query': ['--cache-query'],
+    }
+    for mode in SUPPORTED_OPTIMUS_MODES:
+        for options in BENCH_SWITCH_OPTIONS:
+            name = ' '.join(['switch', mode, *options])
+            cases[name] = ['--switch', mode, *options]
+    return cases
+
+
+def percentile(sorted_values, pct):
+    '''Linear interpolation between closest ranks'''
+    if len(sorted_values) == 1:
+        return sorted_values[0]
+    rank = (len(sorted_values) - 1) * pct / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (rank - lower)
+
+
+def summarize(timings_ns):
+    values = sorted(ns / 1_000_000 for ns in timings_ns)
+    return {
+        'min_ms': values[0],
+        'mean_ms': sum(values) / len(values),
+        'p50_ms': percentile(values, 50),
+        'p90_ms': percentile(values, 90),
+        'p99_ms': percentile(values, 99),
+        'max_ms': values[-1],
+    }
+
+
+@contextlib.contextmanager
+def scratch_sysroot(sysroot):
+    '''Run inside a throw-away copy of the sysroot tree; PREFIX is relative to the working directory'''
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix='envycontrol-bench-') as scratch_dir:
+        shutil.copytree(sysroot, os.path.join(scratch_dir, PREFIX), symlinks=True)
+        os.chdir(scratch_dir)
+        try:
+            yield scratch_dir
+        finally:
+            os.chdir(cwd)
+
+
+@contextlib.contextmanager
+def quiet_logging():
+    '''Discard log records of the measured runs; levels stay as configured'''
+    root = logging.getLogger()
+    handlers = root.handlers[:]
+    root.handlers = [logging.NullHandler()]
+    try:
+        yield
+    finally:
+        root.handlers = handlers
+
+
+def run_once(argv):
+    '''Time one main() call; returns (elapsed_ns, error)'''
+    from envycontrol.main import main
+
+    error = None
+    saved_argv = sys.argv
+    sys.argv = ['envycontrol', *argv]
+    try:
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            start = time.perf_counter_ns()
+            try:
+                main()
+            except SystemExit as e:
+                if e.code:
+                    error = f'exit status {e.code}'
+            except Exception as e:
+                error = f'{type(e).__name__}: {e}'
+            elapsed = time.perf_counter_ns() - start
+    finally:
+        sys.argv = saved_argv
+    return elapsed, error
+
+
+def bench_case(argv, sysroot, repeat, warmup):
+    '''Statistics of repeat runs of argv; a case whose run fails is not timed, only marked invalid'''
+    timings = []
+    for i in range(warmup + repeat):
+        with scratch_sysroot(sysroot):
+            elapsed, error = run_once(argv)
+        if error:
+            return {'argv': argv, 'runs': len(timings), 'invalid': True, 'error': error}
+        if i >= warmup:
+            timings.append(elapsed)
+
+    return {'argv': argv, 'runs': repeat, **summarize(timings)}
+
+
+def run_bench(cases, sysroot=PREFIX, repeat=DEFAULT_REPEAT, warmup=DEFAULT_WARMUP):
+    sysroot = os.path.abspath(sysroot)
+
+    from envycontrol.utils import set_require_root
+
+    # switch cases only change the scratch copies; services are managed offline under them
+    results = {}
+    set_require_root(False)
+    try:
+        for name, argv in cases.items():
+            with quiet_logging():
+                results[name] = bench_case(argv, sysroot, repeat, warmup)
+            if results[name].get('invalid'):
+                logging.error(f"Case '{name}' failed: {results[name]['error']}")
+            else:
+                logging.debug(f"{name}: p50={results[name]['p50_ms']:.3f}ms")
+    finally:
+        set_require_root(True)
+
+    return {
+        'version': VERSION,
+        'python': sys.version.split()[0],
+        'created': datetime.now().isoformat(),
+        'repeat': repeat,
+        'warmup': warmup,
+        'cases': results,
+    }
+
+
+def find_regressions(report, baseline, tolerance=DEFAULT_TOLERANCE):
+    '''Cases whose p50 grew by more than tolerance compared to baseline'''
+    regressions = []
+    for name, result in report['cases'].items():
+        base = baseline.get('cases', {}).get(name)
+        if base is None or result.get('invalid') or base.get('invalid'):
+            continue
+        if result['p50_ms'] > base['p50_ms'] * (1 + tolerance):
+            regressions.append((name, base['p50_ms'], result['p50_ms']))
+    return regressions
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(prog='envycontrol bench',
+                                     description='Benchmark envycontrol operations against a scratch copy of the sysroot; '
+                                                 '`envycontrol bench power --help` measures battery drain')
+    parser.add_argument('--case', type=str, metavar='PATTERN', action='append',
+                        help='Only run cases matching PATTERN (fnmatch); may be repeated')
+    parser.add_argument('--list', action='store_true',
+                        help='List the available cases')
+    parser.add_argument('--repeat', type=int, metavar='N', default=DEFAULT_REPEAT,
+                        help='Measured runs per case. Default: %(default)s')
+    parser.add_argument('--warmup', type=int, metavar='N', default=DEFAULT_WARMUP,
+                        help='Unmeasured runs per case. Default: %(default)s')
+    parser.add_argument('--sysroot', type=str, metavar='DIR', default=PREFIX,
+                        help='Tree copied for every run. Default: %(default)s')
+    parser.add_argument('--replay', type=str, metavar='DIR', default=DEFAULT_BENCH_FIXTURE,
+                        help='Read hardware from a fixture made by `envycontrol capture`. Default: %(default)s')
+    parser.add_argument('--live', action='store_true',
+                        help='Read hardware from this machine instead of a fixture')
+    parser.add_argument('--output', type=str, metavar='FILE',
+                        help='Write the JSON report to FILE instead of stdout')
+    parser.add_argument('--baseline', type=str, metavar='FILE',
+                        help='Compare against a stored report and fail on regressions')
+    parser.add_argument('--tolerance', type=float, metavar='RATIO', default=DEFAULT_TOLERANCE,
+                        help='Allowed p50 growth over the baseline. Default: %(default)s')
+    parser.add_argument('--verbose', default=False, action='store_true',
+                        help='Enable verbose mode')
+    return parser
+
+
+def bench_main(argv):
+    '''envycontrol bench'''
+    if argv[:1] == ['power']:
+        from envycontrol.powerbench import power_bench_main
+        return power_bench_main(argv[1:])
+
+    args = create_parser().parse_args(argv)
+
+    logging.basicConfig(format='%(levelname)s: %(message)s')
+    if args.verbose:
+        logging.getLogger().setLevel(logging.DEBUG)
+
+    cases = get_bench_cases()
+    if args.case:
+        cases = {name: argv for name, argv in cases.items()
+                 if any(fnmatch.fnmatch(name, pattern) for pattern in args.case)}
+
+    if args.list:
+        for name in cases:
+            print(name)
+        return
+
+    if not args.live:
+        set_replay_dir(args.replay)
+
+    report = run_bench(cases, sysroot=args.sysroot, repeat=args.repeat, warmup=args.warmup)
+    report['hardware'] = 'live' if args.live else os.path.basename(os.path.normpath(args.replay))
+
+    content = json.dumps(report, indent=4)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(content + '\n')
+    else:
+        print(content)
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = find_regressions(report, baseline, args.tolerance)
+        for name, base_ms, ms in regressions:
+            logging.error(f"Regression in '{name}': p50 {base_ms:.3f}ms -> {ms:.3f}ms")
+        if regressions:
+            sys.exit(1)
+
+    # numbers of the other cases are still written, but the run does not pass
+    if any(result.get('invalid') for result in report['cases'].values()):
+        sys.exit(1)
@@ -1,61 +1,117 @@
 
+import logging
 import os
 from contextlib import contextmanager
 
-from envycontrol import PREFIX
-from envycontrol.utils import (get_amd_igpu_name, get_current_mode,
-                               get_display_manager, get_igpu_bus_pci_bus,
-                               get_igpu_vendor)
+from envycontrol import CACHE_FILE_PATH
+from envycontrol.query import get_current_mode, show_cache_file
+from envycontrol.target import target_path
 
-# Note: Do NOT remove this in cleanup!
-CACHE_FILE_PATH = PREFIX + '/var/cache/envycontrol/cache.json'
+# version 1 caches have no version field and no fingerprint
+CACHE_VERSION = 2
+
+
+def get_nvidia_gpu_pci_bus(probes=None):
+    # imported lazily to keep envycontrol.utils off the --query path
+    from envycontrol.hardware import NvidiaGpuNotFoundError
+    from envycontrol.utils import exit_without_nvidia_gpu, get_nvidia_gpu_pci_bus
+
+    try:
+        return get_nvidia_gpu_pci_bus(probes)
+    except NvidiaGpuNotFoundError as e:
+        exit_without_nvidia_gpu(e)
 
 
 class CachedConfig:
     '''Adapter for config from CACHE_FILE_PATH'''
 
     def __init__(self, app_args) -> None:
+        from envycontrol.probes import ProbeExecutor
+
         self.app_args = app_args
         self.current_mode = get_current_mode()
+        # shared with the switch, so a fact probed for the cache is not probed again
+        self.probes = ProbeExecutor()
 
     @contextmanager
     def adapter(self):
-        global get_nvidia_gpu_pci_bus
-        use_cache = os.path.exists(CACHE_FILE_PATH)
+        from envycontrol.hardware import HardwareContext
+
+        from envycontrol.timings import span
 
-        if use_cache:
-            self.read_cache_file()  # might not be in hybrid mode
+        with span('phase', 'cache'):
+            use_cache = os.path.exists(target_path(CACHE_FILE_PATH))
 
-            # rebind function to use cached value instead of detection
-            get_nvidia_gpu_pci_bus = self.get_nvidia_gpu_pci_bus
+            if use_cache:
+                self.read_cache_file()  # might not be in hybrid mode
 
-        if self.is_hybrid():  # recreate cache file when in hybrid mode
-            self.create_cache_file()
+            if self.is_hybrid():  # recreate cache file when in hybrid mode and the hardware changed
+                self.update_cache_file()
+
+        # the switch resolves hardware facts from the cache instead of detecting them
+        self.hardware = HardwareContext(getattr(self, 'obj', None), self.probes)
+        if self.is_hybrid():
+            # update_cache_file() just matched the cache to this machine
+            self.hardware.cache_is_current = True
 
         yield self  # back to main ...
 
-    def create_cache_file(self):
+    def update_cache_file(self):
+        from envycontrol.fingerprint import (get_fingerprint_changes,
+                                             get_hardware_fingerprint)
+
+        fingerprint = self.probes.probe('fingerprint', get_hardware_fingerprint).value
+        if hasattr(self, 'obj') and fingerprint is not None:
+            changes = get_fingerprint_changes(self.obj['fingerprint'], fingerprint)
+            if not changes:
+                logging.debug("Cache file is current, skipping detection")
+                return
+            logging.info(f"Recreating cache file: {', '.join(changes)} changed")
+
+        self.create_cache_file(fingerprint)
+
+    def create_cache_file(self, fingerprint=None):
         if not self.is_hybrid():
             raise ValueError('--cache-create requires that the system be in the hybrid Optimus mode')
 
-        self.nvidia_gpu_pci_bus = get_nvidia_gpu_pci_bus()
-        self.obj = self.create_cache_obj(self.nvidia_gpu_pci_bus)
+        # start every probe at once, so creating the cache takes as long as the slowest probe, not their sum
+        for name, func in self.get_probes(fingerprint).items():
+            self.probes.start(name, func)
+
+        self.nvidia_gpu_pci_bus = get_nvidia_gpu_pci_bus(self.probes)
+        self.obj = self.create_cache_obj(self.nvidia_gpu_pci_bus, fingerprint)
         self.write_cache_file()
 
-    def create_cache_obj(self, nvidia_gpu_pci_bus):
+    @staticmethod
+    def get_probes(fingerprint=None):
+        from envycontrol.fingerprint import get_hardware_fingerprint
+        from envycontrol.hardware import CACHED_FACTS, get_detector
+
+        probes = {name: get_detector(name) for name in CACHED_FACTS}
+        if fingerprint is None:
+            probes['fingerprint'] = get_hardware_fingerprint
+        return probes
+
+    def create_cache_obj(self, nvidia_gpu_pci_bus, fingerprint=None):
+        '''The cache of this machine; a fact whose probe failed or timed out is None, a fingerprint of None makes
+        the next run in hybrid mode recreate the cache'''
         from datetime import datetime
+
+        results = self.probes.run(self.get_probes(fingerprint))
         return {
+            'version': CACHE_VERSION,
+            'fingerprint': fingerprint or results['fingerprint'].value,
             'switch': {
                 'nvidia_gpu_pci_bus': nvidia_gpu_pci_bus
             },
             'metadata': {
                 'audit_iso_tmstmp': datetime.now().isoformat(),
                 'args': vars(self.app_args),
-                'amd_igpu_name': get_amd_igpu_name(),
+                'amd_igpu_name': results['amd_igpu_name'].value,
                 'current_mode': self.current_mode,
-                'display_manager': get_display_manager(),
-                'igpu_pci_bus': get_igpu_bus_pci_bus(),
-                'igpu_vendor': get_igpu_vendor(),
+                'display_manager': results['display_manager'].value,
+                'igpu_pci_bus': results['igpu_pci_bus'].value,
+                'igpu_vendor': results['igpu_vendor'].value,
             }
         }
 
@@ -70,15 +126,16 @@ class CachedConfig:
 
     @staticmethod
     def delete_cache_file():
-        os.remove(CACHE_FILE_PATH)
-        os.removedirs(os.path.dirname(CACHE_FILE_PATH))
+        cache_file_path = target_path(CACHE_FILE_PATH)
+        os.remove(cache_file_path)
+        try:
+            os.removedirs(os.path.dirname(cache_file_path))
+        except OSError:
+            pass  # the directory still holds the other caches
 
     def read_cache_file(self):
-        from json import loads
-        if os.path.exists(CACHE_FILE_PATH):
-            with open(CACHE_FILE_PATH, 'r', encoding='utf-8') as f:
-                content = f.read()
-            self.obj = loads(content)
+        if os.path.exists(target_path(CACHE_FILE_PATH)):
+            self.obj = load_cache_obj()
             self.nvidia_gpu_pci_bus = self.obj['switch']['nvidia_gpu_pci_bus']
         elif self.is_hybrid():
             self.nvidia_gpu_pci_bus = get_nvidia_gpu_pci_bus()
@@ -87,15 +144,36 @@ class CachedConfig:
 
     @staticmethod
     def show_cache_file():
-        content = f'ERROR: Could not read {CACHE_FILE_PATH}'
-        if os.path.exists(CACHE_FILE_PATH):
-            with open(CACHE_FILE_PATH, 'r', encoding='utf-8') as f:
-                content = f.read()
-        print(content)
+        show_cache_file()
 
     def write_cache_file(self):
-        from json import dump
-        os.makedirs(os.path.dirname(CACHE_FILE_PATH), exist_ok=True)
+        from json import dumps
+
+        from envycontrol.staging import atomic_write
+
+        # a crash never leaves a truncated cache behind
+        atomic_write(target_path(CACHE_FILE_PATH), dumps(self.obj, indent=4, sort_keys=False).encode('utf-8'))
+
+
+def load_cache_obj():
+    '''The cache as of CACHE_VERSION; None when there is none'''
+    from json import loads
+    try:
+        with open(target_path(CACHE_FILE_PATH), 'r', encoding='utf-8') as f:
+            content = f.read()
+    except FileNotFoundError:
+        return None
+    return migrate_cache_obj(loads(content))
+
+
+def migrate_cache_obj(obj):
+    '''Bring a cache read from disk up to CACHE_VERSION'''
+    version = obj.get('version', 1)
+    if version > CACHE_VERSION:
+        raise ValueError(f'Cache file version {version} is newer than this EnvyControl supports ({CACHE_VERSION})')
+
+    if version == 1:
+        # no fingerprint is known, so the cache is recreated the next time the system is in hybrid mode
+        obj = {'version': 2, 'fingerprint': None, **obj}
 
-        with open(CACHE_FILE_PATH, 'w', encoding='utf-8') as f:
-            dump(self.obj, fp=f, indent=4, sort_keys=False)
+    return obj
@@ -0,0 +1,229 @@
+import ctypes
+import json
+import logging
+import os
+import selectors
+import signal
+import socket
+import sys
+
+from envycontrol import (BLACKLIST_PATH, CACHE_FILE_PATH, MODESET_PATH,
+                         QUERY_SOCKET_PATH, UDEV_INTEGRATED_PATH, XORG_PATH)
+from envycontrol.query import ask_daemon, get_current_mode, read_cache_file
+from envycontrol.target import target_path
+
+# the answers of the daemon are derived from these files only
+WATCHED_PATHS = [
+    BLACKLIST_PATH,
+    UDEV_INTEGRATED_PATH,
+    XORG_PATH,
+    MODESET_PATH,
+    CACHE_FILE_PATH,
+]
+
+# inotify(7) events that can change whether or what a watched file is
+IN_MODIFY = 0x002
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+WATCH_MASK = (IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF |
+              IN_MOVE_SELF)
+
+REQUEST_MAX_SIZE = 256
+
+
+class Inotify:
+    '''The part of inotify(7) the daemon needs, through libc'''
+
+    def __init__(self) -> None:
+        self.libc = ctypes.CDLL(None, use_errno=True)
+        if not hasattr(self.libc, 'inotify_init1'):
+            raise OSError('inotify is not available on this system')
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, f'inotify_init1: {os.strerror(errno)}')
+
+    def add_watch(self, path):
+        if self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK) < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, f'inotify_add_watch {path}: {os.strerror(errno)}')
+
+    def drain(self):
+        '''Discard the queued events; True when there were any'''
+        drained = False
+        while True:
+            try:
+                if not os.read(self.fd, 65536):
+                    return drained
+            except BlockingIOError:
+                return drained
+            drained = True
+
+    def close(self):
+        os.close(self.fd)
+
+
+def get_watch_dir(path):
+    '''Nearest existing directory above path; its events tell when path appears or goes away'''
+    path = os.path.dirname(os.path.abspath(path))
+    while not os.path.isdir(path):
+        path = os.path.dirname(path)
+    return path
+
+
+def read_state():
+    from envycontrol.cacheconfig import load_cache_obj
+    from envycontrol.hardware import CACHED_FACTS
+
+    try:
+        cache = load_cache_obj()
+    except ValueError as e:
+        logging.warning(f"Could not read {target_path(CACHE_FILE_PATH)}: {e}")
+        cache = None
+
+    facts = {}
+    if cache:
+        facts = {name: cache.get(section, {}).get(key) for name, (section, key) in CACHED_FACTS.items()}
+
+    return {
+        'mode': get_current_mode(),
+        'facts': facts,
+        'metadata': (cache or {}).get('metadata'),
+        'cache': read_cache_file(),
+    }
+
+
+class QueryDaemon:
+    '''Answers queries from memory on a Unix socket; inotify tells when to evaluate again
+
+    Requests are one line: "mode" and "cache" are answered like `--query` and `--cache-query`, "state" as JSON.
+    '''
+
+    def __init__(self, socket_path=None) -> None:
+        self.socket_path = socket_path or target_path(QUERY_SOCKET_PATH)
+        self.inotify = Inotify()
+        self.state = None
+        self.selector = selectors.DefaultSelector()
+        self.wakeup_r, self.wakeup_w = os.pipe()
+        self.running = False
+
+    def watch(self):
+        # watches on directories that were removed are dropped by the kernel; re-adding is a no-op otherwise
+        for watch_dir in sorted({get_watch_dir(target_path(path)) for path in WATCHED_PATHS}):
+            self.inotify.add_watch(watch_dir)
+
+    def invalidate(self):
+        if self.inotify.drain():
+            logging.debug('Watched files changed')
+            self.state = None
+            self.watch()
+
+    def get_state(self):
+        # events are queued by the syscall that made the change, so draining first never answers stale
+        self.invalidate()
+        if self.state is None:
+            self.state = read_state()
+        return self.state
+
+    def answer(self, request):
+        state = self.get_state()
+        if request == 'mode':
+            return state['mode']
+        if request == 'cache':
+            return state['cache']
+        if request == 'state':
+            return json.dumps({key: value for key, value in state.items() if key != 'cache'}, indent=4)
+        return f'ERROR: unknown request {request!r}'
+
+    def bind(self):
+        os.makedirs(os.path.dirname(self.socket_path) or '.', exist_ok=True)
+        if os.path.exists(self.socket_path):
+            if ask_daemon('mode', self.socket_path) is not None:
+                raise OSError(f'Another daemon is listening on {self.socket_path}')
+            os.remove(self.socket_path)  # left behind by a daemon that did not shut down
+
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(self.socket_path)
+        os.chmod(self.socket_path, 0o666)  # querying does not need root
+        self.server.listen()
+
+    def serve(self, client):
+        with client:
+            client.settimeout(1)
+            try:
+                request = client.recv(REQUEST_MAX_SIZE).decode('utf-8').strip()
+                client.sendall(self.answer(request).encode('utf-8'))
+            except (OSError, UnicodeDecodeError) as e:
+                logging.debug(f'Dropped query: {e}')
+
+    def serve_forever(self):
+        self.bind()
+        self.watch()
+        self.selector.register(self.server, selectors.EVENT_READ)
+        self.selector.register(self.inotify.fd, selectors.EVENT_READ)
+        self.selector.register(self.wakeup_r, selectors.EVENT_READ)
+        logging.info(f'Answering queries on {self.socket_path}')
+
+        self.running = True
+        try:
+            while self.running:
+                for key, _ in self.selector.select():
+                    if key.fileobj is self.server:
+                        self.serve(self.server.accept()[0])
+                    elif key.fileobj == self.inotify.fd:
+                        self.invalidate()
+        finally:
+            self.close()
+
+    def shutdown(self):
+        if not self.running:
+            return
+        self.running = False
+        os.write(self.wakeup_w, b'\0')
+
+    def close(self):
+        self.selector.close()
+        self.server.close()
+        self.inotify.close()
+        os.close(self.wakeup_r)
+        os.close(self.wakeup_w)
+        try:
+            os.remove(self.socket_path)
+        except FileNotFoundError:
+            pass
+
+
+def daemon_main(argv):
+    '''envycontrol daemon'''
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='envycontrol daemon',
+                                     description='Answer `--query` and `--cache-query` from memory until stopped')
+    parser.add_argument('--socket', type=str, metavar='PATH', action='store', default=None,
+                        help=f'Unix socket to listen on. Default: {target_path(QUERY_SOCKET_PATH)}')
+    parser.add_argument('--verbose', default=False, action='store_true',
+                        help='Enable verbose mode')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(format='%(levelname)s: %(message)s')
+    if args.verbose:
+        logging.getLogger().setLevel(logging.DEBUG)
+
+    try:
+        daemon = QueryDaemon(args.socket)
+    except OSError as e:
+        logging.error(e)
+        sys.exit(1)
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: daemon.shutdown())
+    signal.signal(signal.SIGINT, lambda signum, frame: daemon.shutdown())
+    try:
+        daemon.serve_forever()
+    except OSError as e:
+        logging.error(e)
+        sys.exit(1)
@@ -0,0 +1,123 @@
+import logging
+import os
+import re
+from dataclasses import dataclass
+from functools import cache
+
+from envycontrol.pci import PciDevice, read_pci_device
+from envycontrol.replay import host_path
+
+SYSFS_DRM_PATH = '/sys/class/drm'
+
+# marketing names the amdgpu X driver reports, as 'DEVICE,\tREVISION,\tNAME' in hex
+AMDGPU_IDS_PATH = '/usr/share/libdrm/amdgpu.ids'
+AMDGPU_UNKNOWN_NAME = 'Unknown AMD Radeon GPU'
+
+# X picks the amdgpu DDX over modesetting for amdgpu cards when it is installed
+AMDGPU_DDX_PATHS = [
+    '/usr/lib/xorg/modules/drivers/amdgpu_drv.so',
+    '/usr/lib64/xorg/modules/drivers/amdgpu_drv.so',
+]
+
+MODESETTING_PROVIDER = 'modesetting'
+
+CARD_NAME_PATTERN = re.compile(r'card\d+')
+
+
+@dataclass(frozen=True, slots=True)
+class DrmCard:
+    '''One /sys/class/drm/cardN and the PCI device behind it'''
+
+    name: str  # e.g., card0
+    pci: PciDevice
+    revision: int | None = None
+    boot_vga: bool = False
+
+
+def read_drm_card(path: str) -> DrmCard:
+    # the device symlink leads to the PCI device in sysfs, or in the replay fixture
+    device_path = os.path.realpath(os.path.join(path, 'device'))
+
+    def read_optional(name):
+        try:
+            with open(os.path.join(device_path, name), 'r', encoding='utf-8') as f:
+                return int(f.read().strip(), 16)
+        except (OSError, ValueError):
+            return None
+
+    return DrmCard(
+        name=os.path.basename(path),
+        pci=read_pci_device(device_path),
+        revision=read_optional('revision'),
+        boot_vga=read_optional('boot_vga') == 1,
+    )
+
+
+def get_drm_cards(drm_path: str | None = None) -> tuple[DrmCard, ...]:
+    return scan_drm_cards(drm_path or host_path(SYSFS_DRM_PATH))
+
+
+@cache
+def scan_drm_cards(drm_path: str) -> tuple[DrmCard, ...]:
+    '''Walk drm_path once per process; connectors and render nodes are skipped'''
+    try:
+        names = sorted(name for name in os.listdir(drm_path) if CARD_NAME_PATTERN.fullmatch(name))
+    except OSError as e:
+        logging.warning(f"DRM cards are not available from '{drm_path}': {e}")
+        return ()
+
+    cards = []
+    for name in names:
+        try:
+            cards.append(read_drm_card(os.path.join(drm_path, name)))
+        except (OSError, ValueError) as e:
+            logging.debug(f"Skipping DRM card {name}: {e}")
+
+    logging.debug(f"Found {len(cards)} DRM cards in '{drm_path}'")
+    return tuple(cards)
+
+
+def get_vendor_card(vendor: int) -> DrmCard | None:
+    '''The card of vendor, preferring the one the firmware booted with'''
+    cards = [card for card in get_drm_cards() if card.pci.vendor == vendor]
+    cards.sort(key=lambda card: not card.boot_vga)
+    return cards[0] if cards else None
+
+
+@cache
+def read_amdgpu_ids(path: str) -> dict[tuple[int, int], str]:
+    ids = {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                fields = [field.strip() for field in line.split(',', 2)]
+                if len(fields) != 3 or line.startswith('#'):
+                    continue
+                try:
+                    ids[(int(fields[0], 16), int(fields[1], 16))] = fields[2]
+                except ValueError:
+                    continue
+    except OSError as e:
+        logging.debug(f"AMD GPU names are not available from '{path}': {e}")
+    return ids
+
+
+def get_amdgpu_marketing_name(card: DrmCard) -> str:
+    return read_amdgpu_ids(host_path(AMDGPU_IDS_PATH)).get((card.pci.device, card.revision), AMDGPU_UNKNOWN_NAME)
+
+
+def is_amdgpu_ddx_installed() -> bool:
+    return any(os.path.exists(host_path(path)) for path in AMDGPU_DDX_PATHS)
+
+
+def get_provider_name(card: DrmCard) -> str:
+    '''Name `xrandr --listproviders` shows for card, worked out without an X server'''
+    if card.pci.driver == 'amdgpu' and is_amdgpu_ddx_installed():
+        # the amdgpu DDX names its provider after the marketing name and the PCI address
+        return f'{get_amdgpu_marketing_name(card)} @ pci:{card.pci.address}'
+    return MODESETTING_PROVIDER
+
+
+def clear_caches() -> None:
+    scan_drm_cards.cache_clear()
+    read_amdgpu_ids.cache_clear()
@@ -0,0 +1,64 @@
+import os
+import re
+
+from envycontrol.pci import NVIDIA_VENDOR_ID, get_pci_devices
+from envycontrol.replay import host_path
+
+FINGERPRINT_VERSION = 2
+
+KERNEL_RELEASE_PATH = '/proc/sys/kernel/osrelease'
+NVIDIA_DRIVER_VERSION_PATH = '/proc/driver/nvidia/version'
+DISPLAY_MANAGER_UNIT_PATH = '/etc/systemd/system/display-manager.service'
+
+
+def read_first_line(path):
+    try:
+        with open(host_path(path), 'r', encoding='utf-8') as f:
+            return f.readline().strip()
+    except OSError:
+        return None
+
+
+def get_nvidia_driver_version():
+    '''Version of the loaded Nvidia kernel module; None when it is not loaded, e.g., in integrated mode'''
+    line = read_first_line(NVIDIA_DRIVER_VERSION_PATH)
+    if line is None:
+        return None
+    match = re.search(r'Kernel Module\s+(\S+)', line)
+    return match.group(1) if match else line
+
+
+def get_hardware_fingerprint():
+    '''Cheap summary of the inputs a switch is derived from; no process is spawned'''
+    try:
+        dm_unit_mtime_ns = os.stat(host_path(DISPLAY_MANAGER_UNIT_PATH)).st_mtime_ns
+    except OSError:
+        dm_unit_mtime_ns = None
+
+    devices = get_pci_devices()
+    nvidia = [f'{d.address} {d.vendor:04x}:{d.device:04x}' for d in devices if d.vendor == NVIDIA_VENDOR_ID]
+    return {
+        'version': FINGERPRINT_VERSION,
+        'pci': [f'{d.vendor:04x}:{d.device:04x}' for d in devices if d.vendor != NVIDIA_VENDOR_ID],
+        # integrated mode removes the Nvidia functions from the bus; None then, so a replaced or moved dGPU is
+        # noticed whenever it is visible
+        'nvidia_pci': nvidia or None,
+        'kernel': read_first_line(KERNEL_RELEASE_PATH),
+        'nvidia_driver': get_nvidia_driver_version(),
+        'dm_unit_mtime_ns': dm_unit_mtime_ns,
+    }
+
+
+def get_fingerprint_changes(stored, current):
+    '''Names of the fingerprint fields that differ; the driver and the Nvidia functions only count when they are
+    present in both'''
+    if stored is None or stored.get('version') != current['version']:
+        return ['version']
+
+    changes = []
+    for key, value in current.items():
+        if key in ['nvidia_driver', 'nvidia_pci'] and (value is None or stored.get(key) is None):
+            continue
+        if stored.get(key) != value:
+            changes.append(key)
+    return changes
@@ -0,0 +1,62 @@
+import bisect
+
+# Nvidia architectures, oldest first
+NVIDIA_ARCHITECTURES = ['tesla', 'fermi', 'kepler', 'maxwell', 'pascal', 'volta', 'turing', 'ampere', 'hopper', 'ada',
+                        'blackwell']
+
+# (first device ID, last device ID, architecture) of the display functions; sorted, not overlapping
+NVIDIA_DEVICE_RANGES = [
+    (0x0190, 0x01df, 'tesla'),      # G80
+    (0x0400, 0x05ff, 'tesla'),      # G84, G86, GT200
+    (0x0600, 0x06bf, 'tesla'),      # G92, G94, G96
+    (0x06c0, 0x06df, 'fermi'),      # GF100
+    (0x06e0, 0x06ff, 'tesla'),      # G98
+    (0x0840, 0x0a7f, 'tesla'),      # MCP7x, GT21x
+    (0x0ca0, 0x0cbf, 'tesla'),      # GT215
+    (0x0dc0, 0x0dff, 'fermi'),      # GF106, GF108
+    (0x0e20, 0x0e3f, 'fermi'),      # GF104
+    (0x0fc0, 0x0fff, 'kepler'),     # GK107
+    (0x1000, 0x103f, 'kepler'),     # GK110
+    (0x1040, 0x10ff, 'fermi'),      # GF110, GF119
+    (0x1140, 0x117f, 'fermi'),      # GF117
+    (0x1180, 0x11ff, 'kepler'),     # GK104, GK106
+    (0x1200, 0x127f, 'fermi'),      # GF114, GF116
+    (0x1280, 0x12ff, 'kepler'),     # GK208
+    (0x1340, 0x13ff, 'maxwell'),    # GM107, GM108, GM204
+    (0x1400, 0x143f, 'maxwell'),    # GM206
+    (0x15f0, 0x15ff, 'pascal'),     # GP100
+    (0x1617, 0x167f, 'maxwell'),    # GM204M
+    (0x17c0, 0x17ff, 'maxwell'),    # GM200
+    (0x1b00, 0x1d7f, 'pascal'),     # GP102, GP104, GP106, GP107, GP108
+    (0x1d80, 0x1dff, 'volta'),      # GV100
+    (0x1e00, 0x1fff, 'turing'),     # TU102, TU104, TU106, TU117
+    (0x2080, 0x20ff, 'ampere'),     # GA100
+    (0x2180, 0x21ff, 'turing'),     # TU116
+    (0x2200, 0x22ff, 'ampere'),     # GA102
+    (0x2300, 0x233f, 'hopper'),     # GH100
+    (0x2400, 0x25ff, 'ampere'),     # GA103, GA104, GA106, GA107
+    (0x2600, 0x28ff, 'ada'),        # AD102, AD103, AD104, AD106, AD107
+    (0x2900, 0x2fff, 'blackwell'),  # GB100, GB202, GB203, GB205, GB206, GB207
+]
+
+NVIDIA_DEVICE_RANGE_STARTS = [first for first, _, _ in NVIDIA_DEVICE_RANGES]
+
+# runtime D3 power management of the dGPU, i.e., --rtd3, needs Turing or newer
+RTD3_MIN_ARCHITECTURE = 'turing'
+
+
+def get_nvidia_architecture(device):
+    '''Architecture of the Nvidia GPU with PCI device ID device; None when the ID is not in the table'''
+    i = bisect.bisect_right(NVIDIA_DEVICE_RANGE_STARTS, device) - 1
+    if i < 0:
+        return None
+    first, last, architecture = NVIDIA_DEVICE_RANGES[i]
+    return architecture if first <= device <= last else None
+
+
+def is_at_least(architecture, min_architecture):
+    return NVIDIA_ARCHITECTURES.index(architecture) >= NVIDIA_ARCHITECTURES.index(min_architecture)
+
+
+def supports_rtd3(architecture):
+    return is_at_least(architecture, RTD3_MIN_ARCHITECTURE)
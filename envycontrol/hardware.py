@@ -0,0 +1,102 @@
+import logging
+import threading
+
+from envycontrol.probes import ProbeExecutor
+
+# where each fact lives in cache.json
+CACHED_FACTS = {
+    'nvidia_gpu_pci_bus': ('switch', 'nvidia_gpu_pci_bus'),
+    'amd_igpu_name': ('metadata', 'amd_igpu_name'),
+    'display_manager': ('metadata', 'display_manager'),
+    'igpu_pci_bus': ('metadata', 'igpu_pci_bus'),
+    'igpu_vendor': ('metadata', 'igpu_vendor'),
+}
+
+
+def get_detector(name):
+    # imported lazily; envycontrol.utils imports this module
+    from envycontrol import utils
+
+    return {
+        'nvidia_gpu_pci_bus': utils.find_nvidia_gpu_pci_bus,
+        'amd_igpu_name': utils.get_amd_igpu_name,
+        'display_manager': utils.get_display_manager,
+        'igpu_pci_bus': utils.get_igpu_bus_pci_bus,
+        'igpu_vendor': utils.get_igpu_vendor,
+        'nvidia_architecture': utils.find_nvidia_architecture,
+    }[name]
+
+
+class NvidiaGpuNotFoundError(Exception):
+    '''The Nvidia GPU is neither on the bus nor in the cache'''
+
+    def __init__(self) -> None:
+        super().__init__('Could not find Nvidia GPU')
+
+
+class HardwareContext:
+    '''Hardware facts of one invocation; each fact is taken from an option, the cache or a live probe, once
+
+    Cached facts are only trusted while the hardware fingerprint of the cache matches this machine. The Nvidia
+    bus is the exception: the cached value is what lets a switch work while the GPU is off the bus. Live probes run
+    on probes, so a probe that hangs or fails leaves its fact unknown.
+    '''
+
+    def __init__(self, cache=None, probes=None) -> None:
+        self.cache = cache
+        self.probes = probes or ProbeExecutor()
+        self.facts = {}
+        self.sources = {}
+        self.cache_is_current = None
+        self.lock = threading.Lock()
+
+    def set(self, name, value, source='option'):
+        with self.lock:
+            self.facts[name] = value
+            self.sources[name] = source
+        logging.info(f"{name}: {value} ({source})")
+
+    def get(self, name):
+        with self.lock:
+            if name in self.facts:
+                return self.facts[name]
+
+        # probes of different facts run concurrently, so the lock is not held while probing
+        source = 'cached'
+        if self.is_cache_current() and name in CACHED_FACTS:
+            value = self.get_cached(name)
+        else:
+            source = 'live'
+            value = self.probes.probe(name, get_detector(name)).value
+
+            if value is None and name == 'nvidia_gpu_pci_bus':
+                value = self.get_cached(name)
+                if value is None:
+                    raise NvidiaGpuNotFoundError()
+                source = 'cached, not on the bus'
+
+        self.set(name, value, source)
+        return value
+
+    def get_cached(self, name):
+        section, key = CACHED_FACTS[name]
+        return (self.cache or {}).get(section, {}).get(key)
+
+    def is_cache_current(self):
+        if self.cache is None:
+            return False
+        if self.cache_is_current is None:
+            from envycontrol.fingerprint import (get_fingerprint_changes,
+                                                 get_hardware_fingerprint)
+
+            fingerprint = self.probes.probe('fingerprint', get_hardware_fingerprint).value
+            if fingerprint is None:
+                logging.info("Not using cached hardware facts: the fingerprint of this machine is unknown")
+                self.cache_is_current = False
+                return False
+
+            changes = get_fingerprint_changes(self.cache.get('fingerprint'), fingerprint)
+            if changes:
+                logging.info(f"Not using cached hardware facts: {', '.join(changes)} changed")
+            self.cache_is_current = not changes
+        return self.cache_is_current
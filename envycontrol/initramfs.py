@@ -0,0 +1,276 @@
+import hashlib
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from envycontrol import BLACKLIST_PATH, MODESET_PATH, PREFIX
+from envycontrol.probes import get_remaining_time
+from envycontrol.staging import atomic_write
+from envycontrol.target import target_path
+from envycontrol.timings import (TIMINGS_ENV, TIMINGS_FORMAT_ENV,
+                                 TIMINGS_PROFILE_ENV, span)
+
+# Note: Do NOT remove these in cleanup!
+INITRAMFS_MANIFEST_PATH = PREFIX + '/var/cache/envycontrol/initramfs.json'
+INITRAMFS_STATUS_DIR = PREFIX + '/var/cache/envycontrol/initramfs'
+
+KERNEL_MODULES_PATH = '/lib/modules'
+
+# files managed by EnvyControl that end up in the initramfs
+INITRAMFS_INPUT_PATHS = [
+    BLACKLIST_PATH,
+    MODESET_PATH,
+]
+
+
+def hash_initramfs_inputs():
+    digest = hashlib.sha256()
+    for path in INITRAMFS_INPUT_PATHS:
+        digest.update(path.encode('utf-8') + b'\0')
+        try:
+            with open(target_path(path), mode='rb') as f:
+                digest.update(hashlib.sha256(f.read()).digest())
+        except FileNotFoundError:
+            digest.update(b'absent')
+    return digest.hexdigest()
+
+
+def get_installed_kernels():
+    try:
+        return sorted(entry.name for entry in os.scandir(KERNEL_MODULES_PATH) if entry.is_dir())
+    except OSError:
+        return []
+
+
+def get_running_kernel():
+    return os.uname().release
+
+
+def read_initramfs_manifest():
+    try:
+        with open(target_path(INITRAMFS_MANIFEST_PATH), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+    manifest.setdefault('kernels', {})
+    return manifest
+
+
+def write_initramfs_manifest(manifest):
+    atomic_write(target_path(INITRAMFS_MANIFEST_PATH), json.dumps(manifest, indent=4, sort_keys=True).encode('utf-8'))
+
+
+def get_rebuild_commands(kernels=None):
+    '''Commands rebuilding the initramfs of kernels; None means every installed kernel'''
+    # Debian and Ubuntu derivatives
+    if os.path.exists('/etc/debian_version'):
+        if kernels is None:
+            return [['update-initramfs', '-u', '-k', 'all']]
+        return [['update-initramfs', '-u', '-k', kernel] for kernel in kernels]
+    # RHEL and SUSE derivatives
+    elif os.path.exists('/etc/redhat-release') or os.path.exists('/usr/bin/zypper'):
+        if kernels is None:
+            return [['dracut', '--force', '--regenerate-all']]
+        return [['dracut', '--force', '--kver', kernel] for kernel in kernels]
+    # EndeavourOS with dracut - dracut-rebuild can only regenerate everything
+    elif os.path.exists('/usr/lib/endeavouros-release') and os.path.exists('/usr/bin/dracut'):
+        return [['dracut-rebuild']]
+    return []
+
+
+def get_stale_kernels(kernels, inputs_hash, manifest):
+    return [kernel for kernel in kernels if manifest['kernels'].get(kernel) != inputs_hash]
+
+
+def get_status_path(kernel, suffix='.json'):
+    return os.path.join(target_path(INITRAMFS_STATUS_DIR), kernel + suffix)
+
+
+def write_kernel_status(kernel, **status):
+    status = {'kernel': kernel, 'pid': os.getpid(), **status}
+    atomic_write(get_status_path(kernel), json.dumps(status, indent=4).encode('utf-8'))
+
+
+def read_kernel_statuses():
+    '''Status of the last rebuild of every kernel, sorted by kernel'''
+    try:
+        names = sorted(name for name in os.listdir(target_path(INITRAMFS_STATUS_DIR)) if name.endswith('.json'))
+    except FileNotFoundError:
+        return []
+
+    statuses = []
+    for name in names:
+        try:
+            with open(get_status_path(name, suffix=''), 'r', encoding='utf-8') as f:
+                status = json.load(f)
+        except (OSError, ValueError):
+            continue
+        # the rebuilding process went away without recording an outcome
+        if status['state'] in ('queued', 'running') and not is_process_alive(status['pid']):
+            status['state'] = 'interrupted'
+        statuses.append(status)
+    return statuses
+
+
+def is_process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def run_command(command, log_path=None, timeout=None):
+    '''Run command with its output in log_path, on the terminal without one; returns the exit code, None when it
+    could not run or was killed
+
+    Inside a probe, the command is killed at the deadline of the probe unless timeout is given.
+    '''
+    timeout = timeout or get_remaining_time()
+    with span('command', ' '.join(command), argv=command) as event:
+        try:
+            if log_path is None:
+                p = subprocess.run(command, timeout=timeout)
+            else:
+                with open(log_path, 'wb') as log:
+                    p = subprocess.run(command, stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT,
+                                       timeout=timeout)
+            returncode = p.returncode
+        except subprocess.TimeoutExpired:
+            logging.error(f"Killed '{' '.join(command)}' after {timeout:g}s")
+            event['timed_out'] = True
+            returncode = None
+        except OSError as e:
+            logging.error(f"Failed to run '{' '.join(command)}': {e}")
+            returncode = None
+        event['exit_code'] = returncode
+    return returncode
+
+
+def run_rebuild_job(kernels, command):
+    '''Run one rebuild command for kernels; returns whether it succeeded'''
+    started = time.time()
+    for kernel in kernels:
+        write_kernel_status(kernel, state='running', command=command, started=started)
+
+    log_path = None if logging.getLogger().level == logging.DEBUG else get_status_path(kernels[0], '.log')
+    returncode = run_command(command, log_path)
+
+    state = 'succeeded' if returncode == 0 else 'failed'
+    for kernel in kernels:
+        write_kernel_status(kernel, state=state, command=command, started=started, finished=time.time(),
+                            returncode=returncode, log=log_path)
+    if state == 'failed':
+        logging.error(f"An error ocurred while rebuilding the initramfs for {', '.join(kernels)}" +
+                      (f"; see {log_path}" if log_path else ''))
+    return state == 'succeeded'
+
+
+def get_rebuild_jobs(stale, installed, jobs):
+    '''[(kernels, command)]; one job per kernel when running in parallel or when only some are stale'''
+    if jobs > 1 or set(stale) != set(installed):
+        commands = get_rebuild_commands(stale)
+        if len(commands) == len(stale):
+            return [([kernel], command) for kernel, command in zip(stale, commands)]
+        return [(stale, command) for command in commands]
+    return [(stale, command) for command in get_rebuild_commands(None)]
+
+
+def spawn_detached_rebuild(stale, running_kernel_only, force, jobs):
+    '''Rebuild in a new session that outlives this process; progress shows in `envycontrol status`'''
+    # the background process queues the stale kernels under its own pid once it starts
+    argv = [sys.executable, '-m', 'envycontrol', 'initramfs', '--jobs', str(jobs)]
+    if running_kernel_only:
+        argv += ['--kernel', 'running']
+    if force:
+        argv.append('--force')
+
+    package_parent = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = {name: value for name, value in os.environ.items()
+           if name not in (TIMINGS_ENV, TIMINGS_FORMAT_ENV, TIMINGS_PROFILE_ENV)}
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [package_parent, os.environ.get('PYTHONPATH')]))
+    try:
+        p = subprocess.Popen(argv, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                             start_new_session=True, env=env)
+    except OSError as e:
+        logging.error(f'Failed to start the initramfs rebuild in the background: {e}')
+        return
+    print(f'Rebuilding the initramfs in the background (pid {p.pid}); run `envycontrol status` for progress')
+
+
+def rebuild_initramfs(running_kernel_only=False, force=False, jobs=1, detach=False):
+    with span('phase', 'initramfs'):
+        rebuild_stale_initramfs(running_kernel_only, force, jobs, detach)
+
+
+def rebuild_stale_initramfs(running_kernel_only, force, jobs, detach):
+    installed = get_installed_kernels() or [get_running_kernel()]
+    targets = [get_running_kernel()] if running_kernel_only else installed
+
+    inputs_hash = hash_initramfs_inputs()
+    manifest = read_initramfs_manifest()
+    stale = targets if force else get_stale_kernels(targets, inputs_hash, manifest)
+
+    if not stale:
+        print('The initramfs is up to date, skipping rebuild')
+        return
+
+    logging.info(f"Stale initramfs for kernel(s): {', '.join(stale)}")
+    rebuild_jobs = get_rebuild_jobs(stale, installed, jobs)
+
+    if len(rebuild_jobs) != 0:
+        if detach:
+            spawn_detached_rebuild(stale, running_kernel_only, force, jobs)
+            return
+
+        for kernel in stale:
+            write_kernel_status(kernel, state='queued')
+
+        print('Rebuilding the initramfs...')
+        with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+            succeeded = list(executor.map(lambda job: run_rebuild_job(*job), rebuild_jobs))
+
+        rebuilt = [kernel for (kernels, _), ok in zip(rebuild_jobs, succeeded) if ok for kernel in kernels]
+        manifest['kernels'] = {kernel: digest for kernel, digest in manifest['kernels'].items() if kernel in installed}
+        manifest['kernels'].update({kernel: inputs_hash for kernel in rebuilt})
+        write_initramfs_manifest(manifest)
+
+        if all(succeeded):
+            print('Successfully rebuilt the initramfs!')
+        else:
+            logging.error("An error ocurred while rebuilding the initramfs")
+
+
+def initramfs_main(argv):
+    '''envycontrol initramfs'''
+    import argparse
+
+    from envycontrol.main import INITRAMFS_KERNELS
+
+    parser = argparse.ArgumentParser(prog='envycontrol initramfs',
+                                     description='Rebuild the initramfs of kernels whose inputs changed')
+    parser.add_argument('--kernel', type=str, metavar='KERNEL', choices=INITRAMFS_KERNELS, default='all',
+                        help='Available choices: %(choices)s. Default: %(default)s')
+    parser.add_argument('--jobs', type=int, metavar='N', default=1,
+                        help='Kernels rebuilt in parallel. Default: %(default)s')
+    parser.add_argument('--detach', action='store_true',
+                        help='Return right away and rebuild in the background')
+    parser.add_argument('--force', action='store_true',
+                        help='Rebuild even when the inputs did not change')
+    parser.add_argument('--verbose', default=False, action='store_true',
+                        help='Enable verbose mode')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(format='%(levelname)s: %(message)s')
+    if args.verbose:
+        logging.getLogger().setLevel(logging.DEBUG)
+
+    from envycontrol.utils import assert_root
+    assert_root()
+    rebuild_initramfs(running_kernel_only=args.kernel == 'running', force=args.force, jobs=args.jobs, detach=args.detach)
@@ -0,0 +1,155 @@
+import logging
+import os
+import re
+from abc import ABC, abstractmethod
+
+from envycontrol import PREFIX
+from envycontrol.target import target_path
+from envycontrol.timings import span
+
+NVIDIA_PERSISTENCED_SERVICE = 'nvidia-persistenced'
+
+
+class InitBackend(ABC):
+    '''Enables and disables services by managing files under root; never spawns the init system'''
+
+    name = None
+
+    def __init__(self, root=None) -> None:
+        self.root = target_path(PREFIX) if root is None else root
+
+    def root_path(self, path):
+        return self.root + path
+
+    @abstractmethod
+    def get_enable_links(self, service):
+        '''[(link path, link target)] that make service enabled; paths are relative to root'''
+
+    def is_enabled(self, service):
+        links = self.get_enable_links(service)
+        return bool(links) and all(os.path.islink(self.root_path(link)) for link, _ in links)
+
+    def set_enabled(self, service, enabled):
+        '''Returns whether anything changed; no-op when service is already in the requested state'''
+        links = self.get_enable_links(service)
+        if not links:
+            logging.warning(f"{service} has no installation config; nothing to {'enable' if enabled else 'disable'}")
+            return False
+
+        changed = False
+        for link, target in links:
+            path = self.root_path(link)
+            if enabled and not os.path.islink(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.symlink(target, path)
+                logging.info(f"Created symlink {path} -> {target}")
+                changed = True
+            elif not enabled and os.path.islink(path):
+                os.remove(path)
+                logging.info(f"Removed symlink {path}")
+                changed = True
+        return changed
+
+
+class SystemdBackend(InitBackend):
+    name = 'systemd'
+
+    UNIT_DIRS = ['/etc/systemd/system', '/usr/lib/systemd/system', '/lib/systemd/system']
+    CONFIG_DIR = '/etc/systemd/system'
+
+    def find_unit(self, unit):
+        for unit_dir in self.UNIT_DIRS:
+            unit_path = f'{unit_dir}/{unit}'
+            if os.path.isfile(self.root_path(unit_path)):
+                return unit_path
+        raise FileNotFoundError(f'Unit {unit} not found under {self.root or "/"}')
+
+    def read_install_section(self, unit_path):
+        '''{key: [values]} of the [Install] section'''
+        install = {}
+        section = None
+        with open(self.root_path(unit_path), 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if match := re.fullmatch(r'\[(.+)\]', line):
+                    section = match.group(1)
+                elif section == 'Install' and '=' in line and not line.startswith(('#', ';')):
+                    key, value = line.split('=', 1)
+                    install.setdefault(key.strip(), []).extend(value.split())
+        return install
+
+    def get_enable_links(self, service):
+        unit = f'{service}.service'
+        unit_path = self.find_unit(unit)
+        install = self.read_install_section(unit_path)
+
+        links = []
+        for target in install.get('WantedBy', []):
+            links.append((f'{self.CONFIG_DIR}/{target}.wants/{unit}', unit_path))
+        for target in install.get('RequiredBy', []):
+            links.append((f'{self.CONFIG_DIR}/{target}.requires/{unit}', unit_path))
+        for alias in install.get('Alias', []):
+            links.append((f'{self.CONFIG_DIR}/{alias}', unit_path))
+        return links
+
+
+class RunitBackend(InitBackend):
+    name = 'runit'
+
+    # Void Linux and Artix layouts
+    SERVICE_DIRS = ['/etc/sv', '/etc/runit/sv']
+    RUNSV_DIRS = ['/var/service', '/etc/runit/runsvdir/default']
+
+    def get_enable_links(self, service):
+        for service_dir in self.SERVICE_DIRS:
+            if os.path.isdir(self.root_path(f'{service_dir}/{service}')):
+                break
+        else:
+            raise FileNotFoundError(f'Service {service} not found under {self.root or "/"}')
+
+        runsv_dir = next((d for d in self.RUNSV_DIRS if os.path.isdir(self.root_path(d))), self.RUNSV_DIRS[0])
+        return [(f'{runsv_dir}/{service}', f'{service_dir}/{service}')]
+
+
+class DinitBackend(InitBackend):
+    name = 'dinit'
+
+    SERVICE_DIR = '/etc/dinit.d'
+    BOOT_DIR = '/etc/dinit.d/boot.d'
+
+    def get_enable_links(self, service):
+        if not os.path.isfile(self.root_path(f'{self.SERVICE_DIR}/{service}')):
+            raise FileNotFoundError(f'Service {service} not found under {self.root or "/"}')
+        return [(f'{self.BOOT_DIR}/{service}', f'../{service}')]
+
+
+INIT_BACKENDS = {backend.name: backend for backend in [SystemdBackend, RunitBackend, DinitBackend]}
+
+
+def get_init_backend(init='systemd', root=None):
+    return INIT_BACKENDS[init](root)
+
+
+def is_service_enabled(service, init='systemd'):
+    '''None when the init system has no installation config for service'''
+    try:
+        backend = get_init_backend(init)
+        return backend.is_enabled(service) if backend.get_enable_links(service) else None
+    except OSError:
+        return None
+
+
+def set_service_enabled(service, enabled, init='systemd'):
+    action = 'enabling' if enabled else 'disabling'
+    try:
+        with span('service', service, init=init, enabled=enabled) as event:
+            event['changed'] = changed = get_init_backend(init).set_enabled(service, enabled)
+    except OSError as e:
+        logging.error(f"An error ocurred while {action} service: {e}")
+        return
+
+    state = 'enabled' if enabled else 'disabled'
+    if changed:
+        print(f'Successfully {state} {service}.service')
+    else:
+        logging.info(f"{service}.service is already {state}")
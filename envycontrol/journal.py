@@ -0,0 +1,189 @@
+import json
+import logging
+import os
+import stat
+import sys
+from datetime import datetime
+
+from envycontrol import JOURNAL_PATH
+from envycontrol.backupstore import get_backup_store
+from envycontrol.staging import (EXECUTABLE_BITS, StagedChanges, atomic_write,
+                                 fsync_dir)
+from envycontrol.target import target_path
+
+JOURNAL_VERSION = 1
+
+# journal mode of --reset, which leaves no manifest behind
+RESET_MODE = 'reset'
+
+
+def read_file(path):
+    '''(content, mode) of path as it is on disk; (None, None) when it does not exist'''
+    try:
+        with open(target_path(path), 'rb') as f:
+            return f.read(), stat.S_IMODE(os.fstat(f.fileno()).st_mode)
+    except FileNotFoundError:
+        return None, None
+
+
+def is_pending(content, executable, current, current_mode):
+    if content != current:
+        return True
+    return content is not None and executable and (current_mode & EXECUTABLE_BITS) != EXECUTABLE_BITS
+
+
+def begin(changes, mode, services=()):
+    '''Record the staged changes that differ from disk and the services, with their state before and after, ahead of
+    applying them
+
+    The contents go to the backup store and the journal only refers to them by hash, so it stays small.
+    '''
+    from envycontrol.initsystem import is_service_enabled
+
+    store = changes.backups if changes.backups is not None else get_backup_store()
+
+    entries = []
+    object_dirs = set()
+    for path, (content, executable) in changes.changes.items():
+        current, current_mode = read_file(path)
+        if not is_pending(content, executable, current, current_mode):
+            continue
+
+        entry = {'path': path, 'content': None, 'executable': executable, 'before': None, 'before_mode': current_mode}
+        for key, value in [('content', content), ('before', current)]:
+            if value is not None:
+                entry[key] = store.put(value)
+                object_dirs.add(os.path.dirname(store.get_object_path(entry[key])))
+        entries.append(entry)
+
+    for dir_path in sorted(object_dirs):
+        fsync_dir(dir_path)
+
+    journal = {
+        'version': JOURNAL_VERSION,
+        'mode': mode,
+        'started': datetime.now().isoformat(),
+        'paths': list(changes.changes),
+        'changes': entries,
+        'services': [list(service) for service in services],
+        # None when the service has no installation config; left alone on roll back
+        'services_before': [is_service_enabled(service, init) for service, _, init in services],
+    }
+    journal_path = target_path(JOURNAL_PATH)
+    atomic_write(journal_path, json.dumps(journal, indent=4).encode('utf-8'))
+    fsync_dir(os.path.dirname(journal_path))
+
+
+def commit():
+    journal_path = target_path(JOURNAL_PATH)
+    try:
+        os.remove(journal_path)
+    except FileNotFoundError:
+        return
+    fsync_dir(os.path.dirname(journal_path))
+
+
+def apply_journaled(changes, mode, services=()):
+    '''Set services (service, enabled, init) and changes.apply() behind the journal, so an interrupted apply is
+    finished by recover(); returns the changed paths'''
+    from envycontrol.initsystem import set_service_enabled
+
+    begin(changes, mode, services)
+    for service in services:
+        set_service_enabled(*service)
+    changed = changes.apply()
+    commit()
+    return changed
+
+
+def read_journal():
+    try:
+        with open(target_path(JOURNAL_PATH), 'r', encoding='utf-8') as f:
+            journal = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        # atomic_write() never leaves a partial journal, so this one was not written by EnvyControl
+        logging.error(f"Ignoring unreadable journal {target_path(JOURNAL_PATH)}: {e}")
+        return None
+    if journal.get('version') != JOURNAL_VERSION:
+        logging.error(f"Ignoring journal {target_path(JOURNAL_PATH)} of version {journal.get('version')}")
+        return None
+    return journal
+
+
+def is_interrupted():
+    '''True when a switch did not finish; cheap enough for --query'''
+    return os.path.exists(target_path(JOURNAL_PATH))
+
+
+def stage_recovery(journal, store):
+    '''(direction, staged changes) that finish the switch, or undo it when a content it needs is gone'''
+    changes = StagedChanges(store)
+    try:
+        for entry in journal['changes']:
+            if entry['content'] is None:
+                changes.remove(entry['path'])
+            else:
+                changes.write(entry['path'], store.get(entry['content']).decode('utf-8'), entry['executable'])
+        return 'forward', changes
+    except (OSError, ValueError) as e:
+        logging.warning(f"Can not finish the interrupted switch: {e}")
+
+    changes = StagedChanges(store)
+    for entry in journal['changes']:
+        if entry['before'] is None:
+            changes.remove(entry['path'])
+        else:
+            changes.write(entry['path'], store.get(entry['before']).decode('utf-8'),
+                          bool(entry['before_mode'] & EXECUTABLE_BITS))
+    return 'back', changes
+
+
+def recover():
+    '''Finish or undo the switch an earlier run left unfinished, services included; only the files not yet changed
+    are touched
+
+    Returns True when there was one to recover.
+    '''
+    from envycontrol.initsystem import set_service_enabled
+    from envycontrol.manifest import remove_manifest, write_manifest
+
+    journal = read_journal()
+    if journal is None:
+        commit()  # drop an unreadable journal
+        return False
+
+    logging.warning(f"Recovering the switch to {journal['mode']} interrupted at {journal['started']}")
+    try:
+        direction, changes = stage_recovery(journal, get_backup_store())
+    except (OSError, ValueError) as e:
+        raise ValueError(f"Can not recover the interrupted switch to {journal['mode']}: {e}") from e
+
+    changed = changes.apply()
+
+    if direction == 'forward':
+        for service in journal['services']:
+            set_service_enabled(*service)
+        if journal['mode'] == RESET_MODE:
+            remove_manifest()
+        else:
+            write_manifest(journal['mode'], journal['paths'], journal['services'])
+    else:
+        for (service, _, init), enabled in zip(journal['services'], journal['services_before']):
+            if enabled is not None:
+                set_service_enabled(service, enabled, init)
+    commit()
+
+    print(f"Recovered the interrupted switch to {journal['mode']}: rolled {direction}, "
+          f"{len(changed)} of {len(journal['changes'])} file(s) were left to change")
+    return True
+
+
+def recover_interrupted_switch():
+    '''recover() before an operation that changes files; exits when the system can not be brought back'''
+    try:
+        return recover()
+    except ValueError as e:
+        logging.error(e)
+        sys.exit(1)
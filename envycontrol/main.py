@@ -1,26 +1,95 @@
 
-import argparse
-import logging
+import os
 import sys
 
-from envycontrol import SDDM_XSETUP_CONTENT, SDDM_XSETUP_PATH, VERSION
-from envycontrol.cacheconfig import CachedConfig
-from envycontrol.utils import (assert_root, cleanup, create_file,
-                               get_current_mode, graphics_mode_switcher,
-                               rebuild_initramfs)
+from envycontrol import VERSION
+
+# Note: keep module level imports cheap; they are paid by every `--query`
 
 SUPPORTED_OPTIMUS_MODES = ['integrated', 'hybrid', 'nvidia']
 SUPPORTED_DISPLAY_MANAGERS = ['gdm', 'gdm3', 'sddm', 'lightdm']
 RTD3_MODES = [0, 1, 2, 3]
+SUPPORTED_INIT_SYSTEMS = ['systemd', 'runit', 'dinit']
+INITRAMFS_KERNELS = ['all', 'running']
+
+# verbs are imported on first use and build their own parser from argv
+VERBS = {
+    'bench': 'envycontrol.bench:bench_main',
+    'capture': 'envycontrol.replay:capture_main',
+    'batch': 'envycontrol.batch:batch_main',
+    'daemon': 'envycontrol.daemon:daemon_main',
+    'initramfs': 'envycontrol.initramfs:initramfs_main',
+    'plan': 'envycontrol.plan:plan_main',
+    'query': 'envycontrol.query:query_main',
+    'status': 'envycontrol.status:status_main',
+    'switch': 'envycontrol.plan:switch_main',
+}
+
+# options answered without argparse when given on their own
+FAST_OPTIONS = {
+    '-q': 'envycontrol.query:print_current_mode',
+    '--query': 'envycontrol.query:print_current_mode',
+    '--cache-query': 'envycontrol.query:show_cache_file',
+    '--check': 'envycontrol.manifest:check_main',
+}
+
+
+def load_entry_point(spec):
+    module_name, func_name = spec.split(':')
+    return getattr(__import__(module_name, fromlist=[func_name]), func_name)
 
 
 def main():
+    argv = sys.argv[1:]
+
+    if os.environ.get('ENVYCONTROL_TIMINGS') or any(arg.startswith('--timings') for arg in argv):
+        timed_main(argv)
+        return
+
+    dispatch(argv)
+
+
+def timed_main(argv):
+    from envycontrol.timings import pop_timings_options, recording
+
+    try:
+        path, fmt, profile_path, argv = pop_timings_options(argv)
+    except ValueError as e:
+        print(f'envycontrol: error: {e}', file=sys.stderr)
+        sys.exit(2)
+    sys.argv = [sys.argv[0], *argv]
+
+    if path is None:
+        dispatch(argv)
+        return
+    with recording(path, argv, fmt, profile_path):
+        dispatch(argv)
+
+
+def dispatch(argv):
+    if argv and argv[0] in VERBS:
+        load_entry_point(VERBS[argv[0]])(argv[1:])
+        return
+
+    if len(argv) == 1 and argv[0] in FAST_OPTIONS:
+        load_entry_point(FAST_OPTIONS[argv[0]])()
+        return
+
+    legacy_main()
+
+
+def create_parser():
+    import argparse
+
     # define CLI arguments
     parser = argparse.ArgumentParser()
     parser.add_argument('-v', '--version', action='version', version=VERSION,
                         help='Output the current version')
     parser.add_argument('-q', '--query', action='store_true',
                         help='Query the current graphics mode')
+    parser.add_argument('--check', action='store_true',
+                        help='Check that the managed files and services still match the last switch; exits with 3 when '
+                             'they drifted and 4 when there was no switch yet')
     parser.add_argument('-s', '--switch', type=str, metavar='MODE', action='store', choices=SUPPORTED_OPTIMUS_MODES,
                         help='Switch the graphics mode. Available choices: %(choices)s')
     parser.add_argument('--dm', type=str, metavar='DISPLAY_MANAGER', action='store', choices=SUPPORTED_DISPLAY_MANAGERS,
@@ -31,20 +100,63 @@ def main():
                         help='Enable Coolbits on Nvidia mode. Default if specified: %(const)s')
     parser.add_argument('--rtd3', type=int, nargs='?', metavar='VALUE', action='store', choices=RTD3_MODES, const=2,
                         help='Setup PCI-Express Runtime D3 (RTD3) Power Management on Hybrid mode. Available choices: %(choices)s. Default if specified: %(const)s')
+    parser.add_argument('--init', type=str, metavar='INIT', action='store', choices=SUPPORTED_INIT_SYSTEMS, default='systemd',
+                        help='Init system whose services are enabled or disabled. Available choices: %(choices)s. '
+                             'Default: %(default)s')
     parser.add_argument('--use-nvidia-current', action='store_true',
                         help='Use nvidia-current instead of nvidia for kernel modules')
     parser.add_argument('--reset-sddm', action='store_true',
                         help='Restore default Xsetup file')
     parser.add_argument('--reset', action='store_true',
                         help='Revert changes made by EnvyControl')
+    parser.add_argument('--recover', action='store_true',
+                        help='Finish or undo a switch that was interrupted, e.g., by a power loss; switches and resets '
+                             'do this first on their own')
+    parser.add_argument('--initramfs-kernel', type=str, metavar='KERNEL', action='store', choices=INITRAMFS_KERNELS, default='all',
+                        help='Kernels whose initramfs is rebuilt when its inputs changed. Available choices: '
+                             '%(choices)s. Default: %(default)s')
+    parser.add_argument('--initramfs-jobs', type=int, metavar='N', action='store', default=1,
+                        help='Rebuild the initramfs of up to N kernels in parallel. Default: %(default)s')
+    parser.add_argument('--initramfs-detach', action='store_true',
+                        help='Rebuild the initramfs in the background; see `envycontrol status`')
     parser.add_argument('--cache-create', action='store_true',
                         help='Create cache used by EnvyControl; only works in hybrid mode')
     parser.add_argument('--cache-delete', action='store_true',
                         help='Delete cache created by EnvyControl')
     parser.add_argument('--cache-query', action='store_true',
                         help='Show cache created by EnvyControl')
+    parser.add_argument('--root', type=str, metavar='DIR', action='store',
+                        help='Manage the system installed under DIR, e.g., an OS image, instead of this one')
+    parser.add_argument('--replay', type=str, metavar='DIR', action='store',
+                        help='Read hardware from a fixture made by `envycontrol capture` instead of this machine')
     parser.add_argument('--verbose', default=False, action='store_true',
                         help='Enable verbose mode')
+    # taken out of argv by timed_main() for every verb; listed here for --help
+    parser.add_argument('--timings', type=str, metavar='FILE', action='store',
+                        help='Record the time of each phase, command and file operation to FILE; also ENVYCONTROL_TIMINGS')
+    parser.add_argument('--timings-format', type=str, metavar='FORMAT', action='store', choices=['json', 'trace'],
+                        default='json',
+                        help='json or a Chrome trace-event file. Available choices: %(choices)s. Default: %(default)s')
+    parser.add_argument('--timings-profile', type=str, metavar='FILE', action='store',
+                        help='Also write a cProfile dump of the Python side to FILE')
+    return parser
+
+
+def legacy_main():
+    import logging
+
+    from envycontrol import SDDM_XSETUP_PATH
+    from envycontrol.cacheconfig import CachedConfig
+    from envycontrol.initramfs import rebuild_initramfs
+    from envycontrol.journal import recover_interrupted_switch
+    from envycontrol.manifest import check_main, remove_manifest
+    from envycontrol.replay import set_replay_dir
+    from envycontrol.target import get_root_dir, set_root_dir
+    from envycontrol.templatestore import render_template
+    from envycontrol.utils import (assert_root, cleanup, create_file,
+                                   get_current_mode, graphics_mode_switcher)
+
+    parser = create_parser()
 
     # print help if no arg is provided
     if len(sys.argv) == 1:
@@ -60,10 +172,18 @@ def main():
     if args.verbose:
         logging.getLogger().setLevel(logging.DEBUG)
 
+    if args.root:
+        set_root_dir(args.root)
+
+    if args.replay:
+        set_replay_dir(args.replay)
+
     if args.query:
         mode = get_current_mode()
         print(mode)
         return
+    elif args.check:
+        check_main()
     elif args.cache_create:
         assert_root()
         CachedConfig(args).create_cache_file()
@@ -75,19 +195,33 @@ def main():
     elif args.cache_query:
         CachedConfig.show_cache_file()
         return
+    elif args.recover:
+        assert_root()
+        if not recover_interrupted_switch():
+            print('No interrupted switch to recover')
+        return
 
     if args.switch or args.reset_sddm or args.reset:
+        # finish what an interrupted run left half done before changing anything else
+        assert_root()
+        recover_interrupted_switch()
         with CachedConfig(args).adapter() as adapter:
             if args.switch:
                 assert_root()
-                graphics_mode_switcher(**vars(adapter.app_args))
+                graphics_mode_switcher(**vars(adapter.app_args), hw=adapter.hardware)
             elif args.reset_sddm:
                 assert_root()
-                create_file(SDDM_XSETUP_PATH, SDDM_XSETUP_CONTENT, True)
+                create_file(SDDM_XSETUP_PATH, render_template('sddm/Xsetup'), True)
                 print('Operation completed successfully')
             elif args.reset:
                 assert_root()
                 cleanup()
+                remove_manifest()
                 CachedConfig.delete_cache_file()
-                rebuild_initramfs()
+                if get_root_dir() is None:
+                    rebuild_initramfs(running_kernel_only=args.initramfs_kernel == 'running',
+                                      jobs=args.initramfs_jobs, detach=args.initramfs_detach)
+                else:
+                    # the rebuild commands work on the running system; images rebuild their own
+                    logging.info(f"Not rebuilding the initramfs of {get_root_dir()}")
                 print('Operation completed successfully')
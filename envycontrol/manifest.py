@@ -0,0 +1,120 @@
+import hashlib
+import json
+import os
+import stat
+import sys
+from datetime import datetime
+
+from envycontrol import PREFIX, VERSION
+from envycontrol.target import target_path
+
+# Note: keep this module cheap to import; it serves `--check`, which must not spawn anything
+
+# Note: Do NOT remove this in cleanup!
+MANIFEST_PATH = PREFIX + '/var/cache/envycontrol/manifest.json'
+
+MANIFEST_VERSION = 1
+
+CHECK_DRIFT_EXIT = 3
+CHECK_NO_MANIFEST_EXIT = 4
+
+
+def get_file_state(path):
+    '''{'sha256', 'mode'} of the file at path as it is on disk; None when it does not exist'''
+    try:
+        with open(target_path(path), 'rb') as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+            st = os.fstat(f.fileno())
+    except FileNotFoundError:
+        return None
+    return {'sha256': digest, 'mode': stat.S_IMODE(st.st_mode)}
+
+
+def get_service_state(service, enabled, init):
+    '''Links that make service enabled; [] when the init system has no installation config for it'''
+    from envycontrol.initsystem import get_init_backend
+
+    try:
+        links = get_init_backend(init).get_enable_links(service)
+    except OSError:
+        links = []
+    return {'service': service, 'enabled': enabled, 'init': init, 'links': [list(link) for link in links]}
+
+
+def write_manifest(mode, paths, services):
+    '''Record what the switch to mode left on disk; paths are the files it staged, services (service, enabled, init)'''
+    from envycontrol.staging import atomic_write
+
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'envycontrol': VERSION,
+        'mode': mode,
+        'created': datetime.now().isoformat(),
+        'files': {path: get_file_state(path) for path in paths},
+        'services': [get_service_state(*service) for service in services],
+    }
+    atomic_write(target_path(MANIFEST_PATH), json.dumps(manifest, indent=4).encode('utf-8'))
+
+
+def remove_manifest():
+    try:
+        os.remove(target_path(MANIFEST_PATH))
+    except FileNotFoundError:
+        pass
+
+
+def read_manifest():
+    try:
+        with open(target_path(MANIFEST_PATH), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return manifest if manifest.get('version') == MANIFEST_VERSION else None
+
+
+def get_drift(manifest):
+    '''[(kind, path or service, detail)] between the manifest and the disk; [] when in sync'''
+    drift = []
+    for path, expected in manifest['files'].items():
+        actual = get_file_state(path)
+        if expected is None and actual is not None:
+            drift.append(('unexpected', path, 'should not exist'))
+        elif expected is not None and actual is None:
+            drift.append(('missing', path, 'was removed'))
+        elif expected is not None and actual['sha256'] != expected['sha256']:
+            drift.append(('modified', path, 'content changed'))
+        elif expected is not None and actual['mode'] != expected['mode']:
+            drift.append(('mode', path, f"{expected['mode']:04o} -> {actual['mode']:04o}"))
+
+    root = target_path(PREFIX)
+    for service in manifest['services']:
+        for link, link_target in service['links']:
+            path = root + link
+            if service['enabled'] and (not os.path.islink(path) or os.readlink(path) != link_target):
+                drift.append(('service', service['service'], f'{link} should link to {link_target}'))
+            elif not service['enabled'] and os.path.islink(path):
+                drift.append(('service', service['service'], f'{link} should not exist'))
+    return drift
+
+
+def check():
+    '''Compare the disk with the manifest of the last switch; returns the exit status'''
+    manifest = read_manifest()
+    if manifest is None:
+        print(f'No manifest in {target_path(MANIFEST_PATH)}; switch once to create it')
+        return CHECK_NO_MANIFEST_EXIT
+
+    drift = get_drift(manifest)
+    if not drift:
+        print(f"In sync with {manifest['mode']} mode")
+        return 0
+
+    print(f"Drifted from {manifest['mode']} mode:")
+    for kind, name, detail in drift:
+        print(f'  {kind:<10}  {name}: {detail}')
+    return CHECK_DRIFT_EXIT
+
+
+def check_main():
+    '''envycontrol --check'''
+    sys.exit(check())
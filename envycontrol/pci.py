@@ -0,0 +1,105 @@
+import logging
+import os
+from dataclasses import dataclass
+from functools import cache
+
+from envycontrol.replay import host_path
+
+SYSFS_PCI_DEVICES_PATH = '/sys/bus/pci/devices'
+
+NVIDIA_VENDOR_ID = 0x10de
+INTEL_VENDOR_ID = 0x8086
+AMD_VENDOR_ID = 0x1002
+
+# PCI class codes are 0xBBSSPP - base class, subclass, programming interface
+PCI_BASE_CLASS_DISPLAY = 0x03
+PCI_SUBCLASS_VGA = 0x00
+PCI_SUBCLASS_3D = 0x02
+PCI_SUBCLASS_DISPLAY_OTHER = 0x80
+
+
+@dataclass(frozen=True, slots=True)
+class PciDevice:
+    '''One device from the sysfs PCI inventory'''
+
+    address: str  # e.g., 0000:01:00.0
+    vendor: int
+    device: int
+    pci_class: int
+    driver: str | None = None
+
+    @property
+    def base_class(self) -> int:
+        return self.pci_class >> 16
+
+    @property
+    def subclass(self) -> int:
+        return (self.pci_class >> 8) & 0xff
+
+    @property
+    def is_display(self) -> bool:
+        return self.base_class == PCI_BASE_CLASS_DISPLAY
+
+    @property
+    def is_vga_or_3d(self) -> bool:
+        '''lspci "VGA compatible controller" or "3D controller"'''
+        return self.is_display and self.subclass in (PCI_SUBCLASS_VGA, PCI_SUBCLASS_3D)
+
+    @property
+    def is_vga_or_display(self) -> bool:
+        '''lspci "VGA compatible controller" or "Display controller"'''
+        return self.is_display and self.subclass in (PCI_SUBCLASS_VGA, PCI_SUBCLASS_DISPLAY_OTHER)
+
+    @property
+    def bus_id(self) -> str:
+        '''BusID in the X.org 'PCI:bus:device:function' format (decimal)'''
+        bus, device_function = self.address.split(':')[-2:]
+        device, function = device_function.split('.')
+        return f'PCI:{int(bus, 16)}:{int(device, 16)}:{int(function, 16)}'
+
+
+def read_pci_device(path: str) -> PciDevice:
+    def read_hex(name):
+        with open(os.path.join(path, name), 'r', encoding='utf-8') as f:
+            return int(f.read().strip(), 16)
+
+    driver = None
+    driver_link = os.path.join(path, 'driver')
+    if os.path.islink(driver_link):
+        driver = os.path.basename(os.readlink(driver_link))
+
+    return PciDevice(
+        address=os.path.basename(path),
+        vendor=read_hex('vendor'),
+        device=read_hex('device'),
+        pci_class=read_hex('class'),
+        driver=driver,
+    )
+
+
+def get_pci_devices(devices_path: str | None = None) -> tuple[PciDevice, ...]:
+    return scan_pci_devices(devices_path or host_path(SYSFS_PCI_DEVICES_PATH))
+
+
+@cache
+def scan_pci_devices(devices_path: str) -> tuple[PciDevice, ...]:
+    '''Walk devices_path once per process; the snapshot is shared by every detector'''
+    try:
+        addresses = sorted(os.listdir(devices_path))
+    except OSError as e:
+        logging.warning(f"PCI inventory is not available from '{devices_path}': {e}")
+        return ()
+
+    devices = []
+    for address in addresses:
+        try:
+            devices.append(read_pci_device(os.path.join(devices_path, address)))
+        except (OSError, ValueError) as e:
+            logging.debug(f"Skipping PCI device {address}: {e}")
+
+    logging.debug(f"Found {len(devices)} PCI devices in '{devices_path}'")
+    return tuple(devices)
+
+
+def get_display_devices() -> tuple[PciDevice, ...]:
+    return tuple(d for d in get_pci_devices() if d.is_display)
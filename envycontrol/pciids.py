@@ -0,0 +1,184 @@
+import bisect
+import logging
+import mmap
+import os
+import struct
+from functools import cache
+
+from envycontrol import PREFIX
+from envycontrol.replay import host_path
+
+# where distributions install the PCI ID database, in the order searched
+PCI_IDS_PATHS = [
+    '/usr/share/hwdata/pci.ids',
+    '/usr/share/misc/pci.ids',
+    '/usr/share/pci.ids',
+]
+
+# Note: Do NOT remove this in cleanup!
+# it describes the pci.ids of this machine, so it stays here under --root
+PCI_IDS_INDEX_PATH = PREFIX + '/var/cache/envycontrol/pci.ids.idx'
+
+# header: magic, version, mtime and size of the pci.ids it was built from, number of records
+INDEX_HEADER = struct.Struct('<8sIqqI')
+INDEX_MAGIC = b'ECPCIIDX'
+INDEX_VERSION = 1
+
+# records are sorted by key, vendor << 16 | device, and point into the table of NUL terminated names after them
+INDEX_RECORD = struct.Struct('<II')
+
+# device of the record naming the vendor itself; 0xffff is not a valid device ID
+VENDOR_RECORD = 0xffff
+
+# pci.ids ends with the device classes, which are not indexed
+PCI_IDS_CLASSES_PREFIX = 'C '
+
+
+def parse_pci_ids(lines):
+    '''{vendor << 16 | device: name} of the vendors and devices in pci.ids; subsystems are skipped'''
+    names = {}
+    vendor = None
+    for line in lines:
+        if line.startswith(PCI_IDS_CLASSES_PREFIX):
+            break
+        if not line.strip() or line.startswith('#') or line.startswith('\t\t'):
+            continue
+
+        ids, _, name = line.strip().partition(' ')
+        try:
+            if line.startswith('\t'):
+                if vendor is not None:
+                    names[vendor << 16 | int(ids, 16)] = name.strip()
+            else:
+                vendor = int(ids, 16)
+                names[vendor << 16 | VENDOR_RECORD] = name.strip()
+        except ValueError:
+            logging.debug(f"Skipping pci.ids line {line!r}")
+    return names
+
+
+def build_index(source_path):
+    '''The index of source_path as bytes'''
+    st = os.stat(source_path)
+    with open(source_path, 'r', encoding='utf-8', errors='replace') as f:
+        names = parse_pci_ids(f)
+
+    records = bytearray()
+    strings = bytearray()
+    for key in sorted(names):
+        records += INDEX_RECORD.pack(key, len(strings))
+        strings += names[key].encode('utf-8') + b'\0'
+
+    header = INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, st.st_mtime_ns, st.st_size, len(names))
+    return header + records + strings
+
+
+class IndexKeys:
+    '''The record keys of an index as a sequence for bisect'''
+
+    def __init__(self, index) -> None:
+        self.index = index
+
+    def __len__(self):
+        return self.index.count
+
+    def __getitem__(self, i):
+        return self.index.get_record(i)[0]
+
+
+class PciIdIndex:
+    '''Vendor and device names from an index of pci.ids, searched in place by binary search'''
+
+    def __init__(self, buffer) -> None:
+        if len(buffer) < INDEX_HEADER.size:
+            raise ValueError('PCI ID index is truncated')
+        magic, version, self.source_mtime_ns, self.source_size, self.count = INDEX_HEADER.unpack_from(buffer)
+        if magic != INDEX_MAGIC or version != INDEX_VERSION:
+            raise ValueError('Not a PCI ID index of this version')
+        if len(buffer) < INDEX_HEADER.size + self.count * INDEX_RECORD.size:
+            raise ValueError('PCI ID index is truncated')
+
+        self.buffer = buffer
+        self.strings_offset = INDEX_HEADER.size + self.count * INDEX_RECORD.size
+        # bisect reads only the log2(count) records it compares
+        self.keys = IndexKeys(self)
+
+    def is_built_from(self, st):
+        return (self.source_mtime_ns, self.source_size) == (st.st_mtime_ns, st.st_size)
+
+    def get_record(self, i):
+        return INDEX_RECORD.unpack_from(self.buffer, INDEX_HEADER.size + i * INDEX_RECORD.size)
+
+    def find(self, key):
+        i = bisect.bisect_left(self.keys, key)
+        if i == self.count:
+            return None
+        found, offset = self.get_record(i)
+        if found != key:
+            return None
+
+        start = self.strings_offset + offset
+        end = self.buffer.find(b'\0', start)
+        return bytes(self.buffer[start:end]).decode('utf-8')
+
+    def get_vendor_name(self, vendor):
+        return self.find(vendor << 16 | VENDOR_RECORD)
+
+    def get_device_name(self, vendor, device):
+        return self.find(vendor << 16 | device)
+
+
+def open_index(path):
+    with open(path, 'rb') as f:
+        # the mapping outlives the file object; pages are read only when a search touches them
+        return PciIdIndex(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+def find_pci_ids():
+    for path in PCI_IDS_PATHS:
+        if os.path.exists(host_path(path)):
+            return host_path(path)
+    return None
+
+
+@cache
+def get_pci_id_index():
+    '''The index of the installed pci.ids, rebuilt when pci.ids changed; None when pci.ids is not installed'''
+    source_path = find_pci_ids()
+    if source_path is None:
+        logging.debug("pci.ids is not installed; PCI devices have no names")
+        return None
+
+    st = os.stat(source_path)
+    index_path = PCI_IDS_INDEX_PATH
+    try:
+        index = open_index(index_path)
+        if index.is_built_from(st):
+            return index
+    except (OSError, ValueError):
+        pass
+
+    logging.info(f"Indexing {source_path}")
+    content = build_index(source_path)
+    try:
+        from envycontrol.staging import atomic_write
+        atomic_write(index_path, content)
+        return open_index(index_path)
+    except OSError as e:
+        # e.g., not root; the index is kept in memory for this run
+        logging.debug(f"Could not write {index_path}: {e}")
+        return PciIdIndex(content)
+
+
+def get_vendor_name(vendor):
+    index = get_pci_id_index()
+    return index.get_vendor_name(vendor) if index else None
+
+
+def get_device_name(vendor, device):
+    index = get_pci_id_index()
+    return index.get_device_name(vendor, device) if index else None
+
+
+def clear_caches():
+    get_pci_id_index.cache_clear()
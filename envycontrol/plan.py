@@ -0,0 +1,265 @@
+import json
+import logging
+import os
+import sys
+from datetime import datetime
+
+from envycontrol import PREFIX, VERSION
+from envycontrol.backupstore import get_backup_store
+from envycontrol.fingerprint import (get_fingerprint_changes,
+                                     get_hardware_fingerprint)
+from envycontrol.initsystem import NVIDIA_PERSISTENCED_SERVICE
+from envycontrol.journal import apply_journaled, recover_interrupted_switch
+from envycontrol.manifest import write_manifest
+from envycontrol.staging import StagedChanges, atomic_write
+from envycontrol.target import target_path
+from envycontrol.timings import span
+
+SHIPPED_PROFILES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'profiles')
+PROFILE_OVERRIDES_DIR = PREFIX + '/etc/envycontrol/profiles'
+
+# Note: Do NOT remove this in cleanup!
+PLANS_DIR = PREFIX + '/var/cache/envycontrol/plans'
+
+PLAN_VERSION = 1
+
+# profile keys are the dests of the matching command line options
+PROFILE_DEFAULTS = {
+    'switch': None,
+    'dm': None,
+    'force_comp': False,
+    'coolbits': None,
+    'rtd3': None,
+    'use_nvidia_current': False,
+    'init': 'systemd',
+}
+
+
+def check_profile_name(name):
+    '''Profile names become file names; one that could reach outside of its directory is rejected'''
+    if not name or name.startswith('.') or os.sep in name or (os.altsep and os.altsep in name):
+        raise ValueError(f"Invalid profile name '{name}'")
+    return name
+
+
+def get_profile_path(name):
+    '''Path of profile name; a profile in PROFILE_OVERRIDES_DIR wins over a shipped one'''
+    check_profile_name(name)
+    for profiles_dir in [target_path(PROFILE_OVERRIDES_DIR), SHIPPED_PROFILES_DIR]:
+        path = os.path.join(profiles_dir, name + '.json')
+        if os.path.isfile(path):
+            return path
+    raise ValueError(f"Profile '{name}' not found in {target_path(PROFILE_OVERRIDES_DIR)} or {SHIPPED_PROFILES_DIR}")
+
+
+def load_profile(name):
+    '''Switch options of profile name, completed with the defaults of the command line'''
+    from envycontrol.main import (RTD3_MODES, SUPPORTED_DISPLAY_MANAGERS,
+                                  SUPPORTED_INIT_SYSTEMS,
+                                  SUPPORTED_OPTIMUS_MODES)
+
+    path = get_profile_path(name)
+    with open(path, 'r', encoding='utf-8') as f:
+        profile = json.load(f)
+
+    if unknown := set(profile) - set(PROFILE_DEFAULTS):
+        raise ValueError(f"Profile {path} has unknown option(s) {sorted(unknown)}")
+
+    options = {**PROFILE_DEFAULTS, **profile}
+    if options['switch'] not in SUPPORTED_OPTIMUS_MODES:
+        raise ValueError(f"Profile {path} needs 'switch' to be one of {SUPPORTED_OPTIMUS_MODES}")
+    if options['dm'] not in [None, *SUPPORTED_DISPLAY_MANAGERS]:
+        raise ValueError(f"Profile {path} needs 'dm' to be one of {SUPPORTED_DISPLAY_MANAGERS}")
+    if options['rtd3'] not in [None, *RTD3_MODES]:
+        raise ValueError(f"Profile {path} needs 'rtd3' to be one of {RTD3_MODES}")
+    if options['init'] not in SUPPORTED_INIT_SYSTEMS:
+        raise ValueError(f"Profile {path} needs 'init' to be one of {SUPPORTED_INIT_SYSTEMS}")
+    return options
+
+
+def get_stat_key(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [st.st_mtime_ns, st.st_size]
+
+
+def build_plan(name):
+    '''Probe the hardware and render everything a switch to profile name does, without applying it'''
+    from envycontrol.cacheconfig import load_cache_obj
+    from envycontrol.hardware import HardwareContext
+    from envycontrol.rulesengine import get_rules_engine
+    from envycontrol.templatestore import get_template_store
+    from envycontrol.utils import (cleanup, get_probe_steps,
+                                   run_switch_steps, stage_switch)
+
+    options = load_profile(name)
+    hw = HardwareContext(load_cache_obj())
+    if options['dm'] != None:
+        hw.set('display_manager', options['dm'])
+    with span('phase', 'probe'):
+        facts = run_switch_steps(get_probe_steps(hw, options['switch']))
+
+    # cleanup() depends on what is on disk when the plan is applied, so only what the rules add is kept;
+    # it must not adopt an Xsetup.bak into the store either
+    changes = StagedChanges(get_backup_store(read_only=True))
+    cleanup(changes)
+    baseline = dict(changes.changes)
+    ctx = stage_switch(changes, switch=options['switch'], facts=facts, force_comp=options['force_comp'],
+                       coolbits=options['coolbits'], rtd3=options['rtd3'],
+                       use_nvidia_current=options['use_nvidia_current'], init=options['init'])
+
+    # the plan is stale once any input it was rendered from changes
+    engine = get_rules_engine()
+    store = get_template_store()
+    store.save()
+    sources = [
+        get_profile_path(name), target_path(PROFILE_OVERRIDES_DIR), SHIPPED_PROFILES_DIR,
+        *engine.index['dirs'], *(engine.index['rules'][rule]['path'] for rule in engine.find_rules(ctx.match_values())),
+        *store.index['dirs'], *(compiled.path for _, compiled in store.compiled.values()),
+    ]
+
+    return {
+        'version': PLAN_VERSION,
+        'envycontrol': VERSION,
+        'profile': name,
+        'created': datetime.now().isoformat(),
+        'options': options,
+        'fingerprint': get_hardware_fingerprint(),
+        'sources': {path: get_stat_key(path) for path in sources},
+        'changes': [
+            {'path': path, 'content': None if content is None else content.decode('utf-8'), 'executable': executable}
+            for path, (content, executable) in changes.changes.items() if baseline.get(path) != (content, executable)
+        ],
+        'services': [
+            {'service': NVIDIA_PERSISTENCED_SERVICE, 'enabled': options['switch'] != 'integrated', 'init': options['init']},
+        ],
+    }
+
+
+def get_plan_path(name):
+    check_profile_name(name)
+    return os.path.join(target_path(PLANS_DIR), name + '.json')
+
+
+def save_plan(plan):
+    atomic_write(get_plan_path(plan['profile']), json.dumps(plan, indent=4).encode('utf-8'))
+
+
+def read_plan(name):
+    try:
+        with open(get_plan_path(name), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def get_stale_reason(plan):
+    '''Why plan can not be applied as is; None when it is current'''
+    if plan is None:
+        return 'no plan'
+    if plan.get('version') != PLAN_VERSION or plan.get('envycontrol') != VERSION:
+        return 'plan made by another version'
+    if changed := [path for path, key in plan['sources'].items() if get_stat_key(path) != key]:
+        return f"changed {', '.join(changed)}"
+    if changed := get_fingerprint_changes(plan['fingerprint'], get_hardware_fingerprint()):
+        return f"hardware changed: {', '.join(changed)}"
+    return None
+
+
+def apply_plan(plan):
+    '''Apply a plan on top of cleanup(); nothing is probed'''
+    from envycontrol.utils import cleanup
+
+    print(f"Switching to {plan['options']['switch']} mode with profile {plan['profile']}")
+
+    changes = StagedChanges(get_backup_store())
+    with span('phase', 'cleanup'):
+        cleanup(changes)
+    for change in plan['changes']:
+        if change['content'] is None:
+            changes.remove(change['path'])
+        else:
+            changes.write(change['path'], change['content'], change['executable'])
+
+    paths = list(changes.changes)
+    services = [(service['service'], service['enabled'], service['init']) for service in plan['services']]
+    with span('phase', 'apply'):
+        changed = apply_journaled(changes, plan['options']['switch'], services)
+    logging.info(f"Changed {len(changed)} file(s)")
+
+    with span('phase', 'manifest'):
+        write_manifest(plan['options']['switch'], paths, services)
+
+    print('Operation completed successfully')
+    print('Please reboot your computer for changes to take effect!')
+
+
+def create_parser(prog, description):
+    import argparse
+
+    def profile_name(name):
+        try:
+            return check_profile_name(name)
+        except ValueError as e:
+            raise argparse.ArgumentTypeError(e)
+
+    parser = argparse.ArgumentParser(prog=prog, description=description)
+    parser.add_argument('--profile', type=profile_name, metavar='NAME', required=True,
+                        help=f'Profile from {PROFILE_OVERRIDES_DIR} or {SHIPPED_PROFILES_DIR}')
+    parser.add_argument('--root', type=str, metavar='DIR', action='store',
+                        help='Manage the system installed under DIR, e.g., an OS image, instead of this one')
+    parser.add_argument('--replay', type=str, metavar='DIR', action='store',
+                        help='Read hardware from a fixture made by `envycontrol capture` instead of this machine')
+    parser.add_argument('--verbose', default=False, action='store_true',
+                        help='Enable verbose mode')
+    return parser
+
+
+def setup(args):
+    from envycontrol.replay import set_replay_dir
+    from envycontrol.target import set_root_dir
+    from envycontrol.utils import assert_root
+
+    logging.basicConfig(format='%(levelname)s: %(message)s')
+    if args.verbose:
+        logging.getLogger().setLevel(logging.DEBUG)
+    if args.root:
+        set_root_dir(args.root)
+    if args.replay:
+        set_replay_dir(args.replay)
+    assert_root()
+
+
+def plan_main(argv):
+    '''envycontrol plan'''
+    args = create_parser('envycontrol plan', 'Render and store what switching to a profile does').parse_args(argv)
+    setup(args)
+
+    try:
+        plan = build_plan(args.profile)
+    except ValueError as e:
+        logging.error(e)
+        sys.exit(1)
+    save_plan(plan)
+    print(f"Planned {len(plan['changes'])} file change(s) for profile {args.profile}")
+
+
+def switch_main(argv):
+    '''envycontrol switch'''
+    args = create_parser('envycontrol switch', 'Switch to a profile, applying its stored plan').parse_args(argv)
+    setup(args)
+    recover_interrupted_switch()
+
+    plan = read_plan(args.profile)
+    if reason := get_stale_reason(plan):
+        logging.info(f"Planning profile {args.profile} again: {reason}")
+        try:
+            plan = build_plan(args.profile)
+        except ValueError as e:
+            logging.error(e)
+            sys.exit(1)
+        save_plan(plan)
+
+    apply_plan(plan)
@@ -0,0 +1,166 @@
+import json
+import os
+import time
+from dataclasses import asdict, dataclass
+
+from envycontrol.pci import (NVIDIA_VENDOR_ID, SYSFS_PCI_DEVICES_PATH,
+                             get_display_devices)
+from envycontrol.replay import host_path
+
+# runtime power management attributes of a PCI device; reading them does not wake it up, unlike nvidia-smi
+POWER_ATTRIBUTES = {
+    'runtime_status': 'power/runtime_status',
+    'power_state': 'power_state',
+    'suspended_ms': 'power/runtime_suspended_time',
+    'active_ms': 'power/runtime_active_time',
+    'wakeup_count': 'power/wakeup_count',
+}
+
+DEFAULT_WATCH_INTERVAL = 1.0
+
+# the attributes are short; one read gets all of one
+ATTRIBUTE_MAX_SIZE = 64
+
+
+@dataclass(frozen=True, slots=True)
+class PowerSample:
+    '''Runtime PM state of a device at one point in time; None for attributes the kernel does not provide'''
+
+    time: float
+    runtime_status: str | None  # active, suspended, suspending, resuming or unsupported
+    power_state: str | None  # D0, D3hot, D3cold, ...
+    suspended_ms: int | None
+    active_ms: int | None
+    wakeup_count: int | None
+
+
+class AttributeReader:
+    '''Sysfs attributes {name: path relative to path}, opened once and re-read in place with pread(2), so a read
+    costs one system call; attributes that can not be opened read as None
+    '''
+
+    def __init__(self, path, attributes) -> None:
+        self.path = path
+        self.fds = {}
+        for name, attribute in attributes.items():
+            try:
+                self.fds[name] = os.open(os.path.join(path, attribute), os.O_RDONLY | os.O_CLOEXEC)
+            except OSError:
+                pass  # e.g., power_state before Linux 5.x or wakeup_count of a device that can not wake the system
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        for fd in self.fds.values():
+            os.close(fd)
+        self.fds.clear()
+
+    def read(self, name):
+        fd = self.fds.get(name)
+        if fd is None:
+            return None
+        try:
+            return os.pread(fd, ATTRIBUTE_MAX_SIZE, 0).decode('ascii').strip() or None
+        except OSError:
+            return None
+
+    def read_int(self, name):
+        value = self.read(name)
+        try:
+            return int(value) if value is not None else None
+        except ValueError:
+            return None
+
+
+class PowerMonitor(AttributeReader):
+    '''Samples the runtime PM attributes of the device at device_path'''
+
+    def __init__(self, device_path) -> None:
+        super().__init__(device_path, POWER_ATTRIBUTES)
+        self.device_path = device_path
+
+    def sample(self):
+        return PowerSample(
+            time=time.time(),
+            runtime_status=self.read('runtime_status'),
+            power_state=self.read('power_state'),
+            suspended_ms=self.read_int('suspended_ms'),
+            active_ms=self.read_int('active_ms'),
+            wakeup_count=self.read_int('wakeup_count'),
+        )
+
+
+def get_suspended_ratio(start, end):
+    '''Share of the time between two samples the device spent suspended; None when it is not known'''
+    if None in (start.suspended_ms, start.active_ms, end.suspended_ms, end.active_ms):
+        return None
+    suspended = end.suspended_ms - start.suspended_ms
+    total = suspended + end.active_ms - start.active_ms
+    return suspended / total if total > 0 else None
+
+
+def get_nvidia_device_path():
+    '''sysfs directory of the Nvidia GPU; None when it is not on the bus, e.g., in integrated mode'''
+    for device in get_display_devices():
+        if device.vendor == NVIDIA_VENDOR_ID and device.is_vga_or_3d:
+            return os.path.join(host_path(SYSFS_PCI_DEVICES_PATH), device.address)
+    return None
+
+
+def format_ratio(ratio):
+    return '-' if ratio is None else f'{ratio:.1%}'
+
+
+def watch(device_path, interval=DEFAULT_WATCH_INTERVAL, count=None, as_json=False):
+    '''Print a sample of the device every interval seconds until interrupted or count samples were printed
+
+    Wakeups are resumes seen between two samples; resumes shorter than interval can go unseen.
+    '''
+    with PowerMonitor(device_path) as monitor:
+        first = previous = monitor.sample()
+        wakeups = 0
+        started = time.monotonic()
+        cpu_started = time.process_time()
+
+        if not as_json:
+            print(f'{os.path.basename(device_path)}: runtime PM every {interval:g}s; Ctrl+C to stop')
+            print(f"{'time':<8}  {'status':<10}  {'state':<6}  {'interval':>8}  {'overall':>8}  {'wakeups':>7}")
+
+        samples = 0
+        deadline = started
+        try:
+            while count is None or samples < count:
+                deadline += interval
+                time.sleep(max(0.0, deadline - time.monotonic()))
+
+                sample = monitor.sample()
+                if previous.runtime_status == 'suspended' and sample.runtime_status != 'suspended':
+                    wakeups += 1
+                elif None not in (previous.active_ms, sample.active_ms) and sample.active_ms > previous.active_ms \
+                        and previous.runtime_status == sample.runtime_status == 'suspended':
+                    wakeups += 1  # woke up and went back to sleep between the samples
+
+                interval_ratio = get_suspended_ratio(previous, sample)
+                overall_ratio = get_suspended_ratio(first, sample)
+                if as_json:
+                    print(json.dumps({**asdict(sample), 'suspended_ratio': interval_ratio,
+                                      'overall_suspended_ratio': overall_ratio, 'wakeups': wakeups}), flush=True)
+                else:
+                    print(f"{time.strftime('%H:%M:%S', time.localtime(sample.time)):<8}  "
+                          f"{sample.runtime_status or '-':<10}  {sample.power_state or '-':<6}  "
+                          f"{format_ratio(interval_ratio):>8}  {format_ratio(overall_ratio):>8}  {wakeups:>7}",
+                          flush=True)
+                previous = sample
+                samples += 1
+        except KeyboardInterrupt:
+            pass
+
+        if not as_json:
+            elapsed = time.monotonic() - started
+            cpu = (time.process_time() - cpu_started) / elapsed if elapsed > 0 else 0.0
+            print(f'suspended {format_ratio(get_suspended_ratio(first, previous))} of {elapsed:.0f}s, '
+                  f'{wakeups} wakeup(s); monitor CPU {cpu:.3%}')
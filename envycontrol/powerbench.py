@@ -0,0 +1,267 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+from envycontrol import VERSION
+from envycontrol.bench import percentile
+from envycontrol.power import AttributeReader
+from envycontrol.replay import host_path, set_replay_dir
+
+SYSFS_POWER_SUPPLY_PATH = '/sys/class/power_supply'
+
+# power_supply attributes in µW, µWh, µA and µV; batteries that lack power_now report current and voltage
+BATTERY_ATTRIBUTES = ['power_now', 'energy_now', 'current_now', 'voltage_now']
+
+POWER_RESULTS_VERSION = 1
+
+DEFAULT_POWER_DURATION = 60.0
+DEFAULT_POWER_INTERVAL = 1.0
+
+
+class Battery(AttributeReader):
+    '''One battery from the power_supply class'''
+
+    def __init__(self, path) -> None:
+        super().__init__(path, {attribute: attribute for attribute in BATTERY_ATTRIBUTES + ['status']})
+        self.name = os.path.basename(path)
+
+    def read_micro(self, attribute):
+        value = self.read_int(attribute)
+        return value / 1_000_000 if value is not None else None
+
+    def sample(self):
+        '''(power W, energy Wh, current A); power is current times voltage when power_now is missing'''
+        power = self.read_micro('power_now')
+        current = self.read_micro('current_now')
+        if power is None and current is not None and (voltage := self.read_micro('voltage_now')) is not None:
+            power = current * voltage
+        return power, self.read_micro('energy_now'), current
+
+    def describe(self):
+        info = {'name': self.name}
+        for attribute in ['manufacturer', 'model_name', 'technology', 'energy_full', 'energy_full_design']:
+            try:
+                with open(os.path.join(self.path, attribute), 'r', encoding='utf-8') as f:
+                    info[attribute] = f.read().strip()
+            except OSError:
+                pass
+        return info
+
+
+def get_batteries():
+    power_supply_path = host_path(SYSFS_POWER_SUPPLY_PATH)
+    try:
+        names = sorted(os.listdir(power_supply_path))
+    except OSError:
+        return []
+
+    batteries = []
+    for name in names:
+        try:
+            with open(os.path.join(power_supply_path, name, 'type'), 'r', encoding='utf-8') as f:
+                if f.read().strip() != 'Battery':
+                    continue
+        except OSError:
+            continue
+        batteries.append(Battery(os.path.join(power_supply_path, name)))
+    return batteries
+
+
+def summarize_values(values):
+    values = sorted(value for value in values if value is not None)
+    if not values:
+        return None
+    return {
+        'min': values[0],
+        'mean': sum(values) / len(values),
+        'p50': percentile(values, 50),
+        'p90': percentile(values, 90),
+        'max': values[-1],
+    }
+
+
+def get_run_tags():
+    '''What the run is compared by: the mode, the options of the last switch and the machine'''
+    from envycontrol.cacheconfig import load_cache_obj
+    from envycontrol.manifest import read_manifest
+    from envycontrol.query import get_current_mode
+    from envycontrol.status import get_gpus
+
+    cache = load_cache_obj() or {}
+    manifest = read_manifest() or {}
+    return {
+        'mode': get_current_mode(),
+        'switched': manifest.get('created'),
+        'cache_metadata': cache.get('metadata'),
+        'machine': {
+            'hostname': socket.gethostname(),
+            'kernel': platform.release(),
+            'gpus': get_gpus(),
+        },
+    }
+
+
+def measure(batteries, duration=None, interval=DEFAULT_POWER_INTERVAL, workload=None):
+    '''Sample the batteries every interval seconds for duration seconds or while workload runs
+
+    Returns (samples, workload exit status); a sample is [seconds since start, power W, energy Wh, current A]
+    summed over the batteries. Raises ValueError when workload can not be started.
+    '''
+    try:
+        process = subprocess.Popen(workload) if workload else None
+    except OSError as e:
+        raise ValueError(f"Could not run '{' '.join(workload)}': {e}") from e
+    if duration is None and process is None:
+        duration = DEFAULT_POWER_DURATION
+
+    samples = []
+    started = deadline = time.monotonic()
+    try:
+        while True:
+            values = [battery.sample() for battery in batteries]
+            sample = [round(time.monotonic() - started, 3)]
+            for i in range(3):
+                known = [value[i] for value in values if value[i] is not None]
+                sample.append(sum(known) if known else None)
+            samples.append(sample)
+
+            if process is not None and process.poll() is not None:
+                break
+            if duration is not None and time.monotonic() - started >= duration:
+                break
+            deadline += interval
+            time.sleep(max(0.0, deadline - time.monotonic()))
+    except KeyboardInterrupt:
+        logging.warning("Interrupted; the results cover the samples taken so far")
+    finally:
+        if process is not None and process.poll() is None:
+            process.terminate()
+        exit_status = process.wait() if process is not None else None
+    return samples, exit_status
+
+
+def run_power_bench(duration=None, interval=DEFAULT_POWER_INTERVAL, workload=None, label=None):
+    batteries = get_batteries()
+    if not batteries:
+        raise ValueError(f'No battery in {host_path(SYSFS_POWER_SUPPLY_PATH)}')
+    try:
+        if discharging := [b.name for b in batteries if b.read('status') not in [None, 'Discharging']]:
+            logging.warning(f"{', '.join(discharging)} not discharging; unplug the charger to measure the drain")
+
+        tags = get_run_tags()
+        created = datetime.now().isoformat()
+        samples, exit_status = measure(batteries, duration, interval, workload)
+
+        energies = [sample[2] for sample in samples if sample[2] is not None]
+        elapsed = samples[-1][0]
+        energy_used = energies[0] - energies[-1] if len(energies) > 1 else None
+        return {
+            'version': POWER_RESULTS_VERSION,
+            'envycontrol': VERSION,
+            'created': created,
+            'label': label or tags['mode'],
+            **tags,
+            'batteries': [battery.describe() for battery in batteries],
+            'window': {'duration_s': elapsed, 'interval_s': interval, 'workload': workload,
+                       'workload_exit_status': exit_status},
+            'summary': {
+                'samples': len(samples),
+                'power_w': summarize_values(sample[1] for sample in samples),
+                'current_a': summarize_values(sample[3] for sample in samples),
+                'energy_used_wh': energy_used,
+                # a cross-check of power_w; energy_now moves in steps, so it needs a longer window
+                'mean_power_from_energy_w': energy_used * 3600 / elapsed if energy_used is not None and elapsed else None,
+            },
+            'samples': samples,
+        }
+    finally:
+        for battery in batteries:
+            battery.close()
+
+
+def format_number(value, fmt):
+    return '-' if value is None else format(value, fmt)
+
+
+def compare(results):
+    '''Print one line per results file; the drain relative to the first one'''
+    print(f"{'label':<20}  {'mode':<10}  {'machine':<16}  {'mean W':>7}  {'p50 W':>7}  {'p90 W':>7}  {'vs first':>8}")
+    first = None
+    for result in results:
+        power = result['summary']['power_w'] or {}
+        mean = power.get('mean')
+        if first is None:
+            first = mean
+        relative = f'{mean / first - 1:+.1%}' if mean is not None and first else '-'
+        print(f"{result['label']:<20}  {result['mode']:<10}  {result['machine']['hostname']:<16}  "
+              f"{format_number(mean, '.2f'):>7}  {format_number(power.get('p50'), '.2f'):>7}  "
+              f"{format_number(power.get('p90'), '.2f'):>7}  {relative:>8}")
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(prog='envycontrol bench power',
+                                     description='Measure the battery drain in the current mode, idle or under a '
+                                                 'workload given after --')
+    parser.add_argument('--duration', type=float, metavar='SECONDS',
+                        help=f'Length of the window; default: {DEFAULT_POWER_DURATION:g} idle, as long as the workload '
+                             'runs otherwise')
+    parser.add_argument('--interval', type=float, metavar='SECONDS', default=DEFAULT_POWER_INTERVAL,
+                        help='Seconds between two samples. Default: %(default)s')
+    parser.add_argument('--label', type=str, metavar='NAME',
+                        help='Name of the run in comparisons, e.g., hybrid-rtd3-2. Default: the mode')
+    parser.add_argument('--output', type=str, metavar='FILE',
+                        help='Write the JSON results to FILE instead of stdout')
+    parser.add_argument('--compare', type=str, metavar='FILE', nargs='+',
+                        help='Summarize results files side by side instead of measuring')
+    parser.add_argument('--replay', type=str, metavar='DIR',
+                        help='Read the batteries from a fixture instead of this machine')
+    parser.add_argument('--verbose', default=False, action='store_true',
+                        help='Enable verbose mode')
+    return parser
+
+
+def power_bench_main(argv):
+    '''envycontrol bench power'''
+    workload = None
+    if '--' in argv:
+        argv, workload = argv[:argv.index('--')], argv[argv.index('--') + 1:] or None
+
+    parser = create_parser()
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(format='%(levelname)s: %(message)s')
+    if args.verbose:
+        logging.getLogger().setLevel(logging.DEBUG)
+
+    if args.compare:
+        results = []
+        for path in args.compare:
+            with open(path, 'r', encoding='utf-8') as f:
+                results.append(json.load(f))
+        compare(results)
+        return
+
+    if args.interval <= 0:
+        parser.error('--interval must be positive')
+    if args.replay:
+        set_replay_dir(args.replay)
+
+    try:
+        results = run_power_bench(args.duration, args.interval, workload, args.label)
+    except ValueError as e:
+        logging.error(e)
+        sys.exit(1)
+
+    content = json.dumps(results, indent=4)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(content + '\n')
+    else:
+        print(content)
@@ -0,0 +1,124 @@
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable
+
+from envycontrol.timings import span
+
+PROBE_TIMEOUT_ENV = 'ENVYCONTROL_PROBE_TIMEOUT'
+
+# seconds a single probe may take; probes run concurrently, so this also bounds all of them
+DEFAULT_PROBE_TIMEOUT = 5.0
+
+PROBE_OK = 'ok'
+PROBE_FAILED = 'failed'
+PROBE_TIMED_OUT = 'timed out'
+
+local = threading.local()
+
+
+@dataclass(frozen=True)
+class ProbeResult:
+    '''Outcome of one probe; value is None, i.e., unknown, unless status is PROBE_OK'''
+
+    name: str
+    value: Any = None
+    status: str = PROBE_OK
+    error: str | None = None
+
+    @property
+    def ok(self) -> bool:
+        return self.status == PROBE_OK
+
+
+def get_probe_timeout() -> float:
+    try:
+        return float(os.environ.get(PROBE_TIMEOUT_ENV) or DEFAULT_PROBE_TIMEOUT)
+    except ValueError:
+        logging.warning(f"Ignoring {PROBE_TIMEOUT_ENV}={os.environ[PROBE_TIMEOUT_ENV]}: not a number of seconds")
+        return DEFAULT_PROBE_TIMEOUT
+
+
+def get_remaining_time() -> float | None:
+    '''Seconds left until the deadline of the probe running on this thread; None outside of a probe
+
+    Commands started by a probe use it as their timeout, so they are killed when the probe is given up on.
+    '''
+    deadline = getattr(local, 'deadline', None)
+    if deadline is None:
+        return None
+    return max(0.0, deadline - time.monotonic())
+
+
+class ProbeExecutor:
+    '''Runs independent probes concurrently, each against its own deadline; results are memoized by name
+
+    A probe that raises, or even calls sys.exit(), is PROBE_FAILED and one that misses its deadline is
+    PROBE_TIMED_OUT; callers get an unknown value and decide what it means. Probes run on daemon threads, so a
+    probe stuck in a read can not hold up the exit.
+    '''
+
+    def __init__(self, timeout: float | None = None) -> None:
+        self.timeout = get_probe_timeout() if timeout is None else timeout
+        self.results: dict[str, ProbeResult] = {}
+        # name -> (deadline, done event) of the probes started but not collected
+        self.running: dict[str, tuple[float, threading.Event]] = {}
+        self.lock = threading.Lock()
+
+    def start(self, name: str, func: Callable[[], Any]) -> None:
+        '''Start probing name in the background, unless it already is or was'''
+        with self.lock:
+            if name in self.results or name in self.running:
+                return
+            deadline = time.monotonic() + self.timeout
+            done = threading.Event()
+            self.running[name] = (deadline, done)
+
+        threading.Thread(target=self._run, args=(name, func, deadline, done), name=f'envycontrol-probe-{name}',
+                         daemon=True).start()
+
+    def _run(self, name: str, func: Callable[[], Any], deadline: float, done: threading.Event) -> None:
+        local.deadline = deadline
+        with span('probe', name) as event:
+            try:
+                result = ProbeResult(name, func())
+            except BaseException as e:
+                result = ProbeResult(name, status=PROBE_FAILED, error=f'{type(e).__name__}: {e}')
+                logging.warning(f"Probe '{name}' failed: {result.error}; treating it as unknown")
+                logging.debug(f"Probe '{name}' traceback", exc_info=e)
+            event['status'] = result.status
+
+        with self.lock:
+            # a result that comes in after the deadline is dropped; the probe stays timed out
+            if name in self.running:
+                self.results[name] = result
+                del self.running[name]
+        done.set()
+
+    def result(self, name: str) -> ProbeResult:
+        '''Wait for a started probe until its deadline'''
+        with self.lock:
+            if name in self.results:
+                return self.results[name]
+            deadline, done = self.running[name]
+
+        if not done.wait(max(0.0, deadline - time.monotonic())):
+            with self.lock:
+                if name in self.running:
+                    del self.running[name]
+                    self.results[name] = ProbeResult(name, status=PROBE_TIMED_OUT)
+                    logging.warning(f"Probe '{name}' timed out after {self.timeout:g}s; treating it as unknown")
+
+        with self.lock:
+            return self.results[name]
+
+    def run(self, probes: dict[str, Callable[[], Any]]) -> dict[str, ProbeResult]:
+        '''Start all probes, then collect them; takes as long as the slowest one, at most one deadline'''
+        for name, func in probes.items():
+            self.start(name, func)
+        return {name: self.result(name) for name in probes}
+
+    def probe(self, name: str, func: Callable[[], Any]) -> ProbeResult:
+        return self.run({name: func})[name]
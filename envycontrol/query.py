@@ -0,0 +1,70 @@
+import os
+import sys
+
+from envycontrol import (BLACKLIST_PATH, CACHE_FILE_PATH, JOURNAL_PATH,
+                         MODESET_PATH, QUERY_SOCKET_PATH, UDEV_INTEGRATED_PATH,
+                         XORG_PATH)
+from envycontrol.target import target_path
+
+# Note: keep this module cheap to import; it serves the `--query` fast path
+
+# seconds to wait for `envycontrol daemon` before evaluating directly
+QUERY_TIMEOUT = 0.5
+
+
+def get_current_mode():
+    mode = 'hybrid'
+    if os.path.exists(target_path(BLACKLIST_PATH)) and os.path.exists(target_path(UDEV_INTEGRATED_PATH)):
+        mode = 'integrated'
+    elif os.path.exists(target_path(XORG_PATH)) and os.path.exists(target_path(MODESET_PATH)):
+        mode = 'nvidia'
+    return mode
+
+
+def read_cache_file():
+    cache_file_path = target_path(CACHE_FILE_PATH)
+    content = f'ERROR: Could not read {cache_file_path}'
+    if os.path.exists(cache_file_path):
+        with open(cache_file_path, 'r', encoding='utf-8') as f:
+            content = f.read()
+    return content
+
+
+def ask_daemon(request, socket_path=None):
+    '''Answer of `envycontrol daemon` to request; None when it is not running'''
+    socket_path = socket_path or target_path(QUERY_SOCKET_PATH)
+    if not os.path.exists(socket_path):
+        return None
+
+    import socket  # only paid when a daemon might be listening
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            s.settimeout(QUERY_TIMEOUT)
+            s.connect(socket_path)
+            s.sendall(request.encode('utf-8') + b'\n')
+            chunks = []
+            while chunk := s.recv(65536):
+                chunks.append(chunk)
+    except OSError:
+        return None
+    return b''.join(chunks).decode('utf-8') or None
+
+
+def print_current_mode():
+    print(ask_daemon('mode') or get_current_mode())
+    if os.path.exists(target_path(JOURNAL_PATH)):
+        # the files of a switch cut short match no mode
+        print('warning: a switch was interrupted; run `envycontrol --recover`', file=sys.stderr)
+
+
+def show_cache_file():
+    print(ask_daemon('cache') or read_cache_file())
+
+
+def query_main(argv):
+    '''envycontrol query'''
+    if argv:
+        from argparse import ArgumentParser
+        ArgumentParser(prog='envycontrol query', description='Query the current graphics mode').parse_args(argv)
+
+    print_current_mode()
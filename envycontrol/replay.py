@@ -0,0 +1,140 @@
+import logging
+import os
+import shutil
+
+REPLAY_ENV = 'ENVYCONTROL_REPLAY'
+
+# machine inputs read by the detectors
+CAPTURED_FILES = [
+    '/etc/systemd/system/display-manager.service',
+    '/proc/sys/kernel/osrelease',
+    '/proc/driver/nvidia/version',
+    '/usr/share/libdrm/amdgpu.ids',
+]
+
+# machine inputs where only existence matters
+CAPTURED_MARKERS = [
+    '/usr/bin/xrandr',
+    '/usr/lib/xorg/modules/drivers/amdgpu_drv.so',
+    '/usr/lib64/xorg/modules/drivers/amdgpu_drv.so',
+]
+
+# sysfs attributes captured per PCI device; driver is captured as a symlink
+CAPTURED_PCI_ATTRIBUTES = [
+    'vendor',
+    'device',
+    'class',
+    'subsystem_vendor',
+    'subsystem_device',
+    'revision',
+    'boot_vga',
+    # runtime power management, as read by `status --watch`
+    'power_state',
+    'power/runtime_status',
+    'power/runtime_suspended_time',
+    'power/runtime_active_time',
+]
+
+replay_dir = os.environ.get(REPLAY_ENV) or None
+
+
+def get_replay_dir():
+    return replay_dir
+
+
+def set_replay_dir(path):
+    '''Point every detector at a captured fixture directory; None returns to the live machine'''
+    from envycontrol import drm, pciids
+    from envycontrol.pci import scan_pci_devices
+
+    global replay_dir
+    replay_dir = os.path.abspath(path) if path else None
+    scan_pci_devices.cache_clear()
+    drm.clear_caches()
+    pciids.clear_caches()
+    if replay_dir:
+        logging.info(f"Replaying hardware from {replay_dir}")
+
+
+def host_path(path):
+    '''Path of a machine input, redirected into the replay fixture when one is active'''
+    if replay_dir is None:
+        return path
+    return os.path.join(replay_dir, path.lstrip('/'))
+
+
+def capture_pci_devices(fixture_dir):
+    from envycontrol.pci import SYSFS_PCI_DEVICES_PATH
+
+    target_dir = os.path.join(fixture_dir, SYSFS_PCI_DEVICES_PATH.lstrip('/'))
+    for address in sorted(os.listdir(SYSFS_PCI_DEVICES_PATH)):
+        source = os.path.join(SYSFS_PCI_DEVICES_PATH, address)
+        target = os.path.join(target_dir, address)
+        os.makedirs(target, exist_ok=True)
+
+        for attribute in CAPTURED_PCI_ATTRIBUTES:
+            try:
+                with open(os.path.join(source, attribute), 'r', encoding='utf-8') as f:
+                    content = f.read()
+            except OSError:
+                continue
+            os.makedirs(os.path.dirname(os.path.join(target, attribute)), exist_ok=True)
+            with open(os.path.join(target, attribute), 'w', encoding='utf-8') as f:
+                f.write(content)
+
+        driver_link = os.path.join(source, 'driver')
+        if os.path.islink(driver_link):
+            driver = os.path.basename(os.readlink(driver_link))
+            os.symlink(f'../../../../bus/pci/drivers/{driver}', os.path.join(target, 'driver'))
+
+
+def capture_drm_cards(fixture_dir):
+    from envycontrol.drm import CARD_NAME_PATTERN, SYSFS_DRM_PATH
+
+    if not os.path.isdir(SYSFS_DRM_PATH):
+        logging.warning(f"Could not capture DRM cards: {SYSFS_DRM_PATH} is not available")
+        return
+
+    # each card is a symlink to its PCI device, which capture_pci_devices() captured
+    target_dir = os.path.join(fixture_dir, SYSFS_DRM_PATH.lstrip('/'))
+    for name in sorted(os.listdir(SYSFS_DRM_PATH)):
+        if not CARD_NAME_PATTERN.fullmatch(name):
+            continue
+        address = os.path.basename(os.path.realpath(os.path.join(SYSFS_DRM_PATH, name, 'device')))
+        os.makedirs(os.path.join(target_dir, name), exist_ok=True)
+        os.symlink(f'../../../bus/pci/devices/{address}', os.path.join(target_dir, name, 'device'))
+
+
+def capture(fixture_dir):
+    '''Snapshot the hardware inputs of this machine into fixture_dir'''
+    if os.path.exists(fixture_dir) and os.listdir(fixture_dir):
+        raise ValueError(f'Fixture directory {fixture_dir} is not empty')
+
+    capture_pci_devices(fixture_dir)
+    capture_drm_cards(fixture_dir)
+
+    for path in CAPTURED_FILES + CAPTURED_MARKERS:
+        if not os.path.exists(path):
+            continue
+        target = os.path.join(fixture_dir, path.lstrip('/'))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if path in CAPTURED_MARKERS:
+            open(target, 'w').close()
+        else:
+            shutil.copyfile(path, target)
+
+    print(f'Captured hardware inputs into {fixture_dir}')
+
+
+def capture_main(argv):
+    '''envycontrol capture'''
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='envycontrol capture',
+                                     description='Snapshot the hardware inputs of this machine for --replay')
+    parser.add_argument('fixture_dir', metavar='DIR',
+                        help='Empty directory to write the fixture into')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(format='%(levelname)s: %(message)s')
+    capture(args.fixture_dir)
@@ -0,0 +1,23 @@
+'''Hybrid mode: modeset for the Nvidia driver, optionally with runtime D3 power management'''
+from envycontrol import MODESET_PATH, UDEV_PM_PATH
+from envycontrol.gpufamily import RTD3_MIN_ARCHITECTURE, supports_rtd3
+from envycontrol.rulesengine import RuleError
+from envycontrol.templatestore import render_template
+
+MATCH = {'mode': 'hybrid'}
+
+
+def apply(ctx):
+    module = 'nvidia-current' if ctx.use_nvidia_current else 'nvidia'
+
+    if ctx.rtd3 == None:
+        ctx.changes.write(MODESET_PATH, render_template('modprobe/nvidia.conf', module=module))
+    else:
+        architecture = ctx.facts.get('nvidia_architecture')
+        if architecture is not None and not supports_rtd3(architecture):
+            raise RuleError(f"RTD3 needs a {RTD3_MIN_ARCHITECTURE.title()} or newer Nvidia GPU; "
+                            f"this one is {architecture.title()}")
+
+        # setup rtd3
+        ctx.changes.write(MODESET_PATH, render_template('modprobe/nvidia-rtd3.conf', module=module, rtd3=ctx.rtd3))
+        ctx.changes.write(UDEV_PM_PATH, render_template('udev/80-nvidia-pm.rules'))
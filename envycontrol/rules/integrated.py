@@ -0,0 +1,13 @@
+'''Integrated mode: the Nvidia GPU is blacklisted and powered off'''
+from envycontrol import BLACKLIST_PATH, UDEV_INTEGRATED_PATH
+from envycontrol.templatestore import render_template
+
+MATCH = {'mode': 'integrated'}
+
+
+def apply(ctx):
+    # blacklist all nouveau and Nvidia modules
+    ctx.changes.write(BLACKLIST_PATH, render_template('modprobe/blacklist-nvidia.conf'))
+
+    # power off the Nvidia GPU with udev rules
+    ctx.changes.write(UDEV_INTEGRATED_PATH, render_template('udev/50-remove-nvidia.rules'))
@@ -0,0 +1,10 @@
+'''Nvidia mode under LightDM: a display setup script runs the xrandr script'''
+from envycontrol import LIGHTDM_CONFIG_PATH, LIGHTDM_SCRIPT_PATH
+from envycontrol.templatestore import render_template
+
+MATCH = {'mode': 'nvidia'}
+
+
+def apply(ctx):
+    ctx.changes.write(LIGHTDM_SCRIPT_PATH, ctx.facts['xrandr_script'], True)
+    ctx.changes.write(LIGHTDM_CONFIG_PATH, render_template('lightdm/20-nvidia.conf'))
@@ -0,0 +1,20 @@
+'''Nvidia mode: modeset for the Nvidia driver and the extra X.org options'''
+from envycontrol import EXTRA_XORG_PATH, MODESET_PATH
+from envycontrol.templatestore import render_template
+
+MATCH = {'mode': 'nvidia'}
+
+
+def apply(ctx):
+    # enable modeset for Nvidia driver
+    module = 'nvidia-current' if ctx.use_nvidia_current else 'nvidia'
+    ctx.changes.write(MODESET_PATH, render_template('modprobe/nvidia.conf', module=module))
+
+    # extra Xorg config
+    options = ''
+    if ctx.force_comp:
+        options += render_template('xorg/force-comp.conf')
+    if ctx.coolbits != None:
+        options += render_template('xorg/coolbits.conf', coolbits=ctx.coolbits)
+    if options:
+        ctx.changes.write(EXTRA_XORG_PATH, render_template('xorg/10-nvidia.conf', options=options))
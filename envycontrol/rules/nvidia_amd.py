@@ -0,0 +1,9 @@
+'''Nvidia mode on an AMD iGPU: X.org layout with the Nvidia screen and an inactive amdgpu one'''
+from envycontrol import XORG_PATH
+from envycontrol.templatestore import render_template
+
+MATCH = {'mode': 'nvidia', 'igpu': 'amd'}
+
+
+def apply(ctx):
+    ctx.changes.write(XORG_PATH, render_template('xorg/amd.conf', bus_id=ctx.facts['nvidia_gpu_pci_bus']))
@@ -0,0 +1,9 @@
+'''Nvidia mode on an Intel iGPU: X.org layout with the Nvidia screen and an inactive Intel one'''
+from envycontrol import XORG_PATH
+from envycontrol.templatestore import render_template
+
+MATCH = {'mode': 'nvidia', 'igpu': 'intel'}
+
+
+def apply(ctx):
+    ctx.changes.write(XORG_PATH, render_template('xorg/intel.conf', bus_id=ctx.facts['nvidia_gpu_pci_bus']))
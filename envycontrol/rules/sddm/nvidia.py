@@ -0,0 +1,9 @@
+'''Nvidia mode under SDDM: Xsetup runs the xrandr script; the original Xsetup is kept in the backup store'''
+from envycontrol import SDDM_XSETUP_PATH
+
+MATCH = {'mode': 'nvidia'}
+
+
+def apply(ctx):
+    # the backup store keeps the original Xsetup - as restored by cleanup()
+    ctx.changes.write(SDDM_XSETUP_PATH, ctx.facts['xrandr_script'], True)
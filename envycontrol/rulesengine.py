@@ -0,0 +1,249 @@
+import ast
+import hashlib
+import importlib.util
+import json
+import logging
+import marshal
+import os
+import types
+from dataclasses import dataclass, field
+from functools import cache
+from typing import Any
+
+from envycontrol import PREFIX
+from envycontrol.staging import StagedChanges, atomic_write
+from envycontrol.target import target_path
+
+SHIPPED_RULES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rules')
+RULE_OVERRIDES_DIR = PREFIX + '/etc/envycontrol/rules'
+
+# Note: Do NOT remove these in cleanup!
+RULE_INDEX_PATH = PREFIX + '/var/cache/envycontrol/rules.json'
+RULE_BYTECODE_DIR = PREFIX + '/var/cache/envycontrol/rules'
+
+# what a rule can match on; a rule in a directory named after a display manager implies its dm
+RULE_MATCH_KEYS = ['mode', 'dm', 'init', 'igpu']
+
+BYTECODE_MAGIC = importlib.util.MAGIC_NUMBER.hex()
+
+
+@dataclass
+class RuleContext:
+    '''What a rule sees; rules stage their file changes on changes'''
+
+    mode: str
+    dm: str | None
+    init: str
+    igpu: str | None
+    changes: StagedChanges
+    force_comp: bool = False
+    coolbits: int | None = None
+    rtd3: int | None = None
+    use_nvidia_current: bool = False
+    facts: dict[str, Any] = field(default_factory=dict)
+
+    def match_values(self) -> dict[str, str | None]:
+        return {'mode': self.mode, 'dm': self.dm, 'init': self.init, 'igpu': self.igpu}
+
+
+class RuleError(Exception):
+    pass
+
+
+def read_rule_match(source: str, name: str, path: str) -> dict[str, list[str]]:
+    '''The MATCH literal of a rule, read without running it; values are normalized to lists'''
+    match = {}
+    for node in ast.parse(source, path).body:
+        if isinstance(node, ast.Assign) and any(isinstance(t, ast.Name) and t.id == 'MATCH' for t in node.targets):
+            match = ast.literal_eval(node.value)
+
+    if unknown := set(match) - set(RULE_MATCH_KEYS):
+        raise RuleError(f"Rule {path} matches on unknown key(s) {sorted(unknown)}")
+
+    # rules/<dm>/*.py only apply to that display manager
+    if '/' in name and 'dm' not in match:
+        match['dm'] = name.split('/')[0]
+
+    return {key: [value] if isinstance(value, str) else list(value) for key, value in match.items()}
+
+
+def is_rule_matching(match: dict[str, list[str]], values: dict[str, str | None]) -> bool:
+    return all(values[key] in accepted for key, accepted in match.items())
+
+
+class RulesEngine:
+    '''Finds the rules that apply to a switch from an index and imports only those
+
+    The index keeps the MATCH of every rule and points at its cached bytecode, so a switch neither parses nor
+    compiles rule sources unless one changed. A rule in an earlier tree overrides one with the same name in a
+    later tree. Matching rules run in name order.
+    '''
+
+    def __init__(self, dirs: list[str], index_path: str = RULE_INDEX_PATH, bytecode_dir: str = RULE_BYTECODE_DIR) -> None:
+        self.dirs = dirs
+        self.index_path = index_path
+        self.bytecode_dir = bytecode_dir
+        # {'magic': str, 'roots': [dir], 'dirs': {dir: mtime_ns}, 'rules': {name: {path, mtime_ns, size, sha256, match}}}
+        self.index: dict | None = None
+        self.dirty = False
+
+    def find_rules(self, values: dict[str, str | None]) -> list[str]:
+        if self.index is None:
+            self.load()
+        return [name for name, entry in sorted(self.index['rules'].items()) if is_rule_matching(entry['match'], values)]
+
+    def run(self, ctx: RuleContext) -> list[str]:
+        '''Run the rules matching ctx; returns their names'''
+        names = self.find_rules(ctx.match_values())
+        for name in names:
+            module = self.load_rule(name)
+            logging.debug(f"Running rule {name} from {module.__file__}")
+            try:
+                module.apply(ctx)
+            except Exception as e:
+                logging.debug(f"Rule '{name}' traceback", exc_info=e)
+                raise RuleError(f"Rule '{name}' failed: {type(e).__name__}: {e}") from e
+        self.save()
+        return names
+
+    def load(self) -> None:
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = None
+
+        if index is None or index.get('magic') != BYTECODE_MAGIC or not self.is_tree_current(index):
+            self.index = {'rules': index['rules'] if index and index.get('magic') == BYTECODE_MAGIC else {}}
+            self.scan()
+        else:
+            self.index = index
+            # editing a rule in place does not touch its directory
+            for name, entry in list(index['rules'].items()):
+                key = get_stat_key(entry['path'])
+                if key is None:
+                    self.scan()
+                    break
+                if key != (entry['mtime_ns'], entry['size']):
+                    self.index_rule(name, entry['path'])
+
+    def is_tree_current(self, index: dict) -> bool:
+        if index.get('roots') != self.dirs:
+            return False
+        return all(get_mtime_ns(path) == mtime_ns for path, mtime_ns in index.get('dirs', {}).items())
+
+    def scan(self) -> None:
+        previous = self.index.get('rules', {})
+        dirs = {}
+        paths = {}
+
+        # walk the lowest precedence tree first so that overrides replace shipped rules
+        for root in reversed(self.dirs):
+            dirs[root] = get_mtime_ns(root)
+            for dir_path, dir_names, file_names in os.walk(root):
+                dir_names[:] = sorted(d for d in dir_names if not d.startswith(('.', '_')))
+                if dir_path != root:
+                    dirs[dir_path] = get_mtime_ns(dir_path)
+                for file_name in file_names:
+                    if file_name.endswith('.py') and not file_name.startswith(('.', '_')):
+                        path = os.path.join(dir_path, file_name)
+                        paths[os.path.relpath(path, root)[:-3].replace(os.sep, '/')] = path
+
+        self.index = {'magic': BYTECODE_MAGIC, 'roots': list(self.dirs), 'dirs': dirs, 'rules': {}}
+        for name, path in sorted(paths.items()):
+            entry = previous.get(name)
+            if entry is not None and entry['path'] == path and get_stat_key(path) == (entry['mtime_ns'], entry['size']):
+                self.index['rules'][name] = entry
+            else:
+                self.index_rule(name, path)
+
+        logging.debug(f"Indexed {len(paths)} rules in {', '.join(self.dirs)}")
+        self.dirty = True
+
+    def index_rule(self, name: str, path: str) -> types.CodeType:
+        with open(path, mode='rb') as f:
+            source = f.read()
+        mtime_ns, size = get_stat_key(path)
+        sha256 = hashlib.sha256(source).hexdigest()
+
+        try:
+            code = compile(source, path, 'exec', dont_inherit=True)
+            match = read_rule_match(source.decode('utf-8'), name, path)
+        except (SyntaxError, ValueError) as e:
+            raise RuleError(f"Rule {path} is invalid: {e}") from e
+
+        self.write_bytecode(sha256, code)
+        self.index['rules'][name] = {'path': path, 'mtime_ns': mtime_ns, 'size': size, 'sha256': sha256, 'match': match}
+        self.dirty = True
+        return code
+
+    def get_bytecode_path(self, sha256: str) -> str:
+        return os.path.join(self.bytecode_dir, sha256 + '.pyc')
+
+    def write_bytecode(self, sha256: str, code: types.CodeType) -> None:
+        try:
+            atomic_write(self.get_bytecode_path(sha256), marshal.dumps(code))
+        except OSError as e:
+            logging.debug(f"Could not cache the bytecode of rule '{code.co_filename}': {e}")
+
+    def read_bytecode(self, sha256: str) -> types.CodeType | None:
+        try:
+            with open(self.get_bytecode_path(sha256), mode='rb') as f:
+                return marshal.loads(f.read())
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+
+    def load_rule(self, name: str) -> types.ModuleType:
+        entry = self.index['rules'][name]
+        code = self.read_bytecode(entry['sha256'])
+        if code is None:
+            code = self.index_rule(name, entry['path'])
+            entry = self.index['rules'][name]
+
+        module = types.ModuleType(f"envycontrol.rules.{name.replace('/', '.')}")
+        module.__file__ = entry['path']
+        exec(code, module.__dict__)
+        if not callable(getattr(module, 'apply', None)):
+            raise RuleError(f"Rule {entry['path']} does not define apply(ctx)")
+        return module
+
+    def save(self) -> None:
+        '''Persist the index when this run changed it'''
+        if not self.dirty:
+            return
+        try:
+            atomic_write(self.index_path, json.dumps(self.index, indent=4, sort_keys=True).encode('utf-8'))
+            self.dirty = False
+        except OSError as e:
+            logging.debug(f"Could not save the rule index '{self.index_path}': {e}")
+
+
+def get_mtime_ns(path: str) -> int | None:
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def get_stat_key(path: str) -> tuple[int, int] | None:
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+@cache
+def load_rules_engine(dirs: tuple[str, ...], index_path: str, bytecode_dir: str) -> RulesEngine:
+    return RulesEngine(list(dirs), index_path, bytecode_dir)
+
+
+def get_rules_engine() -> RulesEngine:
+    '''The engine for the current overrides; shared by every switch in this process'''
+    dirs = (os.path.abspath(target_path(RULE_OVERRIDES_DIR)), SHIPPED_RULES_DIR)
+    return load_rules_engine(dirs, os.path.abspath(target_path(RULE_INDEX_PATH)),
+                             os.path.abspath(target_path(RULE_BYTECODE_DIR)))
+
+
+def run_rules(ctx: RuleContext) -> list[str]:
+    return get_rules_engine().run(ctx)
@@ -0,0 +1,148 @@
+import logging
+import os
+import stat
+import tempfile
+
+from envycontrol.target import target_path
+from envycontrol.timings import span
+
+DEFAULT_FILE_MODE = 0o644
+EXECUTABLE_BITS = stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH
+
+
+class StagedChanges:
+    '''Collects the file writes and removals of an operation and applies only those that differ from disk
+
+    Paths are staged as given and redirected under the --root directory when read or applied. With a backup store,
+    the content a file had is stored before it is modified or removed.
+    '''
+
+    def __init__(self, backups=None) -> None:
+        # path -> (content, executable); content of None means remove
+        self.changes: dict[str, tuple[bytes | None, bool]] = {}
+        self.backups = backups
+
+    def write(self, path: str, content: str, executable: bool = False) -> None:
+        self.changes.pop(path, None)  # the last staged operation wins
+        self.changes[path] = (content.encode('utf-8'), executable)
+
+    def remove(self, path: str) -> None:
+        self.changes.pop(path, None)
+        self.changes[path] = (None, False)
+
+    def read(self, path: str) -> str | None:
+        '''Content of path as it will be after apply()'''
+        if path in self.changes:
+            content, _ = self.changes[path]
+            return None if content is None else content.decode('utf-8')
+        try:
+            with span('file', path, op='read'), open(target_path(path), mode='r', encoding='utf-8') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def apply(self) -> list[str]:
+        '''Apply the staged changes; returns the paths that actually changed'''
+        changed = []
+        dirs_to_sync = set()
+
+        for path, (content, executable) in self.changes.items():
+            with span('file', path, op='write' if content is not None else 'remove') as event:
+                if content is None:
+                    synced_dir = self._remove(path)
+                else:
+                    synced_dir = self._write(path, content, executable)
+                event['changed'] = synced_dir is not None
+
+            if synced_dir is not None:
+                changed.append(path)
+                dirs_to_sync.add(synced_dir)
+
+        for dir_path in sorted(dirs_to_sync):
+            with span('file', dir_path, op='fsync'):
+                fsync_dir(dir_path)
+
+        if self.backups is not None:
+            self.backups.save()
+        self.changes.clear()
+        return changed
+
+    def _remove(self, logical_path: str) -> str | None:
+        path = target_path(logical_path)
+        try:
+            if self.backups is not None:
+                with open(path, mode='rb') as f:
+                    self.backups.backup(logical_path, f.read(), stat.S_IMODE(os.fstat(f.fileno()).st_mode))
+            os.remove(path)
+            logging.info(f"Removed file {path}")
+            return os.path.dirname(path) or '.'
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logging.error(f"Failed to remove file '{path}': {e}")
+            return None
+
+    def _write(self, logical_path: str, content: bytes, executable: bool) -> str | None:
+        path = target_path(logical_path)
+        dir_path = os.path.dirname(path) or '.'
+        try:
+            current_mode = None
+            try:
+                current_mode = stat.S_IMODE(os.stat(path).st_mode)
+                with open(path, mode='rb') as f:
+                    current_content = f.read()
+            except FileNotFoundError:
+                current_content = None
+
+            mode = DEFAULT_FILE_MODE if current_mode is None else current_mode
+            if executable:
+                mode |= EXECUTABLE_BITS
+
+            if current_content == content and current_mode == mode:
+                logging.debug(f"File {path} is unchanged")
+                return None
+
+            if self.backups is not None:
+                self.backups.backup(logical_path, current_content, current_mode)
+            atomic_write(path, content, mode)
+
+            logging.info(f"Created file {path}")
+            if logging.getLogger().level == logging.DEBUG:
+                print(content.decode('utf-8'))
+            if executable:
+                logging.info(f"Added execution privilege to file {path}")
+            return dir_path
+        except OSError as e:
+            logging.error(f"Failed to create file '{path}': {e}")
+            return None
+
+
+def atomic_write(path: str, content: bytes, mode: int = DEFAULT_FILE_MODE) -> None:
+    '''Replace path with content via a synced temp file; the caller syncs the directory'''
+    dir_path = os.path.dirname(path) or '.'
+    if not os.path.isdir(dir_path):
+        os.makedirs(dir_path, exist_ok=True)
+
+    fd, tmp_path = tempfile.mkstemp(prefix=f'.{os.path.basename(path)}.', dir=dir_path)
+    try:
+        with os.fdopen(fd, mode='wb') as f:
+            f.write(content)
+            f.flush()
+            os.chmod(f.fileno(), mode)
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def fsync_dir(path: str) -> None:
+    try:
+        fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    except OSError as e:
+        logging.debug(f"Could not open directory '{path}' for fsync: {e}")
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
@@ -0,0 +1,88 @@
+import argparse
+import json
+import sys
+import time
+
+from envycontrol.gpufamily import get_nvidia_architecture
+from envycontrol.initramfs import read_kernel_statuses
+from envycontrol.pci import NVIDIA_VENDOR_ID, get_display_devices
+from envycontrol.pciids import get_device_name, get_vendor_name
+from envycontrol.query import get_current_mode
+
+
+def format_elapsed(status):
+    if 'started' not in status:
+        return ''
+    elapsed = status.get('finished', time.time()) - status['started']
+    return f'{elapsed:.1f}s'
+
+
+def get_gpus():
+    '''The display devices with their names from pci.ids and, for Nvidia, their architecture'''
+    return [{
+        'address': device.address,
+        'id': f'{device.vendor:04x}:{device.device:04x}',
+        'vendor': get_vendor_name(device.vendor),
+        'name': get_device_name(device.vendor, device.device),
+        'architecture': get_nvidia_architecture(device.device) if device.vendor == NVIDIA_VENDOR_ID else None,
+    } for device in get_display_devices()]
+
+
+def print_status():
+    print(f'mode: {get_current_mode()}')
+
+    print('gpus:')
+    for gpu in get_gpus():
+        name = ' '.join(part for part in [gpu['vendor'], gpu['name']] if part) or 'unknown'
+        architecture = f" ({gpu['architecture']})" if gpu['architecture'] else ''
+        print(f"  {gpu['address']}  {gpu['id']}  {name}{architecture}")
+
+    statuses = read_kernel_statuses()
+    if not statuses:
+        print('initramfs: no rebuild recorded')
+        return
+
+    print('initramfs:')
+    width = max(len(status['kernel']) for status in statuses)
+    for status in statuses:
+        line = f"  {status['kernel']:<{width}}  {status['state']:<11}  {format_elapsed(status)}"
+        if status['state'] == 'failed' and status.get('log'):
+            line += f"  see {status['log']}"
+        print(line.rstrip())
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(prog='envycontrol status',
+                                     description='Report the graphics mode, the GPUs and the progress of initramfs '
+                                                 'rebuilds')
+    parser.add_argument('--json', action='store_true',
+                        help='Print the status as JSON; with --watch, one JSON object per sample')
+    parser.add_argument('--watch', action='store_true',
+                        help='Stream the runtime power state of the Nvidia GPU, e.g., to confirm RTD3 reaches D3cold')
+    parser.add_argument('--interval', type=float, metavar='SECONDS', default=1.0,
+                        help='Seconds between two samples of --watch. Default: %(default)s')
+    parser.add_argument('--count', type=int, metavar='N',
+                        help='Stop --watch after N samples')
+    return parser
+
+
+def status_main(argv):
+    '''envycontrol status'''
+    parser = create_parser()
+    args = parser.parse_args(argv)
+
+    if args.watch:
+        from envycontrol.power import get_nvidia_device_path, watch
+
+        if args.interval <= 0:
+            parser.error('--interval must be positive')
+        device_path = get_nvidia_device_path()
+        if device_path is None:
+            print('The Nvidia GPU is not on the PCI bus; there is no power state to watch')
+            sys.exit(1)
+        watch(device_path, args.interval, args.count, args.json)
+    elif args.json:
+        print(json.dumps({'mode': get_current_mode(), 'gpus': get_gpus(), 'initramfs': read_kernel_statuses()},
+                         indent=4))
+    else:
+        print_status()
@@ -0,0 +1,78 @@
+import logging
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Any, Callable
+
+from envycontrol.timings import span
+
+
+@dataclass
+class Step:
+    '''One node of an operation; func receives the results of deps as keyword arguments'''
+
+    name: str
+    func: Callable[..., Any]
+    deps: list[str] = field(default_factory=list)
+
+
+class StepError(Exception):
+    '''One or more steps failed; failures maps step name to its exception'''
+
+    def __init__(self, failures: dict[str, BaseException], skipped: list[str]) -> None:
+        self.failures = failures
+        self.skipped = skipped
+        names = ', '.join(failures)
+        super().__init__(f'Failed step(s): {names}' + (f'; skipped: {", ".join(skipped)}' if skipped else ''))
+
+
+def run_step(step: Step, kwargs: dict[str, Any]) -> Any:
+    with span('step', step.name):
+        return step.func(**kwargs)
+
+
+def run_steps(steps: list[Step], max_workers: int | None = None) -> dict[str, Any]:
+    '''Run steps on a thread pool as soon as their deps are done; returns name -> result'''
+    by_name = {step.name: step for step in steps}
+    for step in steps:
+        if unknown := [dep for dep in step.deps if dep not in by_name]:
+            raise ValueError(f"Step '{step.name}' depends on unknown step(s) {unknown}")
+
+    results: dict[str, Any] = {}
+    failures: dict[str, BaseException] = {}
+    skipped: list[str] = []
+    pending = list(steps)
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=max_workers or len(steps) or 1, thread_name_prefix='envycontrol-step') as executor:
+        while pending or running:
+            for step in list(pending):
+                if any(dep in failures or dep in skipped for dep in step.deps):
+                    pending.remove(step)
+                    skipped.append(step.name)
+                elif all(dep in results for dep in step.deps):
+                    pending.remove(step)
+                    kwargs = {dep: results[dep] for dep in step.deps}
+                    running[executor.submit(run_step, step, kwargs)] = step
+
+            if not running:
+                # whatever is left waits on a dependency cycle
+                skipped.extend(step.name for step in pending)
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                step = running.pop(future)
+                try:
+                    results[step.name] = future.result()
+                    logging.debug(f"Step '{step.name}' done")
+                except BaseException as e:
+                    failures[step.name] = e
+
+    for name, e in failures.items():
+        logging.error(f"Step '{name}' failed: {type(e).__name__}: {e}")
+        logging.debug(f"Step '{name}' traceback", exc_info=e)
+
+    if failures or skipped:
+        raise StepError(failures, skipped)
+
+    return results
@@ -0,0 +1,33 @@
+import os
+
+from envycontrol import PREFIX
+
+# Note: keep this module cheap to import; query.py uses it
+
+ROOT_ENV = 'ENVYCONTROL_ROOT'
+
+root_dir = os.path.abspath(os.environ[ROOT_ENV]) if os.environ.get(ROOT_ENV) else None
+
+
+def get_root_dir():
+    return root_dir
+
+
+def set_root_dir(path):
+    '''Manage the files of the system installed under path, e.g., an OS image; None returns to PREFIX'''
+    global root_dir
+    root_dir = os.path.abspath(path) if path else None
+
+
+def target_path(path):
+    '''Path of a file EnvyControl manages, redirected under the root directory when one is set
+
+    The *_PATH constants stay relative to PREFIX; each file access maps them once, right before the I/O.
+    '''
+    if root_dir is None:
+        return path
+    if path == PREFIX:
+        return root_dir
+    if not path.startswith(PREFIX + '/'):
+        return path
+    return root_dir + path[len(PREFIX):]
@@ -0,0 +1,5 @@
+#!/bin/sh
+# Automatically generated by EnvyControl
+
+xrandr --setprovideroutputsource "${provider}" NVIDIA-0
+xrandr --auto
@@ -0,0 +1,184 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from dataclasses import dataclass
+from functools import cache
+from string import Template
+
+from envycontrol import PREFIX
+from envycontrol.staging import atomic_write
+from envycontrol.target import target_path
+
+SHIPPED_TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+TEMPLATE_OVERRIDES_DIR = PREFIX + '/etc/envycontrol/templates'
+
+# Note: Do NOT remove this in cleanup!
+TEMPLATE_INDEX_PATH = PREFIX + '/var/cache/envycontrol/templates.json'
+
+
+@dataclass(frozen=True, slots=True)
+class CompiledTemplate:
+    '''A template parsed once; placeholders are ${name} and $$ is a literal $'''
+
+    path: str
+    sha256: str
+    template: Template
+    identifiers: tuple[str, ...]
+
+    def render(self, **values) -> str:
+        if not self.identifiers:
+            return self.template.template
+        # placeholders without a value are left as is, e.g., shell variables in an override
+        return self.template.safe_substitute(values)
+
+
+def compile_template(path: str, sha256: str, text: str) -> CompiledTemplate:
+    template = Template(text)
+    return CompiledTemplate(path=path, sha256=sha256, template=template, identifiers=tuple(template.get_identifiers()))
+
+
+class TemplateStore:
+    '''Resolves template names against the template trees; a template in an earlier tree overrides a later one
+
+    The resolution and the text of every template are kept in an index file, so a run only walks the trees
+    when a directory changed and only reads a template whose mtime or size changed.
+    '''
+
+    def __init__(self, dirs: list[str], index_path: str = TEMPLATE_INDEX_PATH) -> None:
+        self.dirs = dirs
+        self.index_path = index_path
+        # {'roots': [dir], 'dirs': {dir: mtime_ns}, 'templates': {name: {path, mtime_ns, size, sha256, text}}}
+        self.index: dict | None = None
+        self.dirty = False
+        # name -> ((mtime_ns, size), CompiledTemplate)
+        self.compiled: dict[str, tuple[tuple[int, int], CompiledTemplate]] = {}
+        self.lock = threading.Lock()
+
+    def get(self, name: str) -> CompiledTemplate:
+        with self.lock:
+            try:
+                return self._get(name)
+            except FileNotFoundError:
+                # a template went away since the index was made
+                self.scan()
+                return self._get(name)
+
+    def render(self, name: str, **values) -> str:
+        return self.get(name).render(**values)
+
+    def refresh(self) -> None:
+        '''Pick up templates added or removed since the index was loaded'''
+        with self.lock:
+            if self.index is not None and not self.is_index_current(self.index):
+                self.scan()
+
+    def _get(self, name: str) -> CompiledTemplate:
+        if self.index is None:
+            self.load()
+
+        entry = self.index['templates'].get(name)
+        if entry is None:
+            raise FileNotFoundError(f"Template '{name}' not found in {', '.join(self.dirs)}")
+
+        st = os.stat(entry['path'])
+        key = (st.st_mtime_ns, st.st_size)
+        cached = self.compiled.get(name)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+        if key != (entry.get('mtime_ns'), entry.get('size')) or 'text' not in entry:
+            with open(entry['path'], mode='rb') as f:
+                content = f.read()
+            sha256 = hashlib.sha256(content).hexdigest()
+            if sha256 != entry.get('sha256'):
+                logging.debug(f"Template {entry['path']} changed")
+                entry['text'] = content.decode('utf-8')
+                entry['sha256'] = sha256
+            entry['mtime_ns'], entry['size'] = key
+            self.dirty = True
+
+        # a touched but unchanged template keeps its compiled form
+        if cached is not None and cached[1].sha256 == entry['sha256'] and cached[1].path == entry['path']:
+            compiled = cached[1]
+        else:
+            compiled = compile_template(entry['path'], entry['sha256'], entry['text'])
+        self.compiled[name] = (key, compiled)
+        return compiled
+
+    def load(self) -> None:
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = None
+
+        if index is not None and self.is_index_current(index):
+            self.index = index
+        else:
+            self.index = index or {}
+            self.scan()
+
+    def is_index_current(self, index: dict) -> bool:
+        if index.get('roots') != self.dirs:
+            return False
+        return all(get_mtime_ns(path) == mtime_ns for path, mtime_ns in index.get('dirs', {}).items())
+
+    def scan(self) -> None:
+        '''Walk the template trees; keeps the text of templates that resolve to the same file'''
+        previous = self.index.get('templates', {}) if self.index else {}
+        dirs = {}
+        templates = {}
+
+        # walk the lowest precedence tree first so that overrides replace shipped templates
+        for root in reversed(self.dirs):
+            dirs[root] = get_mtime_ns(root)
+            for dir_path, dir_names, file_names in os.walk(root):
+                dir_names.sort()
+                if dir_path != root:
+                    dirs[dir_path] = get_mtime_ns(dir_path)
+                for file_name in sorted(file_names):
+                    if file_name.startswith('.'):
+                        continue
+                    path = os.path.join(dir_path, file_name)
+                    name = os.path.relpath(path, root).replace(os.sep, '/')
+                    entry = previous.get(name)
+                    templates[name] = entry if entry is not None and entry['path'] == path else {'path': path}
+
+        logging.debug(f"Found {len(templates)} templates in {', '.join(self.dirs)}")
+        self.index = {'roots': list(self.dirs), 'dirs': dirs, 'templates': templates}
+        self.dirty = True
+
+    def save(self) -> None:
+        '''Persist the index when this run changed it'''
+        with self.lock:
+            if not self.dirty:
+                return
+            try:
+                atomic_write(self.index_path, json.dumps(self.index, indent=4, sort_keys=True).encode('utf-8'))
+                self.dirty = False
+            except OSError as e:
+                logging.debug(f"Could not save the template index '{self.index_path}': {e}")
+
+
+def get_mtime_ns(path: str) -> int | None:
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+@cache
+def load_template_store(dirs: tuple[str, ...], index_path: str) -> TemplateStore:
+    return TemplateStore(list(dirs), index_path)
+
+
+def get_template_store() -> TemplateStore:
+    '''The store for the current overrides; shared by every render in this process'''
+    dirs = (os.path.abspath(target_path(TEMPLATE_OVERRIDES_DIR)), SHIPPED_TEMPLATES_DIR)
+    return load_template_store(dirs, os.path.abspath(target_path(TEMPLATE_INDEX_PATH)))
+
+
+def render_template(name: str, **values) -> str:
+    return get_template_store().render(name, **values)
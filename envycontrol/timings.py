@@ -0,0 +1,141 @@
+import contextlib
+import json
+import os
+import threading
+import time
+
+# Note: keep this module cheap to import; spans are no-ops unless recording
+
+TIMINGS_ENV = 'ENVYCONTROL_TIMINGS'
+TIMINGS_FORMAT_ENV = 'ENVYCONTROL_TIMINGS_FORMAT'
+TIMINGS_PROFILE_ENV = 'ENVYCONTROL_TIMINGS_PROFILE'
+
+TIMINGS_FORMATS = ['json', 'trace']
+TIMINGS_VERSION = 1
+
+recorder = None
+
+
+class Recorder:
+    '''Spans of one invocation: phases, steps, external commands and file operations'''
+
+    def __init__(self, argv) -> None:
+        self.argv = argv
+        self.started = time.time()
+        self.start_ns = time.perf_counter_ns()
+        self.events = []
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def span(self, category, name, **args):
+        start_ns = time.perf_counter_ns()
+        cpu_start_ns = time.thread_time_ns()
+        try:
+            yield args
+        finally:
+            event = {
+                'category': category,
+                'name': name,
+                'start_ms': (start_ns - self.start_ns) / 1_000_000,
+                'wall_ms': (time.perf_counter_ns() - start_ns) / 1_000_000,
+                'cpu_ms': (time.thread_time_ns() - cpu_start_ns) / 1_000_000,
+                'thread': threading.current_thread().name,
+                'args': args,
+            }
+            with self.lock:
+                self.events.append(event)
+
+    def to_json(self):
+        summary = {}
+        for event in self.events:
+            totals = summary.setdefault(event['category'], {'count': 0, 'wall_ms': 0.0, 'cpu_ms': 0.0})
+            totals['count'] += 1
+            totals['wall_ms'] += event['wall_ms']
+            totals['cpu_ms'] += event['cpu_ms']
+
+        from envycontrol import VERSION
+        return {
+            'version': TIMINGS_VERSION,
+            'envycontrol': VERSION,
+            'argv': self.argv,
+            'started': self.started,
+            'summary': summary,
+            'events': sorted(self.events, key=lambda event: event['start_ms']),
+        }
+
+    def to_trace(self):
+        '''Chrome trace-event format; load in chrome://tracing or Perfetto'''
+        threads = {}
+        trace_events = []
+        for event in sorted(self.events, key=lambda event: event['start_ms']):
+            tid = threads.setdefault(event['thread'], len(threads) + 1)
+            trace_events.append({
+                'name': event['name'],
+                'cat': event['category'],
+                'ph': 'X',
+                'ts': event['start_ms'] * 1000,
+                'dur': event['wall_ms'] * 1000,
+                'pid': os.getpid(),
+                'tid': tid,
+                'args': {**event['args'], 'cpu_ms': event['cpu_ms']},
+            })
+        trace_events += [{'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': tid, 'args': {'name': name}}
+                         for name, tid in threads.items()]
+        return {'traceEvents': trace_events, 'displayTimeUnit': 'ms', 'otherData': {'argv': self.argv}}
+
+    def write(self, path, fmt='json'):
+        content = self.to_trace() if fmt == 'trace' else self.to_json()
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(content, indent=4, default=str) + '\n')
+
+
+def span(category, name, **args):
+    '''Time the block as one event; yields args so the block can add results, e.g., an exit code'''
+    if recorder is None:
+        return contextlib.nullcontext(args)
+    return recorder.span(category, name, **args)
+
+
+@contextlib.contextmanager
+def recording(path, argv, fmt='json', profile_path=None):
+    '''Record the spans of the block into path; with profile_path, also a cProfile dump of the main thread'''
+    global recorder
+    recorder = Recorder(argv)
+
+    profiler = None
+    if profile_path:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        with recorder.span('invocation', 'envycontrol', argv=argv):
+            yield recorder
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(profile_path)
+        recorder.write(path, fmt)
+        recorder = None
+
+
+def pop_timings_options(argv):
+    '''(path, format, profile path, argv without them); the options apply to every verb, so main() takes them out'''
+    options = {
+        '--timings': os.environ.get(TIMINGS_ENV) or None,
+        '--timings-format': os.environ.get(TIMINGS_FORMAT_ENV) or 'json',
+        '--timings-profile': os.environ.get(TIMINGS_PROFILE_ENV) or None,
+    }
+    rest = []
+    args = iter(argv)
+    for arg in args:
+        name, sep, value = arg.partition('=')
+        if name in options:
+            options[name] = value if sep else next(args, None)
+            if not options[name]:
+                raise ValueError(f'{name} needs a value')
+        else:
+            rest.append(arg)
+
+    if options['--timings-format'] not in TIMINGS_FORMATS:
+        raise ValueError(f"--timings-format must be one of {TIMINGS_FORMATS}")
+    return options['--timings'], options['--timings-format'], options['--timings-profile'], rest
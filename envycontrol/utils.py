@@ -2,210 +2,206 @@
 import logging
 import os
 import re
-import subprocess
 import sys
 
-from envycontrol import (BLACKLIST_CONTENT, BLACKLIST_PATH, COOLBITS,
-                         EXTRA_XORG_90_PATH, EXTRA_XORG_CONTENT,
-                         EXTRA_XORG_PATH, FORCE_COMP, LIGHTDM_CONFIG_CONTENT,
+from envycontrol import (BLACKLIST_PATH, EXTRA_XORG_90_PATH, EXTRA_XORG_PATH,
                          LIGHTDM_CONFIG_PATH, LIGHTDM_SCRIPT_PATH,
-                         MODESET_CONTENT, MODESET_CURRENT_CONTENT,
-                         MODESET_CURRENT_RTD3, MODESET_PATH, MODESET_RTD3,
-                         NVIDIA_XRANDR_SCRIPT, SDDM_XSETUP_PATH,
-                         UDEV_INTEGRATED, UDEV_INTEGRATED_PATH,
-                         UDEV_PM_CONTENT, UDEV_PM_PATH, XORG_AMD, XORG_INTEL,
-                         XORG_PATH)
-
-
-def graphics_mode_switcher(*, switch, dm, force_comp, coolbits, rtd3, use_nvidia_current, **kwargs):
+                         MODESET_PATH, SDDM_XSETUP_PATH, UDEV_INTEGRATED_PATH,
+                         UDEV_PM_PATH, XORG_PATH)
+from envycontrol.backupstore import get_backup_store
+from envycontrol.drm import get_provider_name, get_vendor_card
+from envycontrol.gpufamily import get_nvidia_architecture
+from envycontrol.hardware import HardwareContext, NvidiaGpuNotFoundError
+from envycontrol.initsystem import NVIDIA_PERSISTENCED_SERVICE
+from envycontrol.journal import RESET_MODE, apply_journaled
+from envycontrol.manifest import write_manifest
+from envycontrol.pci import (AMD_VENDOR_ID, INTEL_VENDOR_ID, NVIDIA_VENDOR_ID,
+                             get_display_devices)
+from envycontrol.query import get_current_mode  # noqa: F401 - re-exported
+from envycontrol.replay import host_path
+from envycontrol.rulesengine import RuleContext, RuleError, run_rules
+from envycontrol.staging import StagedChanges
+from envycontrol.steps import Step, StepError, run_steps
+from envycontrol.target import target_path
+from envycontrol.templatestore import get_template_store, render_template
+from envycontrol.timings import span
+
+
+def graphics_mode_switcher(*, switch, dm, force_comp, coolbits, rtd3, use_nvidia_current, init='systemd', hw=None,
+                           **kwargs):
     print(f"Switching to {switch} mode")
 
-    if switch == 'integrated':
-
-        if logging.getLogger().level == logging.DEBUG:
-            service = subprocess.run(
-                ["systemctl", "disable", "nvidia-persistenced.service"])
-        else:
-            service = subprocess.run(
-                ["systemctl", "disable", "nvidia-persistenced.service"],
-                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        if service.returncode == 0:
-            print('Successfully disabled nvidia-persistenced.service')
-        else:
-            logging.error("An error ocurred while disabling service")
-
-        cleanup()
-
-        # blacklist all nouveau and Nvidia modules
-        create_file(BLACKLIST_PATH, BLACKLIST_CONTENT)
-
-        # power off the Nvidia GPU with udev rules
-        create_file(UDEV_INTEGRATED_PATH, UDEV_INTEGRATED)
-
-    elif switch == 'hybrid':
+    if switch == 'hybrid':
         print(f"Enable PCI-Express Runtime D3 (RTD3) Power Management: {rtd3 or False}")
-        cleanup()
-
-        if logging.getLogger().level == logging.DEBUG:
-            service = subprocess.run(
-                ["systemctl", "enable", "nvidia-persistenced.service"])
-        else:
-            service = subprocess.run(
-                ["systemctl", "enable", "nvidia-persistenced.service"],
-                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        if service.returncode == 0:
-            print('Successfully enabled nvidia-persistenced.service')
-        else:
-            logging.error("An error ocurred while enabling service")
-
-        if rtd3 == None:
-            if use_nvidia_current:
-                create_file(MODESET_PATH, MODESET_CURRENT_CONTENT)
-            else:
-                create_file(MODESET_PATH, MODESET_CONTENT)
-        else:
-            # setup rtd3
-            if use_nvidia_current:
-                create_file(
-                    MODESET_PATH, MODESET_CURRENT_RTD3.format(rtd3))
-            else:
-                create_file(MODESET_PATH, MODESET_RTD3.format(rtd3))
-            create_file(UDEV_PM_PATH, UDEV_PM_CONTENT)
-
     elif switch == 'nvidia':
         print(f"Enable ForceCompositionPipeline: {force_comp}")
         print(f"Enable Coolbits: {coolbits or False}")
 
-        if logging.getLogger().level == logging.DEBUG:
-            service = subprocess.run(
-                ["systemctl", "enable", "nvidia-persistenced.service"])
-        else:
-            service = subprocess.run(
-                ["systemctl", "enable", "nvidia-persistenced.service"],
-                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        if service.returncode == 0:
-            print('Successfully enabled nvidia-persistenced.service')
-        else:
-            logging.error("An error ocurred while enabling service")
-
-        cleanup()
-        # get the Nvidia dGPU PCI bus
-        nvidia_gpu_pci_bus = get_nvidia_gpu_pci_bus()
-
-        # get iGPU vendor
-        igpu_vendor = get_igpu_vendor()
-
-        # create the X.org config
-        if igpu_vendor == 'intel':
-            create_file(XORG_PATH, XORG_INTEL.format(nvidia_gpu_pci_bus))
-        elif igpu_vendor == 'amd':
-            create_file(XORG_PATH, XORG_AMD.format(nvidia_gpu_pci_bus))
-
-        # enable modeset for Nvidia driver
-        if use_nvidia_current:
-            create_file(MODESET_PATH, MODESET_CURRENT_CONTENT)
-        else:
-            create_file(MODESET_PATH, MODESET_CONTENT)
-
-        # extra Xorg config
-        if force_comp and coolbits != None:
-            create_file(EXTRA_XORG_PATH, EXTRA_XORG_CONTENT + FORCE_COMP +
-                        COOLBITS.format(coolbits) + 'EndSection\n')
-        elif force_comp:
-            create_file(EXTRA_XORG_PATH, EXTRA_XORG_CONTENT +
-                        FORCE_COMP + 'EndSection\n')
-        elif coolbits != None:
-            create_file(EXTRA_XORG_PATH, EXTRA_XORG_CONTENT +
-                        COOLBITS.format(coolbits) + 'EndSection\n')
-
-        # try to detect the display manager if not provided
-        if dm == None:
-            display_manager = get_display_manager()
-        else:
-            display_manager = dm
-
-        # only sddm and lightdm require further config
-        if display_manager == 'sddm':
-            # backup Xsetup
-            if os.path.exists(SDDM_XSETUP_PATH):
-                logging.info("Creating Xsetup backup")
-                with open(SDDM_XSETUP_PATH, mode='r', encoding='utf-8') as f:
-                    create_file(SDDM_XSETUP_PATH+'.bak', f.read())
-            create_file(SDDM_XSETUP_PATH,
-                        generate_xrandr_script(igpu_vendor), True)
-        elif display_manager == 'lightdm':
-            create_file(LIGHTDM_SCRIPT_PATH,
-                        generate_xrandr_script(igpu_vendor), True)
-            create_file(LIGHTDM_CONFIG_PATH, LIGHTDM_CONFIG_CONTENT)
+    # hardware facts come from --dm, the cache or live probes; each is resolved once
+    hw = hw or HardwareContext()
+    if dm != None:
+        hw.set('display_manager', dm)
+
+    # nothing on the system changes before the journal is written, so the probes run alone
+    with span('phase', 'probe'):
+        facts = run_switch_steps(get_probe_steps(hw, switch))
+
+    # collect every removal and write in a fixed order, then apply only what differs from disk
+    changes = StagedChanges(get_backup_store())
+    with span('phase', 'cleanup'):
+        cleanup(changes)
+    with span('phase', 'rules'):
+        stage_switch(changes, switch=switch, facts=facts, force_comp=force_comp, coolbits=coolbits, rtd3=rtd3,
+                     use_nvidia_current=use_nvidia_current, init=init)
+
+    # keep what was learnt about the templates for the next run
+    get_template_store().save()
+
+    paths = list(changes.changes)
+    services = [(NVIDIA_PERSISTENCED_SERVICE, switch != 'integrated', init)]
+    with span('phase', 'apply'):
+        # the service and the files; a switch cut short, e.g., by a power loss, is finished by the next run
+        changed = apply_journaled(changes, switch, services)
+    logging.info(f"Changed {len(changed)} file(s)")
+
+    # `--check` compares the disk with what this switch left behind
+    with span('phase', 'manifest'):
+        write_manifest(switch, paths, services)
 
     # rebuild_initramfs()
     print('Operation completed successfully')
     print('Please reboot your computer for changes to take effect!')
 
 
-def cleanup():
-    # define list of files to remove
-    to_remove = [
-        BLACKLIST_PATH,
-        UDEV_INTEGRATED_PATH,
-        UDEV_PM_PATH,
-        XORG_PATH,
-        EXTRA_XORG_PATH,
-        EXTRA_XORG_90_PATH,
-        MODESET_PATH,
-        LIGHTDM_SCRIPT_PATH,
-        LIGHTDM_CONFIG_PATH,
+def get_probe_steps(hw, switch):
+    '''Steps resolving the hardware facts the rules of a mode need from hw'''
+    if switch == 'hybrid':
+        # --rtd3 depends on the architecture; unknown while the GPU is off the bus
+        return [Step('nvidia_architecture', lambda: hw.get('nvidia_architecture'))]
+    if switch != 'nvidia':
+        return []
+
+    return [
+        # get the Nvidia dGPU PCI bus
+        Step('nvidia_gpu_pci_bus', lambda: hw.get('nvidia_gpu_pci_bus')),
+        # get iGPU vendor
+        Step('igpu_vendor', lambda: hw.get('igpu_vendor')),
+        # try to detect the display manager if not provided
+        Step('display_manager', lambda: hw.get('display_manager')),
+        # only sddm and lightdm require the xrandr script
+        Step('xrandr_script', lambda igpu_vendor, display_manager:
+             generate_xrandr_script(igpu_vendor, hw) if display_manager in ['sddm', 'lightdm'] else None,
+             deps=['igpu_vendor', 'display_manager']),
     ]
 
-    # remove each file in the list
-    for file_path in to_remove:
-        try:
-            os.remove(file_path)
-            logging.info(f"Removed file {file_path}")
-        except OSError as e:
-            # only warn if file exists (code 2)
-            if e.errno != 2:
-                logging.error(f"Failed to remove file '{file_path}': {e}")
-
-    # restore Xsetup backup if found
-    backup_path = SDDM_XSETUP_PATH + ".bak"
-    if os.path.exists(backup_path):
-        logging.info("Restoring Xsetup backup")
-        with open(backup_path, mode="r", encoding="utf-8") as f:
-            create_file(SDDM_XSETUP_PATH, f.read())
-        # remove backup
-        os.remove(backup_path)
-        logging.info(f"Removed file {backup_path}")
-
-
-def get_nvidia_gpu_pci_bus():
-    lspci_output = subprocess.check_output(['lspci']).decode('utf-8')
-    for line in lspci_output.splitlines():
-        if 'NVIDIA' in line and ('VGA compatible controller' in line or '3D controller' in line):
-            # remove leading zeros
-            pci_bus_id = line.split()[0].replace("0000:", "")
-            logging.info(f"Found Nvidia GPU at {pci_bus_id}")
-            break
-    else:
-        logging.error("Could not find Nvidia GPU")
-        print("Try switching to hybrid mode first!")
+
+def run_switch_steps(steps):
+    try:
+        return run_steps(steps)
+    except StepError as e:
+        if isinstance(e.failures.get('nvidia_gpu_pci_bus'), NvidiaGpuNotFoundError):
+            exit_without_nvidia_gpu(e.failures['nvidia_gpu_pci_bus'])
+        exit_codes = [f.code for f in e.failures.values() if isinstance(f, SystemExit)]
+        sys.exit(exit_codes[0] if exit_codes else 1)
+
+
+def exit_without_nvidia_gpu(e):
+    logging.error(e)
+    print("Try switching to hybrid mode first!")
+    sys.exit(1)
+
+
+def stage_switch(changes, *, switch, facts, force_comp, coolbits, rtd3, use_nvidia_current, init='systemd'):
+    '''Stage the files of a mode on changes, usually on top of cleanup(); returns the context the rules ran with'''
+    # the rules matching the mode, display manager, init system and iGPU stage the files of the mode
+    ctx = RuleContext(mode=switch, dm=facts.get('display_manager'), init=init, igpu=facts.get('igpu_vendor'),
+                      changes=changes, force_comp=force_comp, coolbits=coolbits, rtd3=rtd3,
+                      use_nvidia_current=use_nvidia_current, facts=facts)
+    try:
+        run_rules(ctx)
+    except RuleError as e:
+        logging.error(e)
         sys.exit(1)
+    return ctx
+
+
+# files managed by EnvyControl; removed by cleanup(), never restored from the backup store
+MANAGED_PATHS = [
+    BLACKLIST_PATH,
+    UDEV_INTEGRATED_PATH,
+    UDEV_PM_PATH,
+    XORG_PATH,
+    EXTRA_XORG_PATH,
+    EXTRA_XORG_90_PATH,
+    MODESET_PATH,
+    LIGHTDM_SCRIPT_PATH,
+    LIGHTDM_CONFIG_PATH,
+]
+
+
+def cleanup(changes=None):
+    '''Stage removal of the managed files and restore of the other files EnvyControl changed; applied right away
+    unless the caller owns the staged changes'''
+    staged = changes if changes is not None else StagedChanges(get_backup_store())
+    store = staged.backups if staged.backups is not None else get_backup_store()
+
+    # remove each managed file
+    for file_path in MANAGED_PATHS:
+        staged.remove(file_path)
+
+    # adopt the Xsetup backup made by earlier versions as its original
+    backup_path = SDDM_XSETUP_PATH + ".bak"
+    if os.path.exists(target_path(backup_path)):
+        logging.info("Moving Xsetup backup into the backup store")
+        store.set_original(SDDM_XSETUP_PATH, staged.read(backup_path).encode('utf-8'),
+                           os.stat(target_path(backup_path)).st_mode & 0o777)
+        staged.remove(backup_path)
+
+    # restore what the files outside of MANAGED_PATHS, e.g., Xsetup, were before EnvyControl first changed them
+    for file_path, content, mode in store.get_originals():
+        if file_path not in MANAGED_PATHS:
+            logging.info(f"Restoring {file_path} from the backup store")
+            staged.write(file_path, content.decode('utf-8'), bool(mode & 0o111))
+
+    if changes is None:
+        apply_journaled(staged, RESET_MODE)
+
+
+def find_nvidia_gpu_pci_bus():
+    for device in get_display_devices():
+        if device.vendor == NVIDIA_VENDOR_ID and device.is_vga_or_3d:
+            logging.info(f"Found Nvidia GPU at {device.address}")
+            # need to return the BusID in 'PCI:bus:device:function' format
+            return device.bus_id
+    return None
+
 
-    # need to return the BusID in 'PCI:bus:device:function' format
-    # also perform hexadecimal to decimal conversion
-    bus, device_function = pci_bus_id.split(":")
-    device, function = device_function.split(".")
-    return f"PCI:{int(bus, 16)}:{int(device, 16)}:{int(function, 16)}"
+def find_nvidia_architecture():
+    for device in get_display_devices():
+        if device.vendor == NVIDIA_VENDOR_ID and device.is_vga_or_3d:
+            architecture = get_nvidia_architecture(device.device)
+            logging.info(f"Nvidia GPU {device.device:04x} is of the {architecture or 'unknown'} architecture")
+            return architecture
+    return None
+
+
+def get_nvidia_gpu_pci_bus(probes=None):
+    if probes is None:
+        bus_id = find_nvidia_gpu_pci_bus()
+    else:
+        bus_id = probes.probe('nvidia_gpu_pci_bus', find_nvidia_gpu_pci_bus).value
+    if bus_id is None:
+        raise NvidiaGpuNotFoundError()
+    return bus_id
 
 
 def get_igpu_vendor():
-    lspci_output = subprocess.check_output(["lspci"]).decode('utf-8')
-    for line in lspci_output.splitlines():
-        if 'VGA compatible controller' in line or 'Display controller' in line:
-            if 'Intel' in line:
+    for device in get_display_devices():
+        if device.is_vga_or_display:
+            if device.vendor == INTEL_VENDOR_ID:
                 logging.info("Found Intel iGPU")
                 return 'intel'
-            elif 'ATI' in line or 'AMD' in line or 'AMD/ATI' in line:
+            elif device.vendor == AMD_VENDOR_ID:
                 logging.info("Found AMD iGPU")
                 return 'amd'
     logging.warning("Could not find Intel or AMD iGPU")
@@ -214,7 +210,7 @@ def get_igpu_vendor():
 
 def get_display_manager():
     try:
-        with open('/etc/systemd/system/display-manager.service', 'r', encoding='utf-8') as f:
+        with open(host_path('/etc/systemd/system/display-manager.service'), 'r', encoding='utf-8') as f:
             content = f.read()
             match = re.search(r'ExecStart=(.+)\n', content)
             if match:
@@ -226,119 +222,59 @@ def get_display_manager():
         logging.warning("Display Manager detection is not available")
 
 
-def generate_xrandr_script(igpu_vendor):
+def generate_xrandr_script(igpu_vendor, hw=None):
+    if not os.path.exists(host_path('/usr/bin/xrandr')):
+        logging.warning("The 'xrandr' command is not available. Make sure the package is installed!")
+
     if igpu_vendor == 'intel':
-        return NVIDIA_XRANDR_SCRIPT.format('modesetting')
+        return render_template('xrandr/nvidia.sh', provider='modesetting')
     elif igpu_vendor == 'amd':
-        amd_igpu_name = get_amd_igpu_name()
+        amd_igpu_name = hw.get('amd_igpu_name') if hw else get_amd_igpu_name()
         if amd_igpu_name != None:
-            return NVIDIA_XRANDR_SCRIPT.format(amd_igpu_name)
+            return render_template('xrandr/nvidia.sh', provider=amd_igpu_name)
         else:
-            return NVIDIA_XRANDR_SCRIPT.format('modesetting')
+            return render_template('xrandr/nvidia.sh', provider='modesetting')
     else:
-        return NVIDIA_XRANDR_SCRIPT.format('modesetting')
+        return render_template('xrandr/nvidia.sh', provider='modesetting')
 
 
 def get_amd_igpu_name():
-    if not os.path.exists('/usr/bin/xrandr'):
-        logging.warning("The 'xrandr' command is not available. Make sure the package is installed!")
+    # read from sysfs, so it works without an X server, e.g., from a TTY, a chroot or over SSH
+    card = get_vendor_card(AMD_VENDOR_ID)
+    if card is None:
+        logging.warning("Could not find AMD iGPU in DRM cards.")
         return None
 
-    try:
-        xrandr_output = subprocess.check_output(
-            ['xrandr', '--listproviders']).decode('utf-8')
-    except subprocess.CalledProcessError:
-        logging.warning(
-            "Failed to run the 'xrandr' command.")
-
-    pattern = re.compile(r'(name:).*(ATI*|AMD*|AMD\/ATI)*')
+    provider = get_provider_name(card)
+    logging.info(f"Found AMD iGPU provider {provider} on {card.name}")
+    return provider
 
-    if pattern.findall(xrandr_output):
-        return re.search(pattern, xrandr_output).group(0)[5:]
-    else:
-        logging.warning(
-            "Could not find AMD iGPU in 'xrandr' output.")
-        return None
 
+def create_file(path, content, executable=False):
+    changes = StagedChanges(get_backup_store())
+    changes.write(path, content, executable)
+    changes.apply()
 
-def rebuild_initramfs():
-    # Debian and Ubuntu derivatives
-    if os.path.exists('/etc/debian_version'):
-        command = ['update-initramfs', '-u', '-k', 'all']
-    # RHEL and SUSE derivatives
-    elif os.path.exists('/etc/redhat-release') or os.path.exists('/usr/bin/zypper'):
-        command = ['dracut', '--force', '--regenerate-all']
-    # EndeavourOS with dracut
-    elif os.path.exists('/usr/lib/endeavouros-release') and os.path.exists('/usr/bin/dracut'):
-        command = ['dracut-rebuild']
-    else:
-        command = []
 
-    if len(command) != 0:
-        print('Rebuilding the initramfs...')
-        if logging.getLogger().level == logging.DEBUG:
-            p = subprocess.run(command)
-        else:
-            p = subprocess.run(
-                command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        if p.returncode == 0:
-            print('Successfully rebuilt the initramfs!')
-        else:
-            logging.error("An error ocurred while rebuilding the initramfs")
+# cleared by `envycontrol bench` and the tests, which only change a scratch copy of the sysroot
+require_root = True
 
 
-def create_file(path, content, executable=False):
-    try:
-        # create the parent folders if needed
-        if not os.path.exists(os.path.dirname(path)):
-            os.makedirs(os.path.dirname(path), exist_ok=True)
-        with open(path, mode='w', encoding='utf-8') as f:
-            f.write(content)
-        logging.info(f"Created file {path}")
-        if logging.getLogger().level == logging.DEBUG:
-            print(content)
-
-        # add execution privilege
-        if executable:
-            subprocess.run(['chmod', '+x', path], stdout=subprocess.DEVNULL)
-            logging.info(f"Added execution privilege to file {path}")
-    except OSError as e:
-        logging.error(f"Failed to create file '{path}': {e}")
+def set_require_root(required):
+    global require_root
+    require_root = required
 
 
 def assert_root():
-    if os.geteuid() != 0:
+    if require_root and os.geteuid() != 0:
         logging.error("This operation requires root privileges")
         sys.exit(1)
 
 
-def get_current_mode():
-    mode = 'hybrid'
-    if os.path.exists(BLACKLIST_PATH) and os.path.exists(UDEV_INTEGRATED_PATH):
-        mode = 'integrated'
-    elif os.path.exists(XORG_PATH) and os.path.exists(MODESET_PATH):
-        mode = 'nvidia'
-    return mode
-
-
 def get_igpu_bus_pci_bus():
-    lines = get_lspci_lines()
     rc = None
-    for line in lines:
-        if 'Intel' in line:
-            pci_bus_id = line.split()[0].replace("0000:", "")
-
-            # need to return the BusID in 'PCI:bus:device:function' format
-            # also perform hexadecimal to decimal conversion
-            bus, device_function = pci_bus_id.split(":")
-            device, function = device_function.split(".")
-
-            rc = f"PCI:{int(bus, 16)}:{int(device, 16)}:{int(function, 16)}"
+    for device in get_display_devices():
+        if device.is_vga_or_display and device.vendor == INTEL_VENDOR_ID:
+            # BusID in 'PCI:bus:device:function' format
+            rc = device.bus_id
     return rc
-
-
-def get_lspci_lines():
-    lspci_output = subprocess.check_output(["lspci"]).decode('utf-8')
-    lines = [line for line in lspci_output.splitlines()
-             if 'VGA compatible controller' in line or 'Display controller' in line]
-    return lines
@@ -0,0 +1,102 @@
+import gzip
+import hashlib
+import os
+
+from conftest import read_file
+from envycontrol import SDDM_XSETUP_PATH, XORG_PATH
+from envycontrol.backupstore import BackupStore, get_backup_store
+from envycontrol.staging import StagedChanges
+
+ORIGINAL_XSETUP = '#!/bin/sh\n# original\n'
+
+
+def write_xsetup(content: str) -> None:
+    os.makedirs(os.path.dirname(SDDM_XSETUP_PATH), exist_ok=True)
+    with open(SDDM_XSETUP_PATH, 'w', encoding='utf-8') as f:
+        f.write(content)
+    os.chmod(SDDM_XSETUP_PATH, 0o755)
+
+
+def list_objects(store: BackupStore) -> list[str]:
+    return [name for _, _, names in os.walk(os.path.join(store.store_dir, 'objects')) for name in names]
+
+
+def test_put_should_store_compressed_content_once(tmp_path) -> None:
+    store = BackupStore(str(tmp_path))
+    content = b'Section "Device"\n' * 100
+
+    digest = store.put(content)
+    assert digest == store.put(content)
+
+    assert [digest + '.gz'] == list_objects(store)
+    with open(store.get_object_path(digest), 'rb') as f:
+        compressed = f.read()
+    assert len(compressed) < len(content)
+    assert content == gzip.decompress(compressed) == store.get(digest)
+
+
+def test_staged_changes_should_back_up_before_modify_and_remove(tmp_path) -> None:
+    path = str(tmp_path / 'etc' / 'a.conf')
+    os.makedirs(os.path.dirname(path))
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('before\n')
+
+    store = BackupStore(str(tmp_path / 'store'))
+    changes = StagedChanges(store)
+    changes.write(path, 'after\n')
+    changes.apply()
+    changes.remove(path)
+    changes.apply()
+
+    entry = BackupStore(str(tmp_path / 'store')).index['files'][path]
+    assert hashlib.sha256(b'before\n').hexdigest() == entry['original']
+    assert hashlib.sha256(b'after\n').hexdigest() == entry['latest']
+    assert [(path, b'before\n', 0o644)] == store.get_originals()
+
+
+def test_repeated_switches_should_keep_the_original_xsetup(scratch_root, replay_hardware, run_main) -> None:
+    replay_hardware('intel_nvidia_sddm')
+    write_xsetup(ORIGINAL_XSETUP)
+
+    for _ in range(3):
+        run_main(['--switch', 'nvidia'])
+        assert 'xrandr' in read_file(SDDM_XSETUP_PATH)
+        run_main(['--switch', 'hybrid'])
+        assert ORIGINAL_XSETUP == read_file(SDDM_XSETUP_PATH)
+
+    store = get_backup_store()
+    entry = store.index['files'][SDDM_XSETUP_PATH]
+    assert hashlib.sha256(ORIGINAL_XSETUP.encode()).hexdigest() == entry['original']
+    assert 0o755 == entry['mode']
+    # every content is stored once; switching again adds nothing
+    objects = list_objects(store)
+    assert len(objects) == len(set(objects))
+    assert XORG_PATH in store.index['files']
+
+    run_main(['--switch', 'nvidia'])
+    assert objects == list_objects(get_backup_store())
+
+
+def test_reset_should_restore_from_the_store(scratch_root, replay_hardware, run_main) -> None:
+    replay_hardware('intel_nvidia_sddm')
+    write_xsetup(ORIGINAL_XSETUP)
+    run_main(['--switch', 'nvidia'])
+
+    run_main(['--reset'])
+
+    assert ORIGINAL_XSETUP == read_file(SDDM_XSETUP_PATH)
+    assert os.access(SDDM_XSETUP_PATH, os.X_OK)
+    assert not os.path.exists(XORG_PATH)
+
+
+def test_cleanup_should_adopt_an_old_xsetup_backup(scratch_root, replay_hardware, run_main) -> None:
+    replay_hardware('intel_nvidia_sddm')
+    write_xsetup('#!/bin/sh\nxrandr --auto\n')
+    with open(SDDM_XSETUP_PATH + '.bak', 'w', encoding='utf-8') as f:
+        f.write(ORIGINAL_XSETUP)
+
+    run_main(['--switch', 'nvidia'])
+    assert not os.path.exists(SDDM_XSETUP_PATH + '.bak')
+
+    run_main(['--switch', 'hybrid'])
+    assert ORIGINAL_XSETUP == read_file(SDDM_XSETUP_PATH)
@@ -0,0 +1,62 @@
+import json
+import os
+
+import pytest
+
+from envycontrol.bench import (bench_main, find_regressions, get_bench_cases,
+                               percentile, run_bench)
+from envycontrol.main import SUPPORTED_OPTIMUS_MODES
+
+
+def test_percentile_should_interpolate() -> None:
+    values = [1.0, 2.0, 3.0, 4.0]
+
+    assert 1.0 == percentile(values, 0)
+    assert 2.5 == percentile(values, 50)
+    assert 4.0 == percentile(values, 100)
+    assert 7.0 == percentile([7.0], 99)
+
+
+def test_bench_cases_should_cover_every_mode() -> None:
+    cases = get_bench_cases()
+
+    for mode in SUPPORTED_OPTIMUS_MODES:
+        assert ['--switch', mode] == cases[f'switch {mode}']
+        assert ['--switch', mode, '--rtd3'] == cases[f'switch {mode} --rtd3']
+
+
+def test_run_bench_should_report_statistics() -> None:
+    cases = {name: argv for name, argv in get_bench_cases().items() if name in ['query', 'cache-query']}
+
+    report = run_bench(cases, repeat=3, warmup=0)
+
+    for name in cases:
+        result = report['cases'][name]
+        assert 3 == result['runs']
+        assert not result.get('invalid')
+        assert result['min_ms'] <= result['p50_ms'] <= result['p99_ms'] <= result['max_ms']
+
+
+def test_find_regressions_should_apply_tolerance() -> None:
+    baseline = {'cases': {'query': {'p50_ms': 1.0}, 'cache-query': {'p50_ms': 1.0}}}
+    report = {'cases': {'query': {'p50_ms': 1.2}, 'cache-query': {'p50_ms': 1.3}, 'new': {'p50_ms': 9.0}}}
+
+    assert [('cache-query', 1.0, 1.3)] == find_regressions(report, baseline, tolerance=0.25)
+
+
+def test_failing_case_should_fail_the_run(tmp_path, replay_hardware) -> None:
+    report_path = str(tmp_path / 'bench.json')
+
+    with pytest.raises(SystemExit) as e:
+        bench_main(['--case', 'query', '--case', 'switch nvidia', '--repeat', '2', '--warmup', '0',
+                    '--replay', str(tmp_path), '--output', report_path])
+
+    assert 1 == e.value.code
+    with open(report_path, 'r', encoding='utf-8') as f:
+        cases = json.load(f)['cases']
+    assert {'argv': ['--switch', 'nvidia'], 'runs': 0, 'invalid': True, 'error': 'exit status 1'} == cases['switch nvidia']
+    assert 2 == cases['query']['runs']
+
+
+def test_switch_cases_should_pass_on_the_default_fixture(replay_hardware) -> None:
+    bench_main(['--case', 'switch nvidia', '--repeat', '1', '--warmup', '0', '--output', os.devnull])
@@ -0,0 +1,70 @@
+import json
+import os
+from argparse import Namespace
+
+import pytest
+
+from conftest import forbid_detection
+from envycontrol.cacheconfig import (CACHE_FILE_PATH, CACHE_VERSION,
+                                     CachedConfig)
+
+
+def run_adapter() -> CachedConfig:
+    with CachedConfig(Namespace(switch=None)).adapter() as adapter:
+        return adapter
+
+
+def read_cache() -> dict:
+    with open(CACHE_FILE_PATH, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+@pytest.fixture
+def hybrid_root(scratch_root, replay_hardware):
+    '''Scratch sysroot in hybrid mode on replayed hardware'''
+    replay_hardware('intel_nvidia_sddm')
+    if os.path.exists(CACHE_FILE_PATH):
+        os.remove(CACHE_FILE_PATH)
+    assert run_adapter().is_hybrid()
+    return replay_hardware
+
+
+def test_hybrid_run_should_create_versioned_cache(hybrid_root) -> None:
+    cache = read_cache()
+
+    assert CACHE_VERSION == cache['version']
+    assert '6.8.0-45-generic' == cache['fingerprint']['kernel']
+    assert '550.107.02' == cache['fingerprint']['nvidia_driver']
+    assert 'PCI:1:0:0' == cache['switch']['nvidia_gpu_pci_bus']
+
+
+def test_unchanged_fingerprint_should_skip_detection_and_write(hybrid_root, monkeypatch) -> None:
+    before = os.stat(CACHE_FILE_PATH).st_mtime_ns
+    forbid_detection(monkeypatch)
+
+    run_adapter()
+
+    assert before == os.stat(CACHE_FILE_PATH).st_mtime_ns
+
+
+def test_changed_fingerprint_should_recreate_cache(hybrid_root) -> None:
+    hybrid_root('amd_nvidia_lightdm')
+
+    run_adapter()
+
+    assert 'lightdm' == read_cache()['metadata']['display_manager']
+
+
+def test_version_1_cache_should_be_migrated_and_recreated(hybrid_root) -> None:
+    cache = read_cache()
+    del cache['version'], cache['fingerprint']
+    with open(CACHE_FILE_PATH, 'w', encoding='utf-8') as f:
+        json.dump(cache, f)
+
+    config = CachedConfig(Namespace(switch=None))
+    config.read_cache_file()
+    assert config.obj['fingerprint'] is None
+
+    run_adapter()
+    assert CACHE_VERSION == read_cache()['version']
+    assert read_cache()['fingerprint'] is not None
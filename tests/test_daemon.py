@@ -0,0 +1,74 @@
+import json
+import os
+import threading
+
+import pytest
+
+from envycontrol import (BLACKLIST_PATH, MODESET_PATH, QUERY_SOCKET_PATH,
+                         UDEV_INTEGRATED_PATH, XORG_PATH)
+from envycontrol.daemon import QueryDaemon
+from envycontrol.query import ask_daemon
+
+
+@pytest.fixture
+def daemon(scratch_root):
+    daemon = QueryDaemon()
+    thread = threading.Thread(target=daemon.serve_forever)
+    thread.start()
+    while not daemon.running:
+        pass
+    yield daemon
+    daemon.shutdown()
+    thread.join()
+
+
+def write_files(*paths: str) -> None:
+    for path in paths:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('# test\n')
+
+
+def query(run_main, capsys) -> str:
+    run_main(['-q'])
+    return capsys.readouterr().out.strip()
+
+
+def test_daemon_should_answer_query(daemon, capsys, run_main) -> None:
+    assert 'hybrid' == ask_daemon('mode')
+    assert 'hybrid' == query(run_main, capsys)
+
+
+def test_daemon_should_follow_switches(daemon) -> None:
+    assert 'hybrid' == ask_daemon('mode')
+
+    write_files(XORG_PATH, MODESET_PATH)
+    assert 'nvidia' == ask_daemon('mode')
+
+    os.remove(XORG_PATH)
+    os.remove(MODESET_PATH)
+    write_files(BLACKLIST_PATH, UDEV_INTEGRATED_PATH)
+    assert 'integrated' == ask_daemon('mode')
+
+
+def test_daemon_should_serve_state(daemon) -> None:
+    state = json.loads(ask_daemon('state'))
+
+    assert 'hybrid' == state['mode']
+    assert {} == state['facts']
+    assert ask_daemon('cache').startswith('ERROR: Could not read')
+
+
+def test_query_should_fall_back_without_daemon(scratch_root, capsys, run_main) -> None:
+    assert ask_daemon('mode') is None
+    assert 'hybrid' == query(run_main, capsys)
+
+
+def test_daemon_should_remove_socket_on_shutdown(daemon) -> None:
+    assert os.path.exists(QUERY_SOCKET_PATH)
+
+    daemon.shutdown()
+    while os.path.exists(QUERY_SOCKET_PATH):
+        pass
+
+    assert ask_daemon('mode') is None
@@ -0,0 +1,91 @@
+import os
+
+import pytest
+
+from envycontrol import drm
+from envycontrol.drm import (MODESETTING_PROVIDER, get_drm_cards,
+                             get_provider_name, get_vendor_card)
+from envycontrol.pci import AMD_VENDOR_ID
+from envycontrol.replay import set_replay_dir
+from envycontrol.utils import get_amd_igpu_name
+
+
+def make_card(root, name: str, address: str, vendor: int, device: int, driver: str, boot_vga: int,
+              revision: int = 0xc5) -> None:
+    path = root / 'sys/bus/pci/devices' / address
+    path.mkdir(parents=True)
+    (path / 'vendor').write_text(f'0x{vendor:04x}\n')
+    (path / 'device').write_text(f'0x{device:04x}\n')
+    (path / 'class').write_text('0x030000\n')
+    (path / 'revision').write_text(f'0x{revision:02x}\n')
+    (path / 'boot_vga').write_text(f'{boot_vga}\n')
+    os.symlink(f'../../../../bus/pci/drivers/{driver}', path / 'driver')
+
+    card = root / 'sys/class/drm' / name
+    card.mkdir(parents=True)
+    os.symlink(f'../../../bus/pci/devices/{address}', card / 'device')
+
+
+@pytest.fixture
+def sysfs_drm(tmp_path):
+    make_card(tmp_path, 'card0', '0000:03:00.0', 0x1002, 0x73df, 'amdgpu', 0)
+    make_card(tmp_path, 'card1', '0000:05:00.0', 0x1002, 0x1638, 'amdgpu', 1)
+    (tmp_path / 'sys/class/drm/card1-eDP-1').mkdir()
+    (tmp_path / 'sys/class/drm/renderD128').mkdir()
+
+    ids = tmp_path / 'usr/share/libdrm/amdgpu.ids'
+    ids.parent.mkdir(parents=True)
+    ids.write_text('# List of AMDGPU IDs\n\n1.0.0\n1638,\tC5,\tAMD Radeon Graphics\n')
+
+    set_replay_dir(str(tmp_path))
+    yield tmp_path
+    set_replay_dir(None)
+
+
+def install_amdgpu_ddx(root) -> None:
+    path = root / 'usr/lib/xorg/modules/drivers/amdgpu_drv.so'
+    path.parent.mkdir(parents=True)
+    path.touch()
+    drm.clear_caches()
+
+
+def test_get_drm_cards_should_skip_connectors_and_render_nodes(sysfs_drm):
+    cards = get_drm_cards()
+
+    assert ['card0', 'card1'] == [card.name for card in cards]
+    assert '0000:05:00.0' == cards[1].pci.address
+    assert 'amdgpu' == cards[1].pci.driver
+    assert cards[1].boot_vga
+    assert 0xc5 == cards[1].revision
+
+
+def test_get_vendor_card_should_prefer_boot_vga(sysfs_drm):
+    assert 'card1' == get_vendor_card(AMD_VENDOR_ID).name
+
+
+def test_provider_should_be_modesetting_without_amdgpu_ddx(sysfs_drm):
+    assert MODESETTING_PROVIDER == get_amd_igpu_name()
+
+
+def test_provider_should_name_amdgpu_ddx_provider(sysfs_drm):
+    install_amdgpu_ddx(sysfs_drm)
+
+    assert 'AMD Radeon Graphics @ pci:0000:05:00.0' == get_amd_igpu_name()
+    assert 'Unknown AMD Radeon GPU @ pci:0000:03:00.0' == get_provider_name(get_drm_cards()[0])
+
+
+def test_provider_should_not_need_xrandr(sysfs_drm, monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError('unexpected fork')
+
+    monkeypatch.setattr('subprocess.Popen', fail)
+
+    assert get_amd_igpu_name() is not None
+
+
+def test_missing_drm_should_not_find_amd_igpu(tmp_path):
+    set_replay_dir(str(tmp_path))
+    try:
+        assert get_amd_igpu_name() is None
+    finally:
+        set_replay_dir(None)
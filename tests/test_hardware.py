@@ -0,0 +1,85 @@
+import logging
+
+import pytest
+
+import envycontrol.utils
+from conftest import forbid_detection
+from envycontrol.fingerprint import (get_fingerprint_changes,
+                                     get_hardware_fingerprint)
+from envycontrol.hardware import HardwareContext, NvidiaGpuNotFoundError
+
+
+def test_switch_should_use_cached_facts(scratch_root, replay_hardware, monkeypatch, caplog, run_main) -> None:
+    replay_hardware('intel_nvidia_sddm')
+    run_main(['--cache-create'])
+    forbid_detection(monkeypatch)
+
+    with caplog.at_level(logging.INFO):
+        run_main(['--switch', 'nvidia'])
+
+    assert 'nvidia_gpu_pci_bus: PCI:1:0:0 (cached)' in caplog.messages
+    assert 'display_manager: sddm (cached)' in caplog.messages
+
+
+def test_dm_option_should_win_over_cache(replay_hardware) -> None:
+    replay_hardware('intel_nvidia_sddm')
+    hw = HardwareContext({'fingerprint': None, 'metadata': {'display_manager': 'sddm'}})
+
+    hw.set('display_manager', 'lightdm')
+
+    assert 'lightdm' == hw.get('display_manager')
+    assert 'option' == hw.sources['display_manager']
+
+
+def test_stale_cache_should_be_ignored(replay_hardware) -> None:
+    replay_hardware('amd_nvidia_lightdm')
+    hw = HardwareContext({'fingerprint': None, 'metadata': {'igpu_vendor': 'intel'}})
+
+    assert 'amd' == hw.get('igpu_vendor')
+    assert 'live' == hw.sources['igpu_vendor']
+
+
+def test_cached_bus_should_be_used_when_gpu_is_off_the_bus(monkeypatch) -> None:
+    monkeypatch.setattr(envycontrol.utils, 'find_nvidia_gpu_pci_bus', lambda: None)
+    hw = HardwareContext({'fingerprint': None, 'switch': {'nvidia_gpu_pci_bus': 'PCI:9:0:0'}})
+
+    assert 'PCI:9:0:0' == hw.get('nvidia_gpu_pci_bus')
+    assert 'cached, not on the bus' == hw.sources['nvidia_gpu_pci_bus']
+
+
+def test_moved_gpu_should_invalidate_the_cached_bus(replay_hardware) -> None:
+    replay_hardware('intel_nvidia_sddm')
+    fingerprint = get_hardware_fingerprint()
+    assert ['0000:01:00.0 10de:2520', '0000:01:00.1 10de:228e'] == fingerprint['nvidia_pci']
+    cache = {'fingerprint': {**fingerprint, 'nvidia_pci': ['0000:09:00.0 10de:2520', '0000:09:00.1 10de:228e']},
+             'switch': {'nvidia_gpu_pci_bus': 'PCI:9:0:0'}}
+
+    assert 'PCI:1:0:0' == HardwareContext(cache).get('nvidia_gpu_pci_bus')
+    assert [] == get_fingerprint_changes(cache['fingerprint'], {**fingerprint, 'nvidia_pci': None})
+
+
+def test_missing_gpu_without_cache_should_raise(monkeypatch) -> None:
+    monkeypatch.setattr(envycontrol.utils, 'find_nvidia_gpu_pci_bus', lambda: None)
+
+    with pytest.raises(NvidiaGpuNotFoundError):
+        HardwareContext().get('nvidia_gpu_pci_bus')
+
+
+def test_switch_without_gpu_should_exit(scratch_root, replay_hardware, monkeypatch, capsys, run_main) -> None:
+    replay_hardware('intel_nvidia_sddm')
+    monkeypatch.setattr(envycontrol.utils, 'find_nvidia_gpu_pci_bus', lambda: None)
+
+    with pytest.raises(SystemExit) as e:
+        run_main(['--switch', 'nvidia'])
+
+    assert 1 == e.value.code
+    assert 'Try switching to hybrid mode first!' in capsys.readouterr().out
+
+
+def test_facts_should_be_resolved_once(replay_hardware, monkeypatch) -> None:
+    replay_hardware('intel_nvidia_sddm')
+    hw = HardwareContext()
+    assert 'intel' == hw.get('igpu_vendor')
+
+    forbid_detection(monkeypatch)
+    assert 'intel' == hw.get('igpu_vendor')
@@ -0,0 +1,52 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+# cold import of the envycontrol modules used by `--query`, in microseconds
+QUERY_IMPORT_BUDGET_US = 25_000
+
+# modules the query fast path must never pull in
+HEAVY_MODULES = [
+    'argparse',
+    'logging',
+    'subprocess',
+    're',
+    'envycontrol.cacheconfig',
+    'envycontrol.utils',
+]
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_with_importtime(*args: str) -> tuple[str, dict[str, int]]:
+    p = subprocess.run([sys.executable, '-X', 'importtime', '-m', 'envycontrol', *args],
+                       cwd=PROJECT_DIR, capture_output=True, text=True, check=True)
+
+    self_times = {}
+    for line in p.stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, _, name = line.removeprefix('import time:').split('|')
+        self_times[name.strip()] = int(self_us)
+
+    return p.stdout, self_times
+
+
+@pytest.mark.parametrize('option', ['-q', '--query', '--cache-query'])
+def test_fast_options_should_not_import_heavy_modules(option: str) -> None:
+    _, self_times = run_with_importtime(option)
+
+    imported = [module for module in HEAVY_MODULES if module in self_times]
+
+    assert [] == imported
+
+
+def test_query_should_import_within_budget() -> None:
+    out, self_times = run_with_importtime('-q')
+
+    envycontrol_us = sum(us for name, us in self_times.items() if name.split('.')[0] == 'envycontrol')
+
+    assert out.strip() in ['integrated', 'hybrid', 'nvidia']
+    assert envycontrol_us < QUERY_IMPORT_BUDGET_US, f'{envycontrol_us}us spent importing envycontrol for --query'
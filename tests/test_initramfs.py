@@ -0,0 +1,146 @@
+import os
+import shutil
+
+import pytest
+
+import envycontrol.initramfs
+from envycontrol import BLACKLIST_PATH, PREFIX
+from envycontrol.initramfs import (hash_initramfs_inputs, read_initramfs_manifest,
+                                   read_kernel_statuses, rebuild_initramfs,
+                                   write_kernel_status)
+from envycontrol.target import set_root_dir
+from envycontrol.timings import TIMINGS_ENV, TIMINGS_PROFILE_ENV
+
+
+@pytest.fixture
+def initramfs_env(tmp_path, monkeypatch):
+    blacklist = tmp_path / 'blacklist-nvidia.conf'
+    commands = []
+    failing = set()
+
+    monkeypatch.setattr(envycontrol.initramfs, 'INITRAMFS_MANIFEST_PATH', str(tmp_path / 'initramfs.json'))
+    monkeypatch.setattr(envycontrol.initramfs, 'INITRAMFS_STATUS_DIR', str(tmp_path / 'initramfs'))
+    monkeypatch.setattr(envycontrol.initramfs, 'INITRAMFS_INPUT_PATHS', [str(blacklist)])
+    monkeypatch.setattr(envycontrol.initramfs, 'get_installed_kernels', lambda: ['6.1.0', '6.8.0'])
+    monkeypatch.setattr(envycontrol.initramfs, 'get_running_kernel', lambda: '6.8.0')
+    monkeypatch.setattr(envycontrol.initramfs, 'get_rebuild_commands',
+                        lambda kernels=None: [['true', kernel] for kernel in kernels or ['all']])
+
+    def run(command, **kwargs):
+        commands.append(command)
+        return type('CompletedProcess', (), {'returncode': 1 if command[-1] in failing else 0})
+
+    monkeypatch.setattr(envycontrol.initramfs.subprocess, 'run', run)
+    return blacklist, commands, failing
+
+
+def test_rebuild_should_skip_when_inputs_unchanged(initramfs_env):
+    blacklist, commands, _ = initramfs_env
+    blacklist.write_text('blacklist nouveau\n')
+
+    rebuild_initramfs()
+    rebuild_initramfs()
+
+    assert [['true', 'all']] == commands
+    assert {'6.1.0', '6.8.0'} == set(read_initramfs_manifest()['kernels'])
+
+
+def test_rebuild_should_only_touch_stale_kernels(initramfs_env):
+    blacklist, commands, _ = initramfs_env
+    blacklist.write_text('blacklist nouveau\n')
+    rebuild_initramfs()
+
+    blacklist.unlink()
+    rebuild_initramfs(running_kernel_only=True)
+    rebuild_initramfs()
+
+    assert [['true', 'all'], ['true', '6.8.0'], ['true', '6.1.0']] == commands
+    assert hash_initramfs_inputs() == read_initramfs_manifest()['kernels']['6.1.0']
+
+
+def test_rebuild_should_run_one_job_per_kernel_in_parallel(initramfs_env):
+    blacklist, commands, _ = initramfs_env
+    blacklist.write_text('blacklist nouveau\n')
+
+    rebuild_initramfs(jobs=2)
+
+    assert [['true', '6.1.0'], ['true', '6.8.0']] == sorted(commands)
+    assert [('6.1.0', 'succeeded'), ('6.8.0', 'succeeded')] == \
+        [(status['kernel'], status['state']) for status in read_kernel_statuses()]
+
+
+def test_rebuild_failure_should_not_hide_other_kernels(initramfs_env):
+    blacklist, commands, failing = initramfs_env
+    blacklist.write_text('blacklist nouveau\n')
+    failing.add('6.1.0')
+
+    rebuild_initramfs(jobs=2)
+
+    assert ['6.8.0'] == list(read_initramfs_manifest()['kernels'])
+    assert [('6.1.0', 'failed'), ('6.8.0', 'succeeded')] == \
+        [(status['kernel'], status['state']) for status in read_kernel_statuses()]
+
+    # only the failed kernel is retried
+    failing.clear()
+    commands.clear()
+    rebuild_initramfs(jobs=2)
+    assert [['true', '6.1.0']] == commands
+
+
+def test_read_kernel_statuses_should_mark_dead_rebuilds_interrupted(initramfs_env, monkeypatch):
+    write_kernel_status('6.1.0', state='running', pid=1)
+    write_kernel_status('6.8.0', state='queued', pid=2)
+    write_kernel_status('6.9.0', state='queued', pid=3)
+    monkeypatch.setattr(envycontrol.initramfs, 'is_process_alive', lambda pid: pid == 3)
+
+    assert [('6.1.0', 'interrupted'), ('6.8.0', 'interrupted'), ('6.9.0', 'queued')] == \
+        [(status['kernel'], status['state']) for status in read_kernel_statuses()]
+
+
+def test_detached_rebuild_should_leave_the_statuses_to_the_child(initramfs_env, monkeypatch):
+    blacklist, _, _ = initramfs_env
+    blacklist.write_text('blacklist nouveau\n')
+    monkeypatch.setenv(TIMINGS_ENV, 'timings.json')
+    monkeypatch.setenv(TIMINGS_PROFILE_ENV, 'profile.out')
+    spawned = []
+
+    def popen(argv, **kwargs):
+        if spawned:
+            raise OSError('out of processes')
+        spawned.append(kwargs['env'])
+        return type('Popen', (), {'pid': 1})
+
+    monkeypatch.setattr(envycontrol.initramfs.subprocess, 'Popen', popen)
+    rebuild_initramfs(detach=True)
+
+    assert [] == read_kernel_statuses()
+    assert TIMINGS_ENV not in spawned[0] and TIMINGS_PROFILE_ENV not in spawned[0]
+    assert 'PYTHONPATH' in spawned[0]
+
+    # a spawn that fails leaves nothing queued behind
+    rebuild_initramfs(detach=True)
+    assert [] == read_kernel_statuses()
+
+
+def test_rebuild_should_keep_its_state_under_root(initramfs_env, scratch_root, monkeypatch):
+    _, commands, _ = initramfs_env
+    monkeypatch.setattr(envycontrol.initramfs, 'INITRAMFS_MANIFEST_PATH', PREFIX + '/var/cache/envycontrol/initramfs.json')
+    monkeypatch.setattr(envycontrol.initramfs, 'INITRAMFS_STATUS_DIR', PREFIX + '/var/cache/envycontrol/initramfs')
+    monkeypatch.setattr(envycontrol.initramfs, 'INITRAMFS_INPUT_PATHS', [BLACKLIST_PATH])
+    shutil.copytree(PREFIX, 'image', symlinks=True)
+    image = os.path.abspath('image')
+    with open(os.path.join(image, os.path.relpath(BLACKLIST_PATH, PREFIX)), 'w') as f:
+        f.write('blacklist nouveau\n')
+
+    set_root_dir(image)
+    try:
+        rebuild_initramfs(jobs=2)
+        assert {'6.1.0', '6.8.0'} == set(read_initramfs_manifest()['kernels'])
+        assert ['6.1.0', '6.8.0'] == [status['kernel'] for status in read_kernel_statuses()]
+    finally:
+        set_root_dir(None)
+
+    assert os.path.exists(os.path.join(image, 'var/cache/envycontrol/initramfs.json'))
+    assert not os.path.exists(PREFIX + '/var/cache/envycontrol/initramfs.json')
+    assert not os.path.exists(PREFIX + '/var/cache/envycontrol/initramfs')
+    assert {} == read_initramfs_manifest()['kernels']
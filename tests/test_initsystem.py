@@ -0,0 +1,69 @@
+import os
+
+import pytest
+
+from envycontrol.initsystem import get_init_backend
+
+UNIT_CONTENT = '''[Unit]
+Description=NVIDIA Persistence Daemon
+
+[Service]
+ExecStart=/usr/bin/nvidia-persistenced
+
+[Install]
+WantedBy=multi-user.target graphical.target
+Alias=nvpd.service
+'''
+
+
+def write_file(path, content=''):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(content)
+
+
+def test_systemd_should_manage_install_symlinks(tmp_path) -> None:
+    root = str(tmp_path)
+    write_file(root + '/usr/lib/systemd/system/nvidia-persistenced.service', UNIT_CONTENT)
+    backend = get_init_backend('systemd', root)
+
+    assert not backend.is_enabled('nvidia-persistenced')
+    assert backend.set_enabled('nvidia-persistenced', True)
+    assert not backend.set_enabled('nvidia-persistenced', True)
+    assert backend.is_enabled('nvidia-persistenced')
+
+    wants = root + '/etc/systemd/system/multi-user.target.wants/nvidia-persistenced.service'
+    assert '/usr/lib/systemd/system/nvidia-persistenced.service' == os.readlink(wants)
+    assert os.path.islink(root + '/etc/systemd/system/graphical.target.wants/nvidia-persistenced.service')
+    assert os.path.islink(root + '/etc/systemd/system/nvpd.service')
+
+    assert backend.set_enabled('nvidia-persistenced', False)
+    assert not backend.set_enabled('nvidia-persistenced', False)
+    assert not os.path.lexists(wants)
+
+
+def test_systemd_should_fail_for_missing_unit(tmp_path) -> None:
+    with pytest.raises(FileNotFoundError):
+        get_init_backend('systemd', str(tmp_path)).set_enabled('nvidia-persistenced', True)
+
+
+def test_runit_should_link_into_runsvdir(tmp_path) -> None:
+    root = str(tmp_path)
+    write_file(root + '/etc/sv/nvidia-persistenced/run', '#!/bin/sh\n')
+    os.makedirs(root + '/var/service')
+    backend = get_init_backend('runit', root)
+
+    assert backend.set_enabled('nvidia-persistenced', True)
+    assert '/etc/sv/nvidia-persistenced' == os.readlink(root + '/var/service/nvidia-persistenced')
+    assert backend.set_enabled('nvidia-persistenced', False)
+    assert not backend.is_enabled('nvidia-persistenced')
+
+
+def test_dinit_should_link_into_boot_d(tmp_path) -> None:
+    root = str(tmp_path)
+    write_file(root + '/etc/dinit.d/nvidia-persistenced', 'type = process\n')
+    backend = get_init_backend('dinit', root)
+
+    assert backend.set_enabled('nvidia-persistenced', True)
+    assert '../nvidia-persistenced' == os.readlink(root + '/etc/dinit.d/boot.d/nvidia-persistenced')
+    assert backend.is_enabled('nvidia-persistenced')
@@ -0,0 +1,115 @@
+import os
+
+import pytest
+
+import envycontrol.staging
+from envycontrol import JOURNAL_PATH, XORG_PATH
+from envycontrol.backupstore import get_backup_store
+from envycontrol.initsystem import (NVIDIA_PERSISTENCED_SERVICE,
+                                    is_service_enabled)
+from envycontrol.journal import read_journal
+from envycontrol.manifest import check
+from envycontrol.query import get_current_mode, print_current_mode
+from envycontrol.staging import StagedChanges
+
+
+def interrupt_switch(run_main, monkeypatch, argv: list[str], writes: int) -> None:
+    '''Run a switch that is cut short after writes of the staged files; other state files are written as usual'''
+    write = StagedChanges._write
+    atomic_write = envycontrol.staging.atomic_write
+    calls = []
+
+    def interrupted(*args, **kwargs):
+        if len(calls) == writes:
+            raise KeyboardInterrupt()
+        calls.append(args[0])
+        atomic_write(*args, **kwargs)
+
+    def staged_write(self, *args):
+        envycontrol.staging.atomic_write = interrupted
+        try:
+            return write(self, *args)
+        finally:
+            envycontrol.staging.atomic_write = atomic_write
+
+    monkeypatch.setattr(StagedChanges, '_write', staged_write)
+    with pytest.raises(KeyboardInterrupt):
+        run_main(argv)
+    monkeypatch.setattr(StagedChanges, '_write', write)
+
+
+def test_interrupted_switch_should_be_rolled_forward(scratch_root, replay_hardware, monkeypatch, capsys, run_main) -> None:
+    replay_hardware('intel_nvidia_sddm')
+    interrupt_switch(run_main, monkeypatch, ['--switch', 'nvidia'], writes=1)
+
+    journal = read_journal()
+    assert 'nvidia' == journal['mode']
+    assert 'nvidia' != get_current_mode()
+    print_current_mode()
+    assert 'a switch was interrupted' in capsys.readouterr().err
+
+    run_main(['--recover'])
+
+    pending = len(journal['changes'])
+    assert f'rolled forward, {pending - 1} of {pending} file(s) were left to change' in capsys.readouterr().out
+    assert not os.path.exists(JOURNAL_PATH)
+    assert 'nvidia' == get_current_mode()
+    assert 0 == check()
+
+
+def test_switch_should_recover_first(scratch_root, replay_hardware, monkeypatch, capsys, run_main) -> None:
+    replay_hardware('intel_nvidia_sddm')
+    interrupt_switch(run_main, monkeypatch, ['--switch', 'integrated'], writes=1)
+
+    run_main(['--switch', 'hybrid'])
+
+    assert 'Recovered the interrupted switch to integrated' in capsys.readouterr().out
+    assert not os.path.exists(JOURNAL_PATH)
+    assert 'hybrid' == get_current_mode()
+
+
+def test_switch_should_be_rolled_back_without_its_contents(scratch_root, replay_hardware, monkeypatch,
+                                                           capsys, run_main) -> None:
+    replay_hardware('intel_nvidia_sddm')
+    interrupt_switch(run_main, monkeypatch, ['--switch', 'nvidia'], writes=1)
+
+    store = get_backup_store()
+    for entry in read_journal()['changes']:
+        if entry['path'] == XORG_PATH:
+            os.remove(store.get_object_path(entry['content']))
+
+    run_main(['--recover'])
+
+    assert 'rolled back' in capsys.readouterr().out
+    assert not os.path.exists(XORG_PATH)
+    assert 'hybrid' == get_current_mode()
+
+
+def test_service_change_should_be_rolled_back_with_the_files(scratch_root, replay_hardware, monkeypatch,
+                                                             capsys, run_main) -> None:
+    replay_hardware('intel_nvidia_sddm')
+    assert not is_service_enabled(NVIDIA_PERSISTENCED_SERVICE)
+
+    # cut short between the service change and the first file write
+    interrupt_switch(run_main, monkeypatch, ['--switch', 'nvidia'], writes=0)
+
+    journal = read_journal()
+    assert [[NVIDIA_PERSISTENCED_SERVICE, True, 'systemd']] == journal['services']
+    assert [False] == journal['services_before']
+    assert is_service_enabled(NVIDIA_PERSISTENCED_SERVICE)
+
+    store = get_backup_store()
+    for entry in journal['changes']:
+        if entry['path'] == XORG_PATH:
+            os.remove(store.get_object_path(entry['content']))
+
+    run_main(['--recover'])
+
+    assert 'rolled back' in capsys.readouterr().out
+    assert not is_service_enabled(NVIDIA_PERSISTENCED_SERVICE)
+
+
+def test_recover_should_report_nothing_to_do(scratch_root, capsys, run_main) -> None:
+    run_main(['--recover'])
+
+    assert 'No interrupted switch to recover\n' == capsys.readouterr().out
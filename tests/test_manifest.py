@@ -0,0 +1,74 @@
+import os
+import subprocess
+
+import pytest
+
+from envycontrol import BLACKLIST_PATH, MODESET_PATH, XORG_PATH
+from envycontrol.initsystem import NVIDIA_PERSISTENCED_SERVICE, get_init_backend
+from envycontrol.manifest import CHECK_DRIFT_EXIT, CHECK_NO_MANIFEST_EXIT
+
+
+def run_check(run_main, capsys) -> tuple[int, str]:
+    capsys.readouterr()
+    with pytest.raises(SystemExit) as e:
+        run_main(['--check'])
+    return e.value.code, capsys.readouterr().out
+
+
+def test_check_should_pass_after_switch(scratch_root, replay_hardware, capsys, run_main) -> None:
+    replay_hardware('intel_nvidia_sddm')
+    run_main(['--switch', 'nvidia'])
+
+    assert (0, 'In sync with nvidia mode\n') == run_check(run_main, capsys)
+
+
+def test_check_should_report_drift(scratch_root, replay_hardware, capsys, run_main) -> None:
+    replay_hardware('intel_nvidia_sddm')
+    run_main(['--switch', 'nvidia'])
+
+    with open(XORG_PATH, 'a', encoding='utf-8') as f:
+        f.write('# edited by hand\n')
+    os.remove(MODESET_PATH)
+    with open(BLACKLIST_PATH, 'w', encoding='utf-8') as f:
+        f.write('blacklist nvidia\n')
+    get_init_backend().set_enabled(NVIDIA_PERSISTENCED_SERVICE, False)
+
+    code, out = run_check(run_main, capsys)
+
+    assert CHECK_DRIFT_EXIT == code
+    assert 'Drifted from nvidia mode:' in out
+    assert f'modified    {XORG_PATH}' in out
+    assert f'missing     {MODESET_PATH}' in out
+    assert f'unexpected  {BLACKLIST_PATH}' in out
+    assert f'service     {NVIDIA_PERSISTENCED_SERVICE}' in out
+
+
+def test_check_should_report_mode_changes(scratch_root, replay_hardware, capsys, run_main) -> None:
+    replay_hardware('intel_nvidia_sddm')
+    run_main(['--switch', 'integrated'])
+    os.chmod(BLACKLIST_PATH, 0o600)
+
+    code, out = run_check(run_main, capsys)
+
+    assert CHECK_DRIFT_EXIT == code
+    assert f'mode        {BLACKLIST_PATH}: 0644 -> 0600' in out
+
+
+def test_check_should_need_a_switch(scratch_root, replay_hardware, capsys, run_main) -> None:
+    replay_hardware('intel_nvidia_sddm')
+    assert CHECK_NO_MANIFEST_EXIT == run_check(run_main, capsys)[0]
+
+    run_main(['--switch', 'hybrid'])
+    run_main(['--reset'])
+    assert CHECK_NO_MANIFEST_EXIT == run_check(run_main, capsys)[0]
+
+
+def test_check_should_not_spawn(scratch_root, replay_hardware, capsys, monkeypatch, run_main) -> None:
+    replay_hardware('intel_nvidia_sddm')
+    run_main(['--switch', 'nvidia'])
+
+    def fail(*args, **kwargs):
+        raise AssertionError('unexpected subprocess')
+
+    monkeypatch.setattr(subprocess.Popen, '__init__', fail)
+    assert 0 == run_check(run_main, capsys)[0]
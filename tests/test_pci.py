@@ -0,0 +1,53 @@
+import os
+from pathlib import Path
+
+import pytest
+
+from envycontrol.pci import (NVIDIA_VENDOR_ID, get_pci_devices,
+                             read_pci_device, scan_pci_devices)
+
+
+def make_pci_device(root, address: str, vendor: int, device: int, pci_class: int, driver: str | None = None) -> None:
+    path = root / address
+    path.mkdir(parents=True)
+    (path / 'vendor').write_text(f'0x{vendor:04x}\n')
+    (path / 'device').write_text(f'0x{device:04x}\n')
+    (path / 'class').write_text(f'0x{pci_class:06x}\n')
+    if driver:
+        os.symlink(f'../../../bus/pci/drivers/{driver}', path / 'driver')
+
+
+@pytest.fixture
+def sysfs_pci(tmp_path):
+    make_pci_device(tmp_path, '0000:00:02.0', 0x8086, 0x9a49, 0x030000, 'i915')
+    make_pci_device(tmp_path, '0000:00:14.0', 0x8086, 0xa0ed, 0x0c0330, 'xhci_hcd')
+    make_pci_device(tmp_path, '0000:01:00.0', 0x10de, 0x2520, 0x030200, 'nvidia')
+    make_pci_device(tmp_path, '0000:01:00.1', 0x10de, 0x228e, 0x040300)
+    return str(tmp_path)
+
+
+def test_read_pci_device_should_parse_sysfs_attributes(sysfs_pci):
+    device = read_pci_device(os.path.join(sysfs_pci, '0000:01:00.0'))
+
+    assert NVIDIA_VENDOR_ID == device.vendor
+    assert 0x2520 == device.device
+    assert 'nvidia' == device.driver
+    assert device.is_vga_or_3d
+    assert not device.is_vga_or_display
+    assert 'PCI:1:0:0' == device.bus_id
+
+
+def test_get_pci_devices_should_walk_once(sysfs_pci):
+    scan_pci_devices.cache_clear()
+
+    devices = get_pci_devices(sysfs_pci)
+    make_pci_device(Path(sysfs_pci), '0000:02:00.0', 0x10de, 0x1f9d, 0x030000)
+
+    assert devices is get_pci_devices(sysfs_pci)
+    assert ['0000:00:02.0', '0000:00:14.0', '0000:01:00.0', '0000:01:00.1'] == [d.address for d in devices]
+    assert [d.address for d in devices if d.is_display] == ['0000:00:02.0', '0000:01:00.0']
+    assert devices[3].driver is None
+
+
+def test_get_pci_devices_should_tolerate_missing_sysfs(tmp_path):
+    assert () == get_pci_devices(str(tmp_path / 'missing'))
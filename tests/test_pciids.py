@@ -0,0 +1,118 @@
+import mmap
+import os
+import shutil
+
+import pytest
+
+from envycontrol import MODESET_PATH
+from envycontrol.gpufamily import get_nvidia_architecture, supports_rtd3
+from envycontrol.pciids import (PCI_IDS_INDEX_PATH, get_device_name,
+                                get_pci_id_index, get_vendor_name)
+from envycontrol.replay import set_replay_dir
+from envycontrol.target import set_root_dir
+
+HARDWARE_FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'hardware')
+
+PCI_IDS = '''\
+# List of PCI ID's
+#
+10de  NVIDIA Corporation
+\t1c8d  GP107M [GeForce GTX 1050 Mobile]
+\t\t1028 07be  GeForce GTX 1050 Mobile
+\t2520  GA106M [GeForce RTX 3060 Mobile / Max-Q]
+8086  Intel Corporation
+\t9a49  TigerLake-LP GT2 [Iris Xe Graphics]
+
+# List of known device classes, subclasses and programming interfaces
+C 03  Display controller
+\t00  VGA compatible controller
+'''
+
+
+def write_pci_ids(root, content: str = PCI_IDS) -> str:
+    path = os.path.join(root, 'usr/share/hwdata/pci.ids')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(content)
+    return path
+
+
+@pytest.fixture
+def hardware(scratch_root):
+    '''A copy of the intel_nvidia_sddm fixture that can be changed'''
+    path = os.path.join(scratch_root, 'hardware')
+    shutil.copytree(os.path.join(HARDWARE_FIXTURES_DIR, 'intel_nvidia_sddm'), path, symlinks=True)
+    set_replay_dir(path)
+    yield path
+    set_replay_dir(None)
+
+
+def test_names_should_come_from_the_index(hardware) -> None:
+    write_pci_ids(hardware)
+
+    assert 'NVIDIA Corporation' == get_vendor_name(0x10de)
+    assert 'GA106M [GeForce RTX 3060 Mobile / Max-Q]' == get_device_name(0x10de, 0x2520)
+    assert 'TigerLake-LP GT2 [Iris Xe Graphics]' == get_device_name(0x8086, 0x9a49)
+    assert get_device_name(0x10de, 0x1028) is None  # a subsystem
+    assert get_device_name(0x1002, 0x1638) is None
+
+    assert os.path.exists(PCI_IDS_INDEX_PATH)
+    assert isinstance(get_pci_id_index().buffer, mmap.mmap)
+
+
+def test_index_should_stay_out_of_the_root(hardware) -> None:
+    write_pci_ids(hardware)
+    set_root_dir('image')
+    try:
+        assert 'NVIDIA Corporation' == get_vendor_name(0x10de)
+    finally:
+        set_root_dir(None)
+
+    assert os.path.exists(PCI_IDS_INDEX_PATH)
+    assert not os.path.exists('image')
+
+
+def test_index_should_be_rebuilt_when_pci_ids_changes(hardware) -> None:
+    path = write_pci_ids(hardware)
+    assert get_device_name(0x10de, 0x2560) is None
+
+    write_pci_ids(hardware, PCI_IDS.replace('8086  Intel', '\t2560  GA106M [GeForce RTX 3060 Laptop GPU]\n8086  Intel'))
+    os.utime(path, ns=(0, 0))
+    set_replay_dir(hardware)
+
+    assert 'GA106M [GeForce RTX 3060 Laptop GPU]' == get_device_name(0x10de, 0x2560)
+
+
+def test_names_should_be_unknown_without_pci_ids(hardware) -> None:
+    assert get_vendor_name(0x10de) is None
+    assert not os.path.exists(PCI_IDS_INDEX_PATH)
+
+
+@pytest.mark.parametrize('device, architecture', [
+    (0x1c8d, 'pascal'),
+    (0x1f95, 'turing'),
+    (0x2520, 'ampere'),
+    (0x28e0, 'ada'),
+    (0x1100, None),
+    (0x0001, None),
+])
+def test_nvidia_architecture_should_come_from_device_ranges(device: int, architecture: str) -> None:
+    assert architecture == get_nvidia_architecture(device)
+
+
+def test_rtd3_should_need_turing() -> None:
+    assert not supports_rtd3('pascal')
+    assert supports_rtd3('turing')
+    assert supports_rtd3('ada')
+
+
+def test_switch_should_refuse_rtd3_before_turing(hardware, run_main) -> None:
+    with open(os.path.join(hardware, 'sys/bus/pci/devices/0000:01:00.0/device'), 'w', encoding='utf-8') as f:
+        f.write('0x1c8d\n')
+
+    with pytest.raises(SystemExit):
+        run_main(['--switch', 'hybrid', '--rtd3'])
+    assert not os.path.exists(MODESET_PATH)
+
+    run_main(['--switch', 'hybrid'])
+    assert os.path.exists(MODESET_PATH)
@@ -0,0 +1,126 @@
+import json
+import os
+
+import pytest
+
+import envycontrol.utils
+from conftest import read_file
+from envycontrol import MODESET_PATH, SDDM_XSETUP_PATH, XORG_PATH
+from envycontrol.backupstore import BACKUP_STORE_DIR
+from envycontrol.plan import (PROFILE_OVERRIDES_DIR, get_stale_reason,
+                              load_profile, read_plan)
+
+
+def write_profile(name: str, profile: dict) -> None:
+    os.makedirs(PROFILE_OVERRIDES_DIR, exist_ok=True)
+    with open(os.path.join(PROFILE_OVERRIDES_DIR, name + '.json'), 'w', encoding='utf-8') as f:
+        json.dump(profile, f)
+
+
+def forbid_probing(monkeypatch) -> None:
+    def fail(*args, **kwargs):
+        raise AssertionError('unexpected probing')
+
+    monkeypatch.setattr(envycontrol.utils, 'get_probe_steps', fail)
+
+
+def test_switch_profile_should_match_legacy_switch(scratch_root, replay_hardware, run_main) -> None:
+    replay_hardware('intel_nvidia_sddm')
+    write_profile('mine', {'switch': 'nvidia', 'coolbits': 24, 'force_comp': True})
+
+    run_main(['--switch', 'nvidia', '--coolbits', '24', '--force-comp'])
+    expected = {path: read_file(path) for path in [XORG_PATH, MODESET_PATH, SDDM_XSETUP_PATH]}
+    run_main(['--reset'])
+
+    run_main(['switch', '--profile', 'mine'])
+
+    assert expected == {path: read_file(path) for path in expected}
+
+
+def test_stored_plan_should_apply_without_probing(scratch_root, replay_hardware, monkeypatch, run_main) -> None:
+    replay_hardware('intel_nvidia_sddm')
+    write_profile('mine', {'switch': 'nvidia'})
+    run_main(['plan', '--profile', 'mine'])
+    assert get_stale_reason(read_plan('mine')) is None
+
+    forbid_probing(monkeypatch)
+    run_main(['switch', '--profile', 'mine'])
+
+    assert 'BusID "PCI:1:0:0"' in read_file(XORG_PATH)
+
+
+def test_toggling_profiles_should_restore_xsetup(scratch_root, replay_hardware, monkeypatch, run_main) -> None:
+    replay_hardware('intel_nvidia_sddm')
+    os.makedirs(os.path.dirname(SDDM_XSETUP_PATH), exist_ok=True)
+    with open(SDDM_XSETUP_PATH, 'w', encoding='utf-8') as f:
+        f.write('#!/bin/sh\n# original\n')
+
+    write_profile('nv', {'switch': 'nvidia'})
+    write_profile('hy', {'switch': 'hybrid'})
+    run_main(['plan', '--profile', 'nv'])
+    run_main(['plan', '--profile', 'hy'])
+
+    forbid_probing(monkeypatch)
+    for _ in range(2):
+        run_main(['switch', '--profile', 'nv'])
+        assert 'xrandr' in read_file(SDDM_XSETUP_PATH)
+        assert not os.path.exists(SDDM_XSETUP_PATH + '.bak')
+
+        run_main(['switch', '--profile', 'hy'])
+        assert '#!/bin/sh\n# original\n' == read_file(SDDM_XSETUP_PATH)
+        assert not os.path.exists(SDDM_XSETUP_PATH + '.bak')
+
+
+def test_plan_should_leave_the_backup_store_alone(scratch_root, replay_hardware, run_main) -> None:
+    replay_hardware('intel_nvidia_sddm')
+    os.makedirs(os.path.dirname(SDDM_XSETUP_PATH), exist_ok=True)
+    with open(SDDM_XSETUP_PATH + '.bak', 'w', encoding='utf-8') as f:
+        f.write('#!/bin/sh\n# original\n')
+    write_profile('nv', {'switch': 'nvidia'})
+
+    run_main(['plan', '--profile', 'nv'])
+
+    assert not os.path.exists(BACKUP_STORE_DIR)
+    assert os.path.exists(SDDM_XSETUP_PATH + '.bak')
+
+
+def test_plan_should_go_stale_on_input_changes(scratch_root, replay_hardware, run_main) -> None:
+    replay_hardware('intel_nvidia_sddm')
+    write_profile('mine', {'switch': 'hybrid'})
+    run_main(['plan', '--profile', 'mine'])
+
+    write_profile('mine', {'switch': 'hybrid', 'rtd3': 2})
+    assert get_stale_reason(read_plan('mine')).startswith('changed')
+    run_main(['plan', '--profile', 'mine'])
+
+    replay_hardware('amd_nvidia_lightdm')
+    assert get_stale_reason(read_plan('mine')).startswith('hardware changed')
+
+
+@pytest.mark.parametrize('profile, message', [
+    ({'switch': 'discrete'}, "'switch'"),
+    ({'switch': 'nvidia', 'dm': 'xdm'}, "'dm'"),
+    ({'switch': 'hybrid', 'rtd3': 9}, "'rtd3'"),
+    ({'switch': 'hybrid', 'gpu': 'nvidia'}, 'unknown option'),
+])
+def test_invalid_profile_should_raise(scratch_root, profile, message) -> None:
+    write_profile('bad', profile)
+
+    with pytest.raises(ValueError, match=message):
+        load_profile('bad')
+
+
+@pytest.mark.parametrize('name', ['../../../etc/envycontrol/profiles/mine', 'profiles/mine', '.mine', ''])
+def test_profile_outside_its_directory_should_be_rejected(scratch_root, run_main, name) -> None:
+    write_profile('mine', {'switch': 'hybrid'})
+
+    with pytest.raises(ValueError, match='Invalid profile name'):
+        load_profile(name)
+    with pytest.raises(SystemExit) as e:
+        run_main(['plan', '--profile', name])
+    assert 2 == e.value.code
+
+
+def test_shipped_profiles_should_load() -> None:
+    assert 2 == load_profile('hybrid_rtd3')['rtd3']
+    assert 28 == load_profile('nvidia_coolbits')['coolbits']
@@ -0,0 +1,75 @@
+import json
+import os
+
+import pytest
+
+from envycontrol import power
+from envycontrol.power import (PowerMonitor, PowerSample,
+                               get_nvidia_device_path, get_suspended_ratio,
+                               watch)
+from envycontrol.status import status_main
+
+
+def write_power(device_path, status: str, suspended_ms: int, active_ms: int) -> None:
+    os.makedirs(os.path.join(device_path, 'power'), exist_ok=True)
+    for attribute, value in [('power/runtime_status', status), ('power/runtime_suspended_time', suspended_ms),
+                             ('power/runtime_active_time', active_ms),
+                             ('power_state', 'D3cold' if status == 'suspended' else 'D0')]:
+        with open(os.path.join(device_path, attribute), 'w', encoding='utf-8') as f:
+            f.write(f'{value}\n')
+
+
+def test_monitor_should_reread_open_attributes(tmp_path) -> None:
+    write_power(str(tmp_path), 'active', 0, 100)
+
+    with PowerMonitor(str(tmp_path)) as monitor:
+        sample = monitor.sample()
+        assert ('active', 'D0', 0, 100, None) == (sample.runtime_status, sample.power_state, sample.suspended_ms,
+                                                  sample.active_ms, sample.wakeup_count)
+
+        write_power(str(tmp_path), 'suspended', 900, 100)
+        sample = monitor.sample()
+        assert ('suspended', 'D3cold', 900) == (sample.runtime_status, sample.power_state, sample.suspended_ms)
+
+
+def test_suspended_ratio_should_cover_the_time_between_samples() -> None:
+    start = PowerSample(0, 'active', 'D0', 1000, 1000, None)
+
+    assert 0.75 == get_suspended_ratio(start, PowerSample(1, 'suspended', 'D3cold', 1750, 1250, None))
+    assert get_suspended_ratio(start, start) is None
+    assert get_suspended_ratio(start, PowerSample(1, None, None, None, None, None)) is None
+
+
+def test_watch_should_stream_samples_and_count_wakeups(tmp_path, monkeypatch, capsys) -> None:
+    device_path = str(tmp_path)
+    states = iter([('suspended', 900, 100), ('active', 900, 200), ('suspended', 1800, 300)])
+    write_power(device_path, 'suspended', 0, 100)
+    monkeypatch.setattr(power.time, 'sleep', lambda seconds: write_power(device_path, *next(states)))
+
+    watch(device_path, interval=0.01, count=3, as_json=True)
+
+    samples = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert ['suspended', 'active', 'suspended'] == [sample['runtime_status'] for sample in samples]
+    assert [1.0, 0.0, 0.9] == [sample['suspended_ratio'] for sample in samples]
+    assert 0.9 == samples[-1]['overall_suspended_ratio']
+    assert [0, 1, 1] == [sample['wakeups'] for sample in samples]
+
+
+def test_watch_should_read_the_nvidia_gpu(replay_hardware, capsys) -> None:
+    replay_hardware('intel_nvidia_sddm')
+    device_path = get_nvidia_device_path()
+    assert device_path.endswith('0000:01:00.0')
+
+    watch(device_path, interval=0.01, count=1)
+
+    lines = capsys.readouterr().out.splitlines()
+    assert 'suspended   D3cold' in lines[2]
+    assert lines[-1].startswith('suspended - of 0s, 0 wakeup(s); monitor CPU')
+
+
+def test_status_watch_should_fail_without_nvidia_gpu(monkeypatch) -> None:
+    monkeypatch.setattr('envycontrol.power.get_display_devices', lambda: ())
+
+    with pytest.raises(SystemExit) as e:
+        status_main(['--watch', '--count', '1'])
+    assert 1 == e.value.code
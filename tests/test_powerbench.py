@@ -0,0 +1,91 @@
+import json
+import os
+import sys
+
+import pytest
+
+from envycontrol import powerbench
+from envycontrol.bench import bench_main
+from envycontrol.powerbench import get_batteries, run_power_bench
+from envycontrol.replay import set_replay_dir
+
+
+def write_supply(root, name: str, **attributes) -> None:
+    path = os.path.join(root, 'sys/class/power_supply', name)
+    os.makedirs(path, exist_ok=True)
+    for attribute, value in attributes.items():
+        with open(os.path.join(path, attribute), 'w', encoding='utf-8') as f:
+            f.write(f'{value}\n')
+
+
+@pytest.fixture
+def power_supply(tmp_path):
+    root = str(tmp_path / 'fixture')
+    write_supply(root, 'AC', type='Mains', online=0)
+    write_supply(root, 'BAT0', type='Battery', status='Discharging', power_now=10_000_000, energy_now=50_000_000,
+                 current_now=800_000, model_name='5B10W13930')
+    # reports current and voltage only
+    write_supply(root, 'BAT1', type='Battery', status='Discharging', current_now=500_000, voltage_now=12_000_000)
+    set_replay_dir(root)
+    yield root
+    set_replay_dir(None)
+
+
+def test_batteries_should_skip_other_supplies(power_supply) -> None:
+    batteries = get_batteries()
+
+    assert ['BAT0', 'BAT1'] == [battery.name for battery in batteries]
+    assert (6.0, None, 0.5) == batteries[1].sample()
+
+
+def test_power_bench_should_sample_and_summarize(power_supply, scratch_root, monkeypatch) -> None:
+    drain = iter([(12_000_000, 49_990_000), (14_000_000, 49_980_000)])
+    clock = [100.0]
+
+    def sleep(seconds):
+        clock[0] += seconds
+        power_now, energy_now = next(drain)
+        write_supply(power_supply, 'BAT0', power_now=power_now, energy_now=energy_now)
+
+    monkeypatch.setattr(powerbench.time, 'sleep', sleep)
+    monkeypatch.setattr(powerbench.time, 'monotonic', lambda: clock[0])
+
+    results = run_power_bench(duration=1.0, interval=0.5, label='hybrid-rtd3-2')
+
+    assert [[0.0, 16.0, 50.0, 1.3], [0.5, 18.0, 49.99, 1.3], [1.0, 20.0, 49.98, 1.3]] == \
+        [[round(value, 6) for value in sample] for sample in results['samples']]
+    assert {'min': 16.0, 'mean': 18.0, 'p50': 18.0, 'p90': 19.6, 'max': 20.0} == \
+        {key: round(value, 6) for key, value in results['summary']['power_w'].items()}
+    assert 0.02 == pytest.approx(results['summary']['energy_used_wh'])
+    assert ('hybrid-rtd3-2', 'hybrid') == (results['label'], results['mode'])
+    assert '5B10W13930' == results['batteries'][0]['model_name']
+
+
+def test_power_bench_should_run_the_workload(power_supply, scratch_root) -> None:
+    results = run_power_bench(interval=0.05, workload=[sys.executable, '-c', 'raise SystemExit(3)'])
+
+    assert 3 == results['window']['workload_exit_status']
+    assert results['summary']['samples'] >= 1
+
+
+def test_power_bench_should_fail_on_a_missing_workload(power_supply, scratch_root, caplog) -> None:
+    with pytest.raises(SystemExit) as e:
+        bench_main(['power', '--replay', power_supply, '--', 'no-such-workload'])
+
+    assert 1 == e.value.code
+    assert "Could not run 'no-such-workload'" in caplog.text
+
+
+def test_compare_should_print_drain_relative_to_first(tmp_path, capsys) -> None:
+    paths = []
+    for label, mean in [('integrated', 5.0), ('hybrid', 6.0)]:
+        path = tmp_path / f'{label}.json'
+        path.write_text(json.dumps({'label': label, 'mode': label, 'machine': {'hostname': 'x1'},
+                                    'summary': {'power_w': {'mean': mean, 'p50': mean, 'p90': mean}}}))
+        paths.append(str(path))
+
+    bench_main(['power', '--compare', *paths])
+
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[1].endswith('+0.0%')
+    assert lines[2].startswith('hybrid') and lines[2].endswith('+20.0%')
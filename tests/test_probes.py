@@ -0,0 +1,76 @@
+import sys
+import threading
+import time
+
+import envycontrol.utils
+from envycontrol.hardware import HardwareContext
+from envycontrol.initramfs import run_command
+from envycontrol.probes import (PROBE_FAILED, PROBE_OK, PROBE_TIMED_OUT,
+                                ProbeExecutor, get_remaining_time)
+
+
+def test_probes_should_run_concurrently() -> None:
+    barrier = threading.Barrier(2, timeout=5)
+
+    def probe(name):
+        barrier.wait()  # only passes when both probes run at once
+        return name
+
+    results = ProbeExecutor(timeout=5).run({'a': lambda: probe('a'), 'b': lambda: probe('b')})
+
+    assert {'a': 'a', 'b': 'b'} == {name: result.value for name, result in results.items()}
+
+
+def test_hung_probe_should_time_out_without_delaying_others() -> None:
+    release = threading.Event()
+    started = time.monotonic()
+
+    results = ProbeExecutor(timeout=0.2).run({'hung': release.wait, 'fast': lambda: 1})
+    release.set()
+
+    assert time.monotonic() - started < 1
+    assert (PROBE_TIMED_OUT, None) == (results['hung'].status, results['hung'].value)
+    assert (PROBE_OK, 1) == (results['fast'].status, results['fast'].value)
+
+
+def test_failing_probes_should_be_unknown() -> None:
+    def fail():
+        raise OSError('no such device')
+
+    results = ProbeExecutor().run({'raise': fail, 'exit': lambda: sys.exit(1)})
+
+    assert [PROBE_FAILED, PROBE_FAILED] == [result.status for result in results.values()]
+    assert 'OSError: no such device' == results['raise'].error
+
+
+def test_probe_results_should_be_memoized() -> None:
+    calls = []
+    probes = ProbeExecutor()
+
+    for _ in range(3):
+        assert 'x' == probes.probe('x', lambda: calls.append(1) or 'x').value
+
+    assert 1 == len(calls)
+
+
+def test_commands_should_be_killed_at_the_deadline() -> None:
+    started = time.monotonic()
+    exit_codes = []
+
+    ProbeExecutor(timeout=0.5).probe(
+        'sleep', lambda: exit_codes.append(run_command([sys.executable, '-c', 'import time; time.sleep(30)'])))
+    while not exit_codes and time.monotonic() - started < 5:
+        time.sleep(0.01)
+
+    assert [None] == exit_codes
+    assert time.monotonic() - started < 5
+    assert get_remaining_time() is None
+
+
+def test_hardware_facts_should_be_unknown_when_probe_hangs(monkeypatch) -> None:
+    release = threading.Event()
+    monkeypatch.setattr(envycontrol.utils, 'get_display_manager', release.wait)
+
+    hw = HardwareContext(probes=ProbeExecutor(timeout=0.2))
+    assert hw.get('display_manager') is None
+    release.set()
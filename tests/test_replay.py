@@ -0,0 +1,102 @@
+import os
+
+import pytest
+
+from conftest import HARDWARE_FIXTURES
+from envycontrol import (LIGHTDM_SCRIPT_PATH, PREFIX, SDDM_XSETUP_PATH,
+                         XORG_PATH)
+from envycontrol.initsystem import NVIDIA_PERSISTENCED_SERVICE, get_init_backend
+from envycontrol.pci import get_pci_devices
+from envycontrol.replay import capture, set_replay_dir
+from envycontrol.utils import (get_current_mode, get_display_manager,
+                               get_igpu_vendor, get_nvidia_gpu_pci_bus)
+
+SWITCH_MATRIX = [
+    (['--switch', 'integrated'], 'integrated'),
+    (['--switch', 'hybrid'], 'hybrid'),
+    (['--switch', 'hybrid', '--rtd3'], 'hybrid'),
+    (['--switch', 'nvidia'], 'nvidia'),
+    (['--switch', 'nvidia', '--coolbits', '--force-comp'], 'nvidia'),
+    (['--switch', 'nvidia', '--dm', 'gdm'], 'nvidia'),
+]
+
+
+def read_tree(root: str) -> dict[str, str]:
+    rc = {}
+    for dir_path, _, file_names in os.walk(root):
+        for file_name in file_names:
+            path = os.path.join(dir_path, file_name)
+            # caches are not part of the switch result
+            if not os.path.relpath(path, root).startswith(PREFIX + '/var/cache/'):
+                with open(path, 'r', encoding='utf-8') as f:
+                    rc[os.path.relpath(path, root)] = f.read()
+    return rc
+
+
+def test_detectors_should_answer_from_replay(replay_hardware) -> None:
+    replay_hardware('intel_nvidia_sddm')
+    assert 'PCI:1:0:0' == get_nvidia_gpu_pci_bus()
+    assert 'intel' == get_igpu_vendor()
+    assert 'sddm' == get_display_manager()
+
+    replay_hardware('amd_nvidia_lightdm')
+    assert 'amd' == get_igpu_vendor()
+    assert 'lightdm' == get_display_manager()
+
+
+@pytest.mark.parametrize('hardware', HARDWARE_FIXTURES)
+@pytest.mark.parametrize('argv, mode', SWITCH_MATRIX)
+def test_switch_matrix_should_run_without_gpu(scratch_root, replay_hardware, hardware, argv, mode, run_main) -> None:
+    replay_hardware(hardware)
+
+    run_main(argv)
+
+    assert mode == get_current_mode()
+
+
+def test_switch_nvidia_should_configure_detected_display_manager(scratch_root, replay_hardware, run_main) -> None:
+    replay_hardware('intel_nvidia_sddm')
+    run_main(['--switch', 'nvidia'])
+
+    with open(XORG_PATH, 'r', encoding='utf-8') as f:
+        assert 'BusID "PCI:1:0:0"' in f.read()
+    assert os.access(SDDM_XSETUP_PATH, os.X_OK)
+    assert not os.path.exists(LIGHTDM_SCRIPT_PATH)
+
+
+def test_switch_should_be_repeatable(tmp_path, monkeypatch, replay_hardware, run_main) -> None:
+    replay_hardware('amd_nvidia_lightdm')
+
+    trees = []
+    for run in ['first', 'second']:
+        os.makedirs(tmp_path / run / PREFIX)
+        monkeypatch.chdir(tmp_path / run)
+        run_main(['--switch', 'nvidia', '--coolbits'])
+        trees.append(read_tree(str(tmp_path / run)))
+
+    assert trees[0] == trees[1]
+
+
+def test_capture_should_round_trip_pci_inventory(tmp_path) -> None:
+    set_replay_dir(None)
+    live = get_pci_devices()
+    if not live:
+        pytest.skip('no PCI devices in sysfs')
+
+    capture(str(tmp_path / 'fixture'))
+    set_replay_dir(str(tmp_path / 'fixture'))
+    try:
+        assert live == get_pci_devices()
+    finally:
+        set_replay_dir(None)
+
+
+def test_switch_should_manage_services_under_root(scratch_root, replay_hardware, run_main) -> None:
+    replay_hardware('intel_nvidia_sddm')
+    backend = get_init_backend('systemd')
+
+    run_main(['--switch', 'hybrid'])
+    assert backend.is_enabled(NVIDIA_PERSISTENCED_SERVICE)
+
+    run_main(['--switch', 'integrated'])
+    assert not backend.is_enabled(NVIDIA_PERSISTENCED_SERVICE)
@@ -0,0 +1,116 @@
+import json
+import os
+import shutil
+import threading
+
+import pytest
+
+from envycontrol import (BLACKLIST_PATH, CACHE_FILE_PATH, PREFIX,
+                         QUERY_SOCKET_PATH, XORG_PATH)
+from envycontrol.daemon import QueryDaemon, daemon_main
+from envycontrol.query import ask_daemon
+from envycontrol.target import set_root_dir, target_path
+
+REPLAY_DIR = os.path.join(os.path.dirname(__file__), 'fixtures', 'hardware', 'intel_nvidia_sddm')
+
+
+@pytest.fixture
+def image_roots(scratch_root):
+    '''Copies of the sysroot standing in for OS images'''
+    roots = []
+    for name in ['image1', 'image2']:
+        shutil.copytree(PREFIX, name, symlinks=True)
+        roots.append(os.path.abspath(name))
+    yield roots
+    set_root_dir(None)
+
+
+def in_root(root: str, path: str) -> str:
+    return os.path.join(root, os.path.relpath(path, PREFIX))
+
+
+def test_target_path_should_map_prefix_paths() -> None:
+    set_root_dir('/images/a')
+    try:
+        assert '/images/a/etc/X11/xorg.conf' == target_path(XORG_PATH)
+        assert '/proc/sys/kernel/osrelease' == target_path('/proc/sys/kernel/osrelease')
+    finally:
+        set_root_dir(None)
+
+    assert XORG_PATH == target_path(XORG_PATH)
+
+
+def test_switch_should_only_touch_root(image_roots, replay_hardware, capsys, run_main) -> None:
+    replay_hardware('intel_nvidia_sddm')
+    image1, image2 = image_roots
+
+    run_main(['--root', image1, '--switch', 'integrated'])
+    set_root_dir(None)
+
+    assert os.path.exists(in_root(image1, BLACKLIST_PATH))
+    assert not os.path.exists(in_root(image2, BLACKLIST_PATH))
+    assert not os.path.exists(BLACKLIST_PATH)
+
+    capsys.readouterr()
+    run_main(['--root', image1, '--query'])
+    set_root_dir(None)
+    run_main(['--query'])
+    assert ['integrated', 'hybrid'] == capsys.readouterr().out.split()
+
+
+def test_daemon_should_listen_under_root(image_roots, monkeypatch) -> None:
+    image1, _ = image_roots
+    set_root_dir(image1)
+    answers = []
+
+    def serve_forever(daemon):
+        thread = threading.Thread(target=serve, args=(daemon,))
+        thread.start()
+        while not daemon.running:
+            pass
+        answers.append(ask_daemon('mode'))
+        daemon.shutdown()
+        thread.join()
+
+    serve = QueryDaemon.serve_forever
+    monkeypatch.setattr(QueryDaemon, 'serve_forever', serve_forever)
+    monkeypatch.setattr('signal.signal', lambda signum, handler: None)
+
+    daemon_main([])
+
+    assert ['hybrid'] == answers
+    assert not os.path.exists(QUERY_SOCKET_PATH)
+
+
+def test_batch_should_apply_to_every_root(image_roots, capsys, run_main) -> None:
+    report_path = os.path.abspath('report.json')
+
+    run_main(['batch', *[f'--root={root}' for root in image_roots], '--jobs', '2', '--replay', REPLAY_DIR,
+              '--report', report_path, '--', '--switch', 'nvidia'])
+
+    with open(report_path, 'r', encoding='utf-8') as f:
+        report = json.load(f)
+    assert image_roots == [result['root'] for result in report['roots']]
+    assert [0, 0] == [result['exit_status'] for result in report['roots']]
+    for root in image_roots:
+        assert 'BusID "PCI:1:0:0"' in open(in_root(root, XORG_PATH), encoding='utf-8').read()
+    assert not os.path.exists(XORG_PATH)
+    assert '2 of 2 root(s) switched' in capsys.readouterr().out
+
+
+def test_batch_should_report_failed_roots(image_roots, run_main) -> None:
+    image1, image2 = image_roots
+    cache_path = in_root(image2, CACHE_FILE_PATH)
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    with open(cache_path, 'w', encoding='utf-8') as f:
+        f.write('not json')
+
+    with pytest.raises(SystemExit) as e:
+        run_main(['batch', '--root', image1, '--root', image2, '--replay', REPLAY_DIR, '--report', 'report.json',
+                  '--', '--switch', 'hybrid'])
+    assert 1 == e.value.code
+
+    with open('report.json', 'r', encoding='utf-8') as f:
+        report = json.load(f)
+    assert [0, 1] == [result['exit_status'] for result in report['roots']]
+    assert 'JSONDecodeError' in report['roots'][1]['output']
@@ -0,0 +1,106 @@
+import pytest
+
+import envycontrol.rulesengine
+from envycontrol.rulesengine import (SHIPPED_RULES_DIR, RuleContext, RuleError,
+                                     RulesEngine)
+from envycontrol.staging import StagedChanges
+
+RULE = '''MATCH = {match}
+
+
+def apply(ctx):
+    ctx.changes.write(ctx.facts['out'] + '/{name}', '{name}')
+'''
+
+EXPLODING_RULE = '''raise RuntimeError('must not be imported')
+MATCH = {'mode': 'integrated'}
+'''
+
+
+@pytest.fixture
+def rule_dirs(tmp_path):
+    overrides = tmp_path / 'etc'
+    shipped = tmp_path / 'shipped'
+    (shipped / 'sddm').mkdir(parents=True)
+    (shipped / 'nvidia.py').write_text(RULE.format(match="{'mode': 'nvidia'}", name='nvidia'))
+    (shipped / 'nvidia_intel.py').write_text(RULE.format(match="{'mode': 'nvidia', 'igpu': ['intel']}", name='intel'))
+    (shipped / 'sddm' / 'nvidia.py').write_text(RULE.format(match="{'mode': 'nvidia'}", name='sddm'))
+    (shipped / 'integrated.py').write_text(EXPLODING_RULE)
+
+    def new_engine():
+        return RulesEngine([str(overrides), str(shipped)], str(tmp_path / 'rules.json'), str(tmp_path / 'bytecode'))
+
+    return overrides, shipped, new_engine
+
+
+def new_context(tmp_path, mode='nvidia', dm='sddm', igpu='intel'):
+    return RuleContext(mode=mode, dm=dm, init='systemd', igpu=igpu, changes=StagedChanges(), facts={'out': str(tmp_path)})
+
+
+def test_only_matching_rules_should_run(tmp_path, rule_dirs):
+    _, _, new_engine = rule_dirs
+    ctx = new_context(tmp_path)
+
+    assert ['nvidia', 'nvidia_intel', 'sddm/nvidia'] == new_engine().run(ctx)
+    assert 'intel' == ctx.changes.read(str(tmp_path / 'intel'))
+
+    assert ['nvidia'] == new_engine().find_rules({'mode': 'nvidia', 'dm': 'lightdm', 'init': 'systemd', 'igpu': 'amd'})
+
+
+def test_override_should_replace_shipped_rule(tmp_path, rule_dirs):
+    overrides, _, new_engine = rule_dirs
+    (overrides / 'sddm').mkdir(parents=True)
+    (overrides / 'sddm' / 'nvidia.py').write_text(RULE.format(match="{'mode': 'nvidia'}", name='mine'))
+    ctx = new_context(tmp_path)
+
+    new_engine().run(ctx)
+
+    assert 'mine' == ctx.changes.read(str(tmp_path / 'mine'))
+    assert ctx.changes.read(str(tmp_path / 'sddm')) is None
+
+
+def test_cached_index_should_not_compile_sources(tmp_path, rule_dirs, monkeypatch):
+    _, shipped, new_engine = rule_dirs
+    new_engine().run(new_context(tmp_path))
+
+    def fail(*args, **kwargs):
+        raise AssertionError('unexpected compile')
+
+    monkeypatch.setattr(envycontrol.rulesengine, 'compile', fail, raising=False)
+    engine = new_engine()
+    assert ['nvidia', 'nvidia_intel', 'sddm/nvidia'] == engine.run(new_context(tmp_path))
+    assert not engine.dirty
+
+    # an edit in place is picked up even though the directory did not change
+    monkeypatch.undo()
+    (shipped / 'nvidia_intel.py').write_text(RULE.format(match="{'mode': 'nvidia', 'igpu': 'amd'}", name='intel'))
+    assert ['nvidia', 'sddm/nvidia'] == new_engine().run(new_context(tmp_path))
+
+
+def test_failing_rule_should_raise_rule_error(tmp_path, rule_dirs):
+    _, shipped, new_engine = rule_dirs
+    (shipped / 'nvidia.py').write_text("MATCH = {'mode': 'nvidia'}\n\n\ndef apply(ctx):\n    raise KeyError('boom')\n")
+
+    with pytest.raises(RuleError, match="Rule 'nvidia' failed"):
+        new_engine().run(new_context(tmp_path))
+
+
+def test_unknown_match_key_should_raise_rule_error(tmp_path, rule_dirs):
+    _, shipped, new_engine = rule_dirs
+    (shipped / 'nvidia.py').write_text("MATCH = {'gpu': 'nvidia'}\n")
+
+    with pytest.raises(RuleError, match='unknown key'):
+        new_engine().find_rules({})
+
+
+@pytest.mark.parametrize('mode, dm, igpu, expected', [
+    ('integrated', None, None, ['integrated']),
+    ('hybrid', None, None, ['hybrid']),
+    ('nvidia', 'gdm', 'amd', ['nvidia', 'nvidia_amd']),
+    ('nvidia', 'lightdm', 'intel', ['lightdm/nvidia', 'nvidia', 'nvidia_intel']),
+    ('nvidia', 'sddm', 'intel', ['nvidia', 'nvidia_intel', 'sddm/nvidia']),
+])
+def test_shipped_rules_should_match(tmp_path, mode, dm, igpu, expected):
+    engine = RulesEngine([SHIPPED_RULES_DIR], str(tmp_path / 'rules.json'), str(tmp_path / 'bytecode'))
+
+    assert expected == engine.find_rules({'mode': mode, 'dm': dm, 'init': 'systemd', 'igpu': igpu})
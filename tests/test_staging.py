@@ -0,0 +1,66 @@
+import os
+import stat
+
+from envycontrol.staging import StagedChanges
+
+
+def test_apply_should_skip_unchanged_files(tmp_path):
+    path = str(tmp_path / 'etc' / 'unchanged.conf')
+    changes = StagedChanges()
+    changes.write(path, 'same\n')
+    assert [path] == changes.apply()
+    inode = os.stat(path).st_ino
+
+    changes.write(path, 'same\n')
+    assert [] == changes.apply()
+    assert inode == os.stat(path).st_ino
+
+
+def test_apply_should_replace_changed_files(tmp_path):
+    path = str(tmp_path / 'changed.conf')
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('old\n')
+
+    changes = StagedChanges()
+    changes.write(path, 'new\n')
+    assert [path] == changes.apply()
+
+    with open(path, 'r', encoding='utf-8') as f:
+        assert 'new\n' == f.read()
+    assert ['changed.conf'] == os.listdir(tmp_path)  # no temp files left behind
+
+
+def test_apply_should_set_executable_in_process(tmp_path):
+    path = str(tmp_path / 'script.sh')
+    changes = StagedChanges()
+    changes.write(path, '#!/bin/sh\n')
+    changes.apply()
+    assert not os.stat(path).st_mode & stat.S_IXUSR
+
+    changes.write(path, '#!/bin/sh\n', True)
+    assert [path] == changes.apply()
+    assert os.stat(path).st_mode & stat.S_IXUSR
+
+
+def test_last_staged_operation_wins(tmp_path):
+    keep = str(tmp_path / 'keep.conf')
+    gone = str(tmp_path / 'gone.conf')
+    with open(gone, 'w', encoding='utf-8') as f:
+        f.write('gone\n')
+
+    changes = StagedChanges()
+    changes.remove(keep)
+    changes.write(keep, 'kept\n')
+    changes.remove(gone)
+
+    assert 'kept\n' == changes.read(keep)
+    assert changes.read(gone) is None
+    assert [keep, gone] == changes.apply()
+    assert os.path.exists(keep)
+    assert not os.path.exists(gone)
+
+
+def test_removing_missing_file_is_not_a_change(tmp_path):
+    changes = StagedChanges()
+    changes.remove(str(tmp_path / 'missing.conf'))
+    assert [] == changes.apply()
@@ -0,0 +1,48 @@
+import threading
+
+import pytest
+
+from envycontrol.steps import Step, StepError, run_steps
+
+
+def test_run_steps_should_pass_dependency_results() -> None:
+    results = run_steps([
+        Step('total', lambda a, b: a + b, deps=['a', 'b']),
+        Step('a', lambda: 1),
+        Step('b', lambda: 2),
+    ])
+
+    assert {'a': 1, 'b': 2, 'total': 3} == results
+
+
+def test_run_steps_should_overlap_independent_steps() -> None:
+    barrier = threading.Barrier(2, timeout=5)
+
+    # deadlocks (and times out) unless both steps run at the same time
+    results = run_steps([
+        Step('probe', lambda: barrier.wait() is not None),
+        Step('service', lambda: barrier.wait() is not None),
+    ])
+
+    assert {'probe': True, 'service': True} == results
+
+
+def test_run_steps_should_report_failed_branch() -> None:
+    def fail():
+        raise SystemExit(1)
+
+    with pytest.raises(StepError) as e:
+        run_steps([
+            Step('probe', fail),
+            Step('render', lambda probe: probe, deps=['probe']),
+            Step('service', lambda: True),
+        ])
+
+    assert ['probe'] == list(e.value.failures)
+    assert isinstance(e.value.failures['probe'], SystemExit)
+    assert ['render'] == e.value.skipped
+
+
+def test_run_steps_should_reject_unknown_dependency() -> None:
+    with pytest.raises(ValueError):
+        run_steps([Step('render', lambda probe: probe, deps=['probe'])])
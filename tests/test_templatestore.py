@@ -0,0 +1,90 @@
+import os
+
+import pytest
+
+from envycontrol.templatestore import SHIPPED_TEMPLATES_DIR, TemplateStore
+
+
+@pytest.fixture
+def template_dirs(tmp_path):
+    overrides = tmp_path / 'etc'
+    shipped = tmp_path / 'shipped'
+    (shipped / 'xorg').mkdir(parents=True)
+    (shipped / 'xorg' / 'intel.conf').write_text('BusID "${bus_id}"\n')
+    (shipped / 'modprobe.conf').write_text('options nvidia\n')
+
+    def new_store():
+        return TemplateStore([str(overrides), str(shipped)], str(tmp_path / 'templates.json'))
+
+    return overrides, shipped, new_store
+
+
+def touch(path, mtime_ns):
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_shipped_templates_should_render():
+    store = TemplateStore([SHIPPED_TEMPLATES_DIR], '/nonexistent/templates.json')
+
+    assert 'options nvidia-current "NVreg_DynamicPowerManagement=0x02"' in \
+        store.render('modprobe/nvidia-rtd3.conf', module='nvidia-current', rtd3=2)
+    assert 'xrandr --setprovideroutputsource "modesetting" NVIDIA-0' in \
+        store.render('xrandr/nvidia.sh', provider='modesetting')
+
+
+def test_override_should_win_over_shipped(template_dirs):
+    overrides, _, new_store = template_dirs
+    (overrides / 'xorg').mkdir(parents=True)
+    (overrides / 'xorg' / 'intel.conf').write_text('# mine\nBusID "${bus_id}" $$HOME $USER\n')
+
+    store = new_store()
+
+    assert '# mine\nBusID "PCI:1:0:0" $HOME $USER\n' == store.render('xorg/intel.conf', bus_id='PCI:1:0:0')
+    assert 'options nvidia\n' == store.render('modprobe.conf')
+
+
+def test_edit_should_invalidate_compiled_template(template_dirs):
+    _, shipped, new_store = template_dirs
+    store = new_store()
+    first = store.get('xorg/intel.conf')
+
+    # touched but unchanged keeps the compiled template
+    touch(shipped / 'xorg' / 'intel.conf', 1_000_000_000)
+    assert first is store.get('xorg/intel.conf')
+
+    (shipped / 'xorg' / 'intel.conf').write_text('BusID "${bus_id}" # edited\n')
+    assert 'BusID "PCI:1:0:0" # edited\n' == store.render('xorg/intel.conf', bus_id='PCI:1:0:0')
+
+
+def test_saved_index_should_skip_scan_and_reads(template_dirs, monkeypatch):
+    _, _, new_store = template_dirs
+    store = new_store()
+    expected = store.render('xorg/intel.conf', bus_id='PCI:1:0:0')
+    store.save()
+
+    def fail(*args, **kwargs):
+        raise AssertionError('unexpected walk')
+
+    monkeypatch.setattr(os, 'walk', fail)
+    store = new_store()
+    assert expected == store.render('xorg/intel.conf', bus_id='PCI:1:0:0')
+    assert not store.dirty
+
+
+def test_new_override_should_be_found_after_save(template_dirs):
+    overrides, _, new_store = template_dirs
+    store = new_store()
+    store.render('modprobe.conf')
+    store.save()
+
+    overrides.mkdir()
+    (overrides / 'modprobe.conf').write_text('options nvidia-current\n')
+
+    assert 'options nvidia-current\n' == new_store().render('modprobe.conf')
+
+
+def test_missing_template_should_raise(template_dirs):
+    _, _, new_store = template_dirs
+
+    with pytest.raises(FileNotFoundError):
+        new_store().get('nope.conf')
@@ -0,0 +1,75 @@
+import json
+import pstats
+import sys
+
+import pytest
+
+from envycontrol import XORG_PATH
+from envycontrol.initramfs import run_command
+from envycontrol.timings import pop_timings_options, recording, span
+
+
+def read_json(path: str) -> dict:
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def test_timings_should_record_phases_steps_and_files(scratch_root, replay_hardware, run_main) -> None:
+    replay_hardware('intel_nvidia_sddm')
+
+    run_main(['--switch', 'nvidia', '--timings', 'timings.json'])
+
+    timings = read_json('timings.json')
+    names = {(event['category'], event['name']) for event in timings['events']}
+    assert {('phase', 'cache'), ('phase', 'probe'), ('phase', 'cleanup'), ('phase', 'rules'),
+            ('phase', 'apply')} <= names
+    assert ('step', 'nvidia_gpu_pci_bus') in names
+    assert ('service', 'nvidia-persistenced') in names
+
+    writes = [event for event in timings['events'] if event['category'] == 'file' and event['name'] == XORG_PATH]
+    assert [{'op': 'write', 'changed': True}] == [event['args'] for event in writes]
+    assert ['--switch', 'nvidia'] == timings['argv']
+    assert 1 == timings['summary']['invocation']['count']
+
+
+def test_timings_should_write_chrome_trace_and_profile(scratch_root, replay_hardware, monkeypatch, run_main) -> None:
+    replay_hardware('intel_nvidia_sddm')
+    monkeypatch.setenv('ENVYCONTROL_TIMINGS', 'trace.json')
+    monkeypatch.setenv('ENVYCONTROL_TIMINGS_FORMAT', 'trace')
+
+    run_main(['--switch', 'integrated', '--timings-profile', 'switch.prof'])
+
+    trace = read_json('trace.json')
+    complete = [event for event in trace['traceEvents'] if event['ph'] == 'X']
+    assert 'envycontrol' == complete[0]['name']
+    assert all(event['dur'] >= 0 and 'cpu_ms' in event['args'] for event in complete)
+    assert pstats.Stats('switch.prof').total_calls > 0
+
+
+def test_command_spans_should_record_exit_code(tmp_path) -> None:
+    with recording(str(tmp_path / 'timings.json'), []):
+        assert 3 == run_command([sys.executable, '-c', 'raise SystemExit(3)'], str(tmp_path / 'command.log'))
+
+    commands = [event for event in read_json(str(tmp_path / 'timings.json'))['events']
+                if event['category'] == 'command']
+    assert 3 == commands[0]['args']['exit_code']
+
+
+def test_span_should_be_noop_without_recording() -> None:
+    with span('phase', 'x', a=1) as args:
+        args['b'] = 2
+
+    assert {'a': 1, 'b': 2} == args
+
+
+def test_pop_timings_options_should_leave_other_options() -> None:
+    path, fmt, profile_path, argv = pop_timings_options(['-s', 'nvidia', '--timings=t.json', '--timings-format', 'trace'])
+
+    assert ('t.json', 'trace', None) == (path, fmt, profile_path)
+    assert ['-s', 'nvidia'] == argv
+
+    with pytest.raises(ValueError):
+        pop_timings_options(['--timings-format', 'xml'])
+    for argv in [['--switch', 'hybrid', '--timings'], ['--timings-format']]:
+        with pytest.raises(ValueError, match=f'{argv[-1]} needs a value'):
+            pop_timings_options(argv)
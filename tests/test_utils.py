@@ -1,16 +1,16 @@
 
-
 import envycontrol
+from envycontrol.pci import PciDevice
 from envycontrol.utils import get_igpu_bus_pci_bus
 
 
 def test_get_igpu_bus_pci_bus_should_return_formatted(monkeypatch):
     def mockreturn():
-        return [
-            '0000:00:02.0  Intel '
-        ]
+        return (
+            PciDevice(address='0000:00:02.0', vendor=0x8086, device=0x9a49, pci_class=0x030000, driver='i915'),
+        )
 
-    monkeypatch.setattr(envycontrol.utils, "get_lspci_lines", mockreturn)
+    monkeypatch.setattr(envycontrol.utils, "get_display_devices", mockreturn)
 
     id = get_igpu_bus_pci_bus()
 